@@ -0,0 +1,103 @@
+"""
+Archiving of old loans, and reading loan history across both tables.
+
+Returned loans whose checkout and return are both older than
+``TRANSACTION_ARCHIVE_AFTER_DAYS`` move from ``Transaction`` to
+``ArchivedTransaction`` (``manage.py archive_transactions``). Each batch is
+copied and deleted in one transaction, so an interrupted run leaves no loan
+in both tables or in neither, and the next run just carries on. The live
+table keeps open and recent loans only, so its open-loan index stays small
+and hot.
+
+History reads go through ``LoanHistory``, which runs each query against
+both tables and combines them with ``UNION ALL``. Loans keep their id when
+archived, so cursors and ``/transactions/<id>/`` links stay valid.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ArchivedTransaction, Transaction
+
+ARCHIVED_FIELDS = [field.attname for field in ArchivedTransaction._meta.concrete_fields]
+
+
+def archive_horizon(now=None):
+    """Loans returned before this are archived."""
+    return (now or timezone.now()) - timedelta(days=getattr(settings, 'TRANSACTION_ARCHIVE_AFTER_DAYS', 365))
+
+
+def archivable(before):
+    # checkout_date is indexed; a loan returned before the horizon was also checked out before it
+    return Transaction.objects.filter(checkout_date__lt=before, return_date__lt=before)
+
+
+def archive_returned_loans(before=None, batch_size=1000):
+    """Move returned loans older than ``before`` to the archive in batches; return how many moved."""
+    before = before or archive_horizon()
+    total, last_pk = 0, 0
+    while True:
+        with transaction.atomic():
+            # Returned loans are never written again, so they need no row locks
+            loans = list(archivable(before).filter(pk__gt=last_pk).order_by('pk').values_list(*ARCHIVED_FIELDS)[:batch_size])
+            if not loans:
+                return total
+            ArchivedTransaction.objects.bulk_create(ArchivedTransaction(**dict(zip(ARCHIVED_FIELDS, loan))) for loan in loans)
+            Transaction.objects.filter(pk__in=[loan[0] for loan in loans]).delete()
+        total += len(loans)
+        last_pk = loans[-1][0]
+
+
+class LoanHistory:
+    """
+    Live and archived loans, queried as one.
+
+    Supports what history views need from a QuerySet: ``filter``,
+    ``order_by``, ``values_list``, slicing and ``get``. Filters apply to both
+    tables, so each side still uses its own indexes. Rows come back as
+    ``Transaction`` instances (or tuples after ``values_list``).
+    """
+    model = Transaction
+
+    def __init__(self, live=None, archived=None, ordering=()):
+        self.live = Transaction.objects.all() if live is None else live
+        self.archived = ArchivedTransaction.objects.all() if archived is None else archived
+        self.ordering = ordering
+
+    def filter(self, *args, **kwargs):
+        return LoanHistory(self.live.filter(*args, **kwargs), self.archived.filter(*args, **kwargs), self.ordering)
+
+    def order_by(self, *ordering):
+        # The combined query orders by column name, and 'pk' is not one
+        return LoanHistory(self.live, self.archived, tuple({'pk': 'id', '-pk': '-id'}.get(name, name) for name in ordering))
+
+    def values_list(self, *fields, **kwargs):
+        return LoanHistory(self.live.values_list(*fields, **kwargs), self.archived.values_list(*fields, **kwargs), self.ordering)
+
+    def none(self):
+        return LoanHistory(self.live.none(), self.archived.none(), self.ordering)
+
+    def _combined(self, stop=None):
+        live, archived = self.live.order_by(), self.archived.order_by()
+        if stop is not None and connection.features.supports_slicing_ordering_in_compound:
+            # Neither side can contribute more than `stop` rows (MySQL; SQLite cannot limit the parts)
+            live, archived = live.order_by(*self.ordering)[:stop], archived.order_by(*self.ordering)[:stop]
+        return live.union(archived, all=True).order_by(*self.ordering)
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            raise TypeError("LoanHistory supports slicing only.")
+        return self._combined(k.stop)[k]
+
+    def __iter__(self):
+        return iter(self._combined())
+
+    def get(self, **kwargs):
+        rows = list(self.filter(**kwargs)[:2])
+        if not rows:
+            raise Transaction.DoesNotExist("Transaction matching query does not exist.")
+        if len(rows) > 1:
+            raise Transaction.MultipleObjectsReturned("get() returned more than one Transaction.")
+        return rows[0]
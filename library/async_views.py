@@ -0,0 +1,185 @@
+"""
+Async-native read endpoints for the catalogue, served under ``/api/async/``.
+
+DRF viewsets are sync-only, so under ASGI each of their requests hops onto a
+worker thread. These plain Django async views cover the read-heavy paths
+(available listing, book detail, search). JWT validation and the permission
+check run on the event loop: the token is verified in-process and the
+principal comes from the shared principal cache, with a single async ORM
+query on a miss. Responses match the DRF endpoints' JSON. The available
+listing is keyset-paginated with ``?after=<last id>``.
+
+``feed`` is a server-sent event stream of ``copies_available`` changes for
+the books in ``?books=1,2,3``, fed by ``library.feed``. Clients subscribe
+once instead of polling the available listing.
+
+Django 5.1's async ORM still runs each query in a thread internally, so the
+gain is in everything around the query; it grows as Django adds native
+async database drivers.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import conditional
+from .authentication import principal_cache
+from .feed import availability_feed
+from .models import Book, normalize_isbn
+from . import routers
+from .search import book_index
+from .serializers import BookSerializer
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def _error(detail, status):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+async def authenticate(request):
+    """Return the active user for the request's Bearer token, or None."""
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0] not in api_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        token = AccessToken(header[1])
+    except TokenError:
+        return None
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    user = principal_cache.get(user_id)
+    if user is None:
+        try:
+            # From the primary, as in library.authentication
+            user = await User.objects.using(DEFAULT_DB_ALIAS).select_related('libraryuser').aget(**{api_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            return None
+        principal_cache.put(user_id, user)
+    if not user.is_active:
+        return None
+    return user
+
+
+def authenticated(view):
+    """Async counterpart of ``permission_classes = [IsAuthenticated]``."""
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return _error('Method "%s" not allowed.' % request.method, 405)
+        request.user = await authenticate(request)
+        if request.user is None:
+            return _error("Authentication credentials were not provided or are invalid.", 401)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _int_param(request, name, default, minimum, maximum):
+    try:
+        return min(max(int(request.GET.get(name, default)), minimum), maximum)
+    except ValueError:
+        return default
+
+
+@authenticated
+async def available(request):
+    after = _int_param(request, 'after', 0, 0, 2 ** 63 - 1)
+    etag, last_modified = await sync_to_async(conditional.catalogue_validators)(request, after)
+    unchanged = conditional.not_modified(request, etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+
+    books = Book.objects.filter(copies_available__gt=0).order_by('id')
+    if request.GET.get('title'):
+        books = books.filter(title__icontains=request.GET['title'])
+    if request.GET.get('author'):
+        books = books.filter(author__icontains=request.GET['author'])
+    if request.GET.get('isbn'):
+        books = books.filter(isbn=normalize_isbn(request.GET['isbn']))
+    if after:
+        books = books.filter(id__gt=after)
+
+    page_size = _int_param(request, 'page_size', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    page = [book async for book in books[:page_size + 1]]
+    results = BookSerializer(page[:page_size], many=True).data
+    next_url = None
+    if len(page) > page_size:
+        params = request.GET.copy()
+        params['after'] = page[page_size - 1].pk
+        next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+    response = JsonResponse({'next': next_url, 'results': results})
+    if routers.used_replica():
+        return response  # A lagging replica's rows must not be tagged with the primary's validators
+    return conditional.set_validators(response, etag, last_modified)
+
+
+@authenticated
+async def book_detail(request, pk):
+    try:
+        book = await Book.objects.aget(pk=pk)
+    except Book.DoesNotExist:
+        return _error("No Book matches the given query.", 404)
+    etag, last_modified = conditional.book_validators(book)
+    unchanged = conditional.not_modified(request, etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+    return conditional.set_validators(JsonResponse(BookSerializer(book).data), etag, last_modified)
+
+
+@authenticated
+async def search(request):
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'q': ["This field is required."]}, status=400)
+    limit = _int_param(request, 'limit', 20, 1, 100)
+
+    if not book_index.is_built:
+        await sync_to_async(book_index.ensure_fresh)()  # First build reads the table
+    else:
+        book_index.ensure_fresh()  # Later refreshes run in a background thread
+
+    hits = book_index.search(query, limit)
+    books = await Book.objects.ain_bulk([book_id for book_id, _ in hits])
+    results = [books[book_id] for book_id, _ in hits if book_id in books]
+    return JsonResponse(BookSerializer(results, many=True).data, safe=False)
+
+
+@authenticated
+async def feed(request):
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the stream would hold a worker for as long as the client stays
+        return _error("The availability feed is only served over ASGI.", 501)
+    try:
+        book_ids = {int(value) for value in request.GET.get('books', '').split(',') if value.strip()}
+    except ValueError:
+        return JsonResponse({'books': ["Expected comma-separated book ids."]}, status=400)
+    max_books = getattr(settings, 'FEED_MAX_BOOKS', 100)
+    if not book_ids or len(book_ids) > max_books:
+        return JsonResponse({'books': [f"Give between 1 and {max_books} book ids."]}, status=400)
+
+    async def events():
+        subscription = await availability_feed.subscribe(book_ids)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                changes = await subscription.next(getattr(settings, 'FEED_KEEPALIVE_SECONDS', 15))
+                if not changes:
+                    yield ': keepalive\n\n'  # Stops proxies from closing an idle stream
+                    continue
+                yield ''.join(
+                    'event: availability\ndata: %s\n\n' % json.dumps({'id': book_id, 'copies_available': copies})
+                    for book_id, copies in changes.items()
+                )
+        finally:
+            availability_feed.unsubscribe(subscription)  # Runs when the client disconnects
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+    return response
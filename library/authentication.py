@@ -0,0 +1,94 @@
+"""
+JWT authentication that resolves the user, and their LibraryUser profile,
+from a short-lived in-process cache.
+
+A cache miss costs one joined query; a hit costs none. Entries expire after
+``AUTH_PRINCIPAL_CACHE_TTL`` seconds and are dropped as soon as this process
+saves or deletes the User or its profile (see ``library.signals``), so a
+deactivated user is locked out within the TTL even when another worker made
+the change.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from . import metrics
+
+
+class PrincipalCache:
+    """Bounded LRU of user id -> (expiry, User with its profile loaded)."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < now:
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+        # Each request gets its own copy, so per-request changes never leak
+        return copy.copy(entry[1])
+
+    def put(self, user_id, user):
+        ttl = getattr(settings, 'AUTH_PRINCIPAL_CACHE_TTL', 30)
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + ttl, copy.copy(user))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > getattr(settings, 'AUTH_PRINCIPAL_CACHE_SIZE', 10000):
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+principal_cache = PrincipalCache()
+metrics.register('auth_principal_cache', principal_cache.stats)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication whose user lookup goes through ``principal_cache``."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = principal_cache.get(user_id)
+        if user is None:
+            try:
+                # The profile rides along so request.user.libraryuser costs nothing. Read
+                # from the primary: a replica may not have a just-registered user yet.
+                user = User.objects.using(DEFAULT_DB_ALIAS).select_related('libraryuser').get(**{api_settings.USER_ID_FIELD: user_id})
+            except User.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            principal_cache.put(user_id, user)
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
@@ -0,0 +1,189 @@
+"""
+Helpers shared by the benchmark management commands: seeding a local database
+with a synthetic catalogue and summarising latency samples.
+
+Seeding is top-up: running a benchmark twice against the same database only
+creates the rows that are missing.
+"""
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .models import Book, LibraryUser, RevokedToken, Transaction
+
+BENCH_USER_PREFIX = 'bench-'
+BENCH_PASSWORD = 'bench-password-123'
+BENCH_ISBN_PREFIX = 'B'
+BENCH_JTI_PREFIX = 'bench'
+
+
+def _batches(start, stop, size):
+    for lower in range(start, stop, size):
+        yield range(lower, min(lower + size, stop))
+
+
+@contextmanager
+def _without_auto_now_add(model, field_name):
+    # Seeded loans need historical checkout dates, which auto_now_add would overwrite
+    field = model._meta.get_field(field_name)
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+@contextmanager
+def without_throttling():
+    """Lift the per-endpoint rate limits and DB-latency load shedding, so a load test measures the endpoints."""
+    from .throttling import SlidingWindowThrottle
+
+    rates = SlidingWindowThrottle.THROTTLE_RATES
+    SlidingWindowThrottle.THROTTLE_RATES = dict.fromkeys(rates)  # None: unlimited
+    try:
+        with override_settings(DB_LATENCY_SHED_MS=None):
+            yield
+    finally:
+        SlidingWindowThrottle.THROTTLE_RATES = rates
+
+
+def seed_books(count, batch_size=5000):
+    """Ensure ``count`` benchmark books exist; returns how many were created."""
+    existing = Book.objects.filter(isbn__startswith=BENCH_ISBN_PREFIX).count()
+    rng = random.Random(existing)
+    for batch in _batches(existing, count, batch_size):
+        Book.objects.bulk_create(
+            Book(
+                title=f"Book {i} {rng.choice(('history', 'garden', 'python', 'ocean', 'music'))}",
+                author=f"Author {i % 5000}",
+                isbn=f"{BENCH_ISBN_PREFIX}{i:012d}",
+                published_date=date(1950, 1, 1) + timedelta(days=i % 25000),
+                copies_available=rng.randint(0, 5),
+            )
+            for i in batch
+        )
+    return max(count - existing, 0)
+
+
+def seed_users(count, batch_size=2000):
+    """Ensure ``count`` benchmark patrons exist, all sharing ``BENCH_PASSWORD``."""
+    existing = User.objects.filter(username__startswith=BENCH_USER_PREFIX).count()
+    password = make_password(BENCH_PASSWORD)  # Hashed once, not once per user
+    for batch in _batches(existing, count, batch_size):
+        usernames = [f"{BENCH_USER_PREFIX}{i}" for i in batch]
+        # bulk_create skips the post_save signal, so profiles are created here
+        User.objects.bulk_create(User(username=name, password=password) for name in usernames)
+        LibraryUser.objects.bulk_create(
+            LibraryUser(user_id=pk)
+            for pk in User.objects.filter(username__in=usernames).values_list('pk', flat=True)
+        )
+    return max(count - existing, 0)
+
+
+def seed_transactions(count, open_ratio=0.05, batch_size=10000):
+    """Ensure ``count`` loans exist between benchmark patrons and books.
+
+    Most loans are returned and spread over the last two years; about
+    ``open_ratio`` of them are open, each on a distinct (user, book) pair.
+    """
+    existing = Transaction.objects.count()
+    if existing >= count:
+        return 0
+    book_ids = list(Book.objects.filter(isbn__startswith=BENCH_ISBN_PREFIX).values_list('pk', flat=True))
+    user_ids = list(LibraryUser.objects.filter(
+        user__username__startswith=BENCH_USER_PREFIX).values_list('pk', flat=True))
+    if not book_ids or not user_ids:
+        raise ValueError("Seed books and users before transactions.")
+
+    rng = random.Random(existing)
+    now = timezone.now()
+    open_every = max(int(1 / open_ratio), 1) if open_ratio else 0
+    open_pairs = Transaction.objects.filter(return_date__isnull=True).count()
+    with _without_auto_now_add(Transaction, 'checkout_date'):
+        for batch in _batches(existing, count, batch_size):
+            loans = []
+            for i in batch:
+                if open_every and i % open_every == 0 and open_pairs < len(user_ids) * len(book_ids):
+                    # Walk (user, book) pairs in order so open loans never collide
+                    user_id = user_ids[open_pairs % len(user_ids)]
+                    book_id = book_ids[(open_pairs // len(user_ids)) % len(book_ids)]
+                    open_pairs += 1
+                    checkout = now - timedelta(days=rng.randint(0, 30))
+                    loans.append(Transaction(user_id=user_id, book_id=book_id, checkout_date=checkout))
+                    continue
+                checkout = now - timedelta(days=rng.randint(31, 730), seconds=rng.randint(0, 86400))
+                loans.append(Transaction(
+                    user_id=rng.choice(user_ids), book_id=rng.choice(book_ids),
+                    checkout_date=checkout, return_date=checkout + timedelta(days=rng.randint(1, 30)),
+                ))
+            Transaction.objects.bulk_create(loans, ignore_conflicts=True)
+    return count - existing
+
+
+def seed_token_history(count, token_text, batch_size=10000):
+    """Ensure ``count`` rotated-out refresh tokens exist in both revocation stores.
+
+    One copy goes to simplejwt's OutstandingToken/BlacklistedToken tables, with
+    ``token_text`` as the stored token, and one to RevokedToken. Expiries are
+    spread over the last 30 days and the next day, as in an unpruned store.
+    """
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+    existing = RevokedToken.objects.filter(jti__startswith=BENCH_JTI_PREFIX).count()
+    rng = random.Random(existing)
+    now = timezone.now()
+    for batch in _batches(existing, count, batch_size):
+        rows = [(f"{BENCH_JTI_PREFIX}{i:027d}", now + timedelta(seconds=rng.randint(-30 * 86400, 86400))) for i in batch]
+        RevokedToken.objects.bulk_create(RevokedToken(jti=jti, expires_at=expires_at) for jti, expires_at in rows)
+        OutstandingToken.objects.bulk_create(
+            OutstandingToken(jti=jti, token=token_text, created_at=expires_at - timedelta(days=1), expires_at=expires_at)
+            for jti, expires_at in rows
+        )
+        BlacklistedToken.objects.bulk_create(
+            BlacklistedToken(token_id=pk)
+            for pk in OutstandingToken.objects.filter(jti__in=[jti for jti, _ in rows]).values_list('pk', flat=True)
+        )
+    return max(count - existing, 0)
+
+
+# Transaction bookkeeping, not work done for the request
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+
+
+def count_queries(captured):
+    """Statements in a ``CaptureQueriesContext``, leaving out transaction control."""
+    return sum(1 for query in captured.captured_queries if not query['sql'].startswith(TRANSACTION_CONTROL))
+
+
+def timed(func, *args, **kwargs):
+    """Call ``func`` and return ``(result, elapsed_seconds)``."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_samples) - 1))), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    ordered = sorted(samples)
+    count = len(ordered)
+    return {
+        'count': count,
+        'mean_ms': round(sum(ordered) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3) if count else 0.0,
+    }
@@ -0,0 +1,152 @@
+"""
+Response cache for the available-books listing, validated against shared
+per-segment change counters.
+
+Every committed change to a book bumps the ``CatalogueSegment`` row that
+covers its id (``catalogue_versions.bump``, called from ``books_changed``).
+The counters live in the database, so every worker sees every write.
+
+A cached page records the id span it covers, from its cursor to its last
+book (or to the end of the catalogue when it is the last page), and the
+counters of the segments in that span as they were before the page was
+read. A hit costs one small aggregate over those segments and is served only
+when they have not moved. So a checkout of book 5 invalidates the pages
+that cover book 5, not every cached page.
+
+Entries live in the Django cache named by ``AVAILABLE_CACHE_ALIAS``, so the
+backend is pluggable through ``settings.CACHES``: the bounded LRU below,
+``FileBasedCache`` or ``RedisCache``. A per-worker backend only costs hit
+rate, never freshness.
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from . import metrics
+from .models import CatalogueSegment
+
+
+class CountingLocMemCache(LocMemCache):
+    """LocMemCache (an LRU bounded by ``MAX_ENTRIES``) that counts evictions."""
+
+    evictions = 0
+
+    def _cull(self):
+        before = len(self._cache)
+        super()._cull()
+        CountingLocMemCache.evictions += before - len(self._cache)
+
+
+def segment_of(book_id):
+    return book_id // CatalogueSegment.SIZE
+
+
+def _span(segments, after, through):
+    # Segments holding the book ids in (after, through]; open-ended when through is None
+    if after is not None:
+        segments = segments.filter(pk__gte=segment_of(after + 1))
+    if through is not None:
+        segments = segments.filter(pk__lte=segment_of(through))
+    return segments
+
+
+class CatalogueVersions:
+    def bump(self, book_ids):
+        """Record that ``book_ids`` changed. Call after the change has committed."""
+        segments = {segment_of(book_id) for book_id in book_ids}
+        if not segments:
+            return
+        now = timezone.now()
+        bumped = CatalogueSegment.objects.filter(pk__in=segments).update(generation=F('generation') + 1, changed_at=now)
+        if bumped < len(segments):
+            # First change in a block of ids
+            existing = set(CatalogueSegment.objects.filter(pk__in=segments).values_list('pk', flat=True))
+            for segment in segments - existing:
+                try:
+                    with transaction.atomic():
+                        CatalogueSegment.objects.create(pk=segment, generation=1, changed_at=now)
+                except IntegrityError:  # Created concurrently; still count this change
+                    CatalogueSegment.objects.filter(pk=segment).update(generation=F('generation') + 1, changed_at=now)
+
+    def stamp(self, after=None, through=None):
+        """``(generation total, last change time)`` of the books with ids in (after, through]."""
+        totals = _span(CatalogueSegment.objects.all(), after, through).aggregate(
+            generation=Sum('generation'), changed_at=Max('changed_at')
+        )
+        return totals['generation'] or 0, totals['changed_at']
+
+    def snapshot(self, after=None):
+        """Per-segment ``{id: (generation, changed_at)}`` for ids above ``after``; read before a page, narrowed after it."""
+        return {
+            pk: (generation, changed_at)
+            for pk, generation, changed_at in _span(CatalogueSegment.objects.all(), after, None).values_list(
+                'pk', 'generation', 'changed_at'
+            )
+        }
+
+    def narrow(self, snapshot, through):
+        """The ``stamp`` of ``snapshot`` restricted to ids up to ``through`` (None: no limit)."""
+        rows = [row for pk, row in snapshot.items() if through is None or pk <= segment_of(through)]
+        return sum(generation for generation, _ in rows), max((changed_at for _, changed_at in rows), default=None)
+
+
+catalogue_versions = CatalogueVersions()
+
+
+class VersionedResponseCache:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.stale = 0
+
+    @property
+    def backend(self):
+        return caches[getattr(settings, 'AVAILABLE_CACHE_ALIAS', 'default')]
+
+    def key(self, request, params):
+        """Cache key for ``params``, a dict of normalized filters."""
+        filters = '&'.join(f'{name}={value}' for name, value in sorted(params.items()) if value not in (None, ''))
+        digest = hashlib.sha1(f'{request.get_host()}?{filters}'.encode()).hexdigest()
+        return f'{self.prefix}:{digest}'
+
+    def get(self, key, after=None):
+        """Return ``(data, stamp)`` if the page at ``key`` is cached and its books are unchanged, else None."""
+        entry = self.backend.get(key)
+        stamp = None
+        if entry is not None:
+            stamp = catalogue_versions.stamp(after, entry['through'])
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            elif stamp != entry['stamp']:
+                self.stale += 1
+            else:
+                self.hits += 1
+                return entry['data'], stamp
+        return None
+
+    def set(self, key, data, stamp, through):
+        """Cache a page covering ids up to ``through`` (None: the rest of the catalogue), read at ``stamp``."""
+        self.backend.set(
+            key, {'data': data, 'stamp': stamp, 'through': through},
+            timeout=getattr(settings, 'AVAILABLE_CACHE_TIMEOUT', 300),
+        )
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,  # Found, but books it covers changed since
+            # Only the bundled LRU backend can report evictions
+            'evictions': CountingLocMemCache.evictions,
+        }
+
+
+available_cache = VersionedResponseCache('available')
+metrics.register('available_cache', available_cache.stats)
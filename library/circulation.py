@@ -0,0 +1,271 @@
+"""Checkout/return engine for book copies.
+
+Every inventory change is a conditional UPDATE evaluated by the database, so
+concurrent requests can never oversell a title or lose a returned copy. The
+happy path of each operation costs two queries inside one transaction, and
+the batch variants cost a constant number of queries whatever the batch size.
+
+A copy returned while holds are waiting (``Book.holds_waiting`` > 0) is lent
+straight to the head of the book's hold queue instead of going back on the
+shelf. Write paths lock the Book row before any Hold rows, so returns, hold
+placement, cancellation and the expiry sweep cannot deadlock each other.
+
+Loans are also counted on both sides: ``LibraryUser.open_loans`` and
+``Book.times_circulated`` move in the same transaction as the Transaction
+rows, which lets ``LIBRARY_MAX_OPEN_LOANS`` be enforced with a conditional
+UPDATE instead of a COUNT. The limit also applies when a returned copy is
+lent to a holder: holders at the limit are passed over and keep waiting.
+LibraryUser rows are locked after Book rows.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from rest_framework import status
+
+from .models import Book, Hold, LibraryUser, Transaction
+from .routers import stick_to_primary
+from .signals import books_changed
+
+
+class CirculationError(Exception):
+    """A checkout or return that was refused; carries the API message and status."""
+
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _missing_book_or(book_id, message):
+    # Only reached on the failure path, to tell "no such book" from the rest
+    if Book.objects.filter(pk=book_id).exists():
+        return CirculationError(message)
+    return CirculationError("Book not found.", status.HTTP_404_NOT_FOUND)
+
+
+def _touched():
+    # Copy-count changes are book writes too; keep the ETag validators moving
+    return {'version': F('version') + 1, 'updated_at': timezone.now()}
+
+
+def _announce(user, book_ids):
+    transaction.on_commit(lambda: books_changed.send(sender=Book, book_ids=book_ids))
+    stick_to_primary()  # The patron's next reads must see this change
+
+
+def _result(book_id, message, status_code=status.HTTP_200_OK):
+    return {'book_id': book_id, 'status': status_code, 'message': message}
+
+
+def max_open_loans():
+    return getattr(settings, 'LIBRARY_MAX_OPEN_LOANS', None)
+
+
+def _limit_error(limit):
+    return CirculationError(f"You have reached the limit of {limit} open loans.")
+
+
+def _count_new_loan(user):
+    """Add one open loan to ``user``'s counter; False when that would pass the limit."""
+    patrons = LibraryUser.objects.filter(pk=user.pk)
+    if max_open_loans() is not None:
+        patrons = patrons.filter(open_loans__lt=max_open_loans())
+    return bool(patrons.update(open_loans=F('open_loans') + 1))
+
+
+def _adjust_open_loans(deltas):
+    """Apply ``{library_user_id: delta}`` to the open-loan counters in one UPDATE.
+
+    One statement locks the rows in index order, so two returns that each
+    touch the other's patron cannot deadlock. Counters never go below zero.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if deltas:
+        LibraryUser.objects.filter(pk__in=deltas).update(open_loans=Case(
+            *(When(pk=pk, open_loans__gte=max(-delta, 0), then=F('open_loans') + delta) for pk, delta in deltas.items()),
+            default=Value(0),
+        ))
+
+
+def _lock_patrons(user, book_ids):
+    """Lock ``user`` and the waiting holders of ``book_ids``; return ``{library_user_id: open_loans}``.
+
+    One statement in id order, like ``_adjust_open_loans``, so two returns
+    that allocate to each other's patrons cannot deadlock. Only needed when
+    ``LIBRARY_MAX_OPEN_LOANS`` is set.
+    """
+    holders = Hold.objects.filter(book_id__in=book_ids, status=Hold.WAITING).values('user_id')
+    return dict(LibraryUser.objects.select_for_update().filter(
+        Q(pk=user.pk) | Q(pk__in=holders)
+    ).order_by('pk').values_list('pk', 'open_loans'))
+
+
+def _allocate_to_holder(book_id, deltas, open_loans=None):
+    """Lend a returned copy of ``book_id`` to the next waiting holder; restock it if none can take it.
+
+    Must run in a transaction that already holds the Book row lock. The
+    holder's +1 goes into ``deltas`` for ``_adjust_open_loans``. With a loan
+    limit, ``open_loans`` comes from ``_lock_patrons``; holders whose count
+    plus pending deltas is at the limit are passed over and keep waiting.
+    Returns the fulfilled Hold, or None.
+    """
+    limit = max_open_loans()
+    skipped = []
+    while True:
+        hold = Hold.objects.select_for_update().filter(
+            book_id=book_id, status=Hold.WAITING
+        ).exclude(pk__in=skipped).order_by('-priority', 'id').first()
+        if hold is None:
+            # Shelve the copy; this also resyncs a counter that drifted from the queue
+            Book.objects.filter(pk=book_id).update(
+                copies_available=F('copies_available') + 1, holds_waiting=len(skipped), **_touched()
+            )
+            return None
+        # A holder missing from open_loans was not locked; leave them for the next copy
+        if limit is not None and open_loans.get(hold.user_id, limit) + deltas[hold.user_id] >= limit:
+            skipped.append(hold.pk)
+            continue
+        Hold.objects.filter(pk=hold.pk).update(status=Hold.FULFILLED, closed_at=timezone.now())
+        try:
+            with transaction.atomic():
+                Transaction.objects.create(user_id=hold.user_id, book_id=book_id)
+        except IntegrityError:
+            # The holder already has a copy; the hold is done, try the next one
+            Book.objects.filter(pk=book_id).update(holds_waiting=F('holds_waiting') - 1, **_touched())
+            continue
+        Book.objects.filter(pk=book_id).update(
+            holds_waiting=F('holds_waiting') - 1, times_circulated=F('times_circulated') + 1, **_touched()
+        )
+        deltas[hold.user_id] += 1
+        return hold
+
+
+def checkout_book(user, book_id):
+    """Check out ``book_id`` for the LibraryUser ``user`` and return the Transaction."""
+    try:
+        with transaction.atomic():
+            taken = Book.objects.filter(pk=book_id, copies_available__gt=0).update(
+                copies_available=F('copies_available') - 1, times_circulated=F('times_circulated') + 1, **_touched()
+            )
+            if not taken:
+                raise _missing_book_or(book_id, "No copies available.")
+            if not _count_new_loan(user):
+                raise _limit_error(max_open_loans())
+            # The open-loan constraint on Transaction rejects a second loan
+            # and rolls back the decrement above
+            loan = Transaction.objects.create(user=user, book_id=book_id)
+            _announce(user, [book_id])
+            return loan
+    except IntegrityError:
+        raise CirculationError("You have already checked out this book.")
+
+
+def return_book(user, book_id):
+    """Close the LibraryUser ``user``'s open loan of ``book_id`` and restock the copy."""
+    with transaction.atomic():
+        closed = Transaction.objects.filter(
+            user=user, book_id=book_id, return_date__isnull=True
+        ).update(return_date=timezone.now())
+        if not closed:
+            raise _missing_book_or(book_id, "You have not checked out this book.")
+        shelved = Book.objects.filter(pk=book_id, holds_waiting=0).update(
+            copies_available=F('copies_available') + 1, **_touched()
+        )
+        deltas = Counter({user.pk: -1})
+        if not shelved:
+            # Lock the Book row before reading its queue, as cancel_hold and return_books do;
+            # the missed UPDATE above does not hold it under every isolation level
+            Book.objects.select_for_update().only('pk').get(pk=book_id)
+            open_loans = _lock_patrons(user, [book_id]) if max_open_loans() is not None else None
+            _allocate_to_holder(book_id, deltas, open_loans)
+        _adjust_open_loans(deltas)
+        _announce(user, [book_id])
+
+
+def checkout_books(user, book_ids):
+    """Check out several books for ``user`` in one transaction.
+
+    Costs at most six queries regardless of how many books are requested.
+    Returns one result dict per requested id, in request order; a refused item
+    does not affect the others.
+    """
+    limit = max_open_loans()
+    with transaction.atomic():
+        # Lock the rows so the copy counts read here stay true until commit, in id
+        # order, like return_books, so overlapping batches cannot deadlock
+        copies = dict(Book.objects.select_for_update().filter(pk__in=book_ids).order_by('pk').values_list('pk', 'copies_available'))
+        on_loan = set(Transaction.objects.filter(
+            user=user, book_id__in=book_ids, return_date__isnull=True
+        ).values_list('book_id', flat=True))
+        allowance = len(book_ids)
+        if limit is not None:
+            open_count = LibraryUser.objects.select_for_update().filter(pk=user.pk).values_list('open_loans', flat=True).get()
+            allowance = max(limit - open_count, 0)
+
+        results, taken = [], []
+        for book_id in book_ids:
+            if book_id in taken or book_id in on_loan:
+                results.append(_result(book_id, "You have already checked out this book.", status.HTTP_400_BAD_REQUEST))
+            elif book_id not in copies:
+                results.append(_result(book_id, "Book not found.", status.HTTP_404_NOT_FOUND))
+            elif copies[book_id] <= 0:
+                results.append(_result(book_id, "No copies available.", status.HTTP_400_BAD_REQUEST))
+            elif len(taken) >= allowance:
+                results.append(_result(book_id, _limit_error(limit).message, status.HTTP_400_BAD_REQUEST))
+            else:
+                taken.append(book_id)
+                results.append(_result(book_id, "Book checked out successfully!"))
+
+        if taken:
+            Transaction.objects.bulk_create(Transaction(user=user, book_id=book_id) for book_id in taken)
+            Book.objects.filter(pk__in=taken).update(
+                copies_available=F('copies_available') - 1, times_circulated=F('times_circulated') + 1, **_touched()
+            )
+            _adjust_open_loans({user.pk: len(taken)})
+            _announce(user, taken)
+    return results
+
+
+def return_books(user, book_ids):
+    """Return several books for ``user`` in one transaction.
+
+    Costs at most five queries regardless of how many books are returned,
+    plus the hold allocation for returned books that have waiting holds.
+    Returns one result dict per requested id, in request order.
+    """
+    with transaction.atomic():
+        open_loans = dict(Transaction.objects.select_for_update().filter(
+            user=user, book_id__in=book_ids, return_date__isnull=True
+        ).values_list('book_id', 'pk'))
+        not_on_loan = [book_id for book_id in book_ids if book_id not in open_loans]
+        existing = set(Book.objects.filter(pk__in=not_on_loan).values_list('pk', flat=True)) if not_on_loan else set()
+
+        results, returned = [], []
+        for book_id in book_ids:
+            if book_id in open_loans and book_id not in returned:
+                returned.append(book_id)
+                results.append(_result(book_id, "Book returned successfully!"))
+            elif book_id in open_loans or book_id in existing:
+                results.append(_result(book_id, "You have not checked out this book.", status.HTTP_400_BAD_REQUEST))
+            else:
+                results.append(_result(book_id, "Book not found.", status.HTTP_404_NOT_FOUND))
+
+        if returned:
+            Transaction.objects.filter(pk__in=[open_loans[book_id] for book_id in returned]).update(return_date=timezone.now())
+            shelved = Book.objects.filter(pk__in=returned, holds_waiting=0).update(
+                copies_available=F('copies_available') + 1, **_touched()
+            )
+            deltas = Counter({user.pk: -len(returned)})
+            if shelved < len(returned):
+                held = list(Book.objects.select_for_update().filter(
+                    pk__in=returned, holds_waiting__gt=0
+                ).order_by('pk').values_list('pk', flat=True))
+                open_loans = _lock_patrons(user, held) if max_open_loans() is not None else None
+                for book_id in held:
+                    _allocate_to_holder(book_id, deltas, open_loans)
+            _adjust_open_loans(deltas)
+            _announce(user, returned)
+    return results
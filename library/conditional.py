@@ -0,0 +1,48 @@
+"""
+Conditional GET helpers: ETags and Last-Modified validators that let book
+reads answer ``304 Not Modified`` before querying or serializing.
+
+Book detail validators come from the row's ``version`` and ``updated_at``.
+Listing validators come from the full request path and the catalogue change
+counters (``library.cache.catalogue_versions``) from the page's cursor
+onward, so a change to a book before the page leaves its tag alone. The
+counters live in the database and are bumped after every book or loan
+change, so every worker computes the same tag for the same catalogue state
+and both kinds of tag are strong.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .cache import catalogue_versions
+
+
+def make_etag(*parts, weak=False):
+    etag = '"%s"' % hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return 'W/' + etag if weak else etag
+
+
+def book_validators(book):
+    return make_etag('book', book.pk, book.version, book.updated_at.isoformat()), book.updated_at.timestamp()
+
+
+def catalogue_validators(request, after=None):
+    """Validators for a listing page holding books with ids above ``after`` (None: unknown, the whole catalogue)."""
+    generation, changed_at = catalogue_versions.stamp(after)
+    etag = make_etag('catalogue', generation, changed_at, request.get_host(), request.get_full_path())
+    return etag, changed_at.timestamp() if changed_at else None
+
+
+def not_modified(request, etag, last_modified=None):
+    """The 304 response when the request's validators match, else None."""
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified) if last_modified else None,
+    )
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,53 @@
+"""
+Streaming export of loan history as CSV or NDJSON.
+
+Rows are read in keyset batches (``WHERE id > last ORDER BY id LIMIT n``)
+rather than through ``QuerySet.iterator()``: MySQL's driver buffers a whole
+result set client-side, whereas keyset batches keep memory constant on every
+backend however many rows are exported.
+"""
+import csv
+import json
+
+EXPORT_FIELDS = ['id', 'book_id', 'user_id', 'checkout_date', 'return_date']
+BATCH_SIZE = 5000
+
+
+def iter_batches(queryset, fields=EXPORT_FIELDS, batch_size=BATCH_SIZE):
+    """Yield lists of value tuples from ``queryset`` in primary key order."""
+    last_id = None
+    while True:
+        batch_queryset = queryset if last_id is None else queryset.filter(pk__gt=last_id)
+        batch = list(batch_queryset.order_by('pk').values_list(*fields)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][0]
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+class _Echo:
+    # csv.writer wants a file; this one hands each formatted line straight back
+    def write(self, value):
+        return value
+
+
+def csv_lines(queryset):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for batch in iter_batches(queryset):
+        yield ''.join(
+            writer.writerow([loan_id, book_id, user_id, _isoformat(checkout), _isoformat(returned) or ''])
+            for loan_id, book_id, user_id, checkout, returned in batch
+        )
+
+
+def ndjson_lines(queryset):
+    for batch in iter_batches(queryset):
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_FIELDS, (loan_id, book_id, user_id, _isoformat(checkout), _isoformat(returned))))) + '\n'
+            for loan_id, book_id, user_id, checkout, returned in batch
+        )
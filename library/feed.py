@@ -0,0 +1,149 @@
+"""
+In-process pub/sub behind the availability feed (``/api/async/books/feed/``).
+
+Checkout, return and every other write that changes a book sends
+``books_changed`` on commit, and ``library.signals`` forwards the ids to
+``availability_feed.publish``. That may run in any thread. The ids are
+handed to the event loop, and a single task per process reads the changed
+books' ``copies_available`` in one query. Each connection watching a
+changed book then gets the new count. A short ``FEED_COALESCE_SECONDS``
+pause before the read folds a burst of changes into one query and one event
+per book.
+
+Each connection buffers at most one pending count per watched book, keeping
+only the latest. The buffer is therefore bounded by the subscription size
+(``FEED_MAX_BOOKS``) however far the client falls behind. Writes made by
+other worker processes are picked up by re-reading every watched book each
+``FEED_POLL_SECONDS``. Only counts that actually changed are pushed.
+"""
+import asyncio
+import contextvars
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from . import metrics
+from .models import Book
+
+
+class Subscription:
+    def __init__(self, book_ids):
+        self.book_ids = frozenset(book_ids)
+        self.pending = {}  # Book id -> latest copies_available, not yet sent
+        self._ready = asyncio.Event()
+
+    def push(self, book_id, copies_available):
+        self.pending[book_id] = copies_available
+        self._ready.set()
+
+    async def next(self, timeout):
+        """Wait up to ``timeout`` seconds for changes; return ``{book id: copies}`` (empty on timeout)."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._ready.clear()
+        changes, self.pending = self.pending, {}
+        return changes
+
+
+class AvailabilityFeed:
+    def __init__(self):
+        self._loop = None
+        self._task = None
+        self._wake = None
+        self._watchers = defaultdict(set)  # Book id -> subscriptions
+        self._known = {}  # Book id -> copies_available last pushed
+        self._dirty = set()
+        self.connections = self.events = self.reads = 0
+
+    async def subscribe(self, book_ids):
+        """Watch ``book_ids``. The current counts are queued as the first changes."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._task, self._wake = loop, None, asyncio.Event()
+        subscription = Subscription(book_ids)
+        for book_id in subscription.book_ids:
+            self._watchers[book_id].add(subscription)
+        self.connections += 1
+        try:
+            rows = await sync_to_async(self._read)(sorted(subscription.book_ids))
+        except BaseException:
+            self.unsubscribe(subscription)
+            raise
+        self._apply(rows)
+        for book_id, copies_available in rows:
+            subscription.push(book_id, copies_available)
+        if self._task is None:
+            # A fresh context: the reader outlives this request and must not inherit
+            # its replica routing, so it reads the primary right after each commit
+            self._task = contextvars.Context().run(loop.create_task, self._run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.connections -= 1
+        for book_id in subscription.book_ids:
+            watchers = self._watchers.get(book_id)
+            if watchers is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self._watchers[book_id]
+                    self._known.pop(book_id, None)
+
+    def publish(self, book_ids):
+        """Note that ``book_ids`` changed. Safe to call from any thread."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed() and self._watchers:
+            loop.call_soon_threadsafe(self._mark, book_ids)
+
+    def _mark(self, book_ids):
+        self._dirty.update(book_id for book_id in book_ids if book_id in self._watchers)
+        if self._dirty:
+            self._wake.set()
+
+    def _read(self, book_ids):
+        close_old_connections()  # This runs outside any request, so drop broken or expired connections here
+        self.reads += 1
+        return list(Book.objects.filter(pk__in=book_ids).values_list('pk', 'copies_available'))
+
+    def _apply(self, rows):
+        for book_id, copies_available in rows:
+            if self._known.get(book_id) != copies_available:
+                self._known[book_id] = copies_available
+                for subscription in self._watchers.get(book_id, ()):
+                    subscription.push(book_id, copies_available)
+                    self.events += 1
+
+    async def _run(self):
+        try:
+            while self._watchers:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), getattr(settings, 'FEED_POLL_SECONDS', 5))
+                except asyncio.TimeoutError:
+                    self._dirty.update(self._watchers)  # Catch writes made by other processes
+                self._wake.clear()
+                await asyncio.sleep(getattr(settings, 'FEED_COALESCE_SECONDS', 0.25))
+                book_ids = [book_id for book_id in self._dirty if book_id in self._watchers]
+                self._dirty.clear()
+                if not book_ids:
+                    continue
+                try:
+                    self._apply(await sync_to_async(self._read)(book_ids))
+                except DatabaseError:
+                    self._dirty.update(book_ids)  # Retried on the next pass
+        finally:
+            self._task = None
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'watched_books': len(self._watchers),
+            'events': self.events,
+            'reads': self.reads,
+        }
+
+
+availability_feed = AvailabilityFeed()
+metrics.register('availability_feed', availability_feed.stats)
@@ -0,0 +1,122 @@
+"""
+Password hashing on a small bounded pool.
+
+Registration (``set_password``) and login (``check_password``) both end in
+``PBKDF2PasswordHasher.encode``. Here each encode runs on one of
+``PASSWORD_HASH_WORKERS`` pool threads while the request thread waits for
+it, and at most ``PASSWORD_HASH_QUEUE`` more may wait for a turn. Every
+hash in flight ties up a request thread, so the total is also capped below
+``SERVER_THREADS``, the request threads per process. Beyond that the caller
+gets ``HashingBusy`` at once: a registration spike takes a fixed amount of
+CPU per process and always leaves a request thread for catalogue reads. The
+auth views answer ``HashingBusy`` with 503 and Retry-After, and
+``library.middleware.HashingBusyMiddleware`` does the same for other views
+(the admin login). ``hashlib.pbkdf2_hmac`` releases the GIL, so the pool
+hashes in parallel.
+
+The iteration count is ``PASSWORD_HASH_ITERATIONS`` (Django's default when
+unset). The algorithm name stays ``pbkdf2_sha256``, so stored hashes keep
+verifying, and Django rehashes a password to the configured count the next
+time its owner logs in. Queue wait and hash time are served through
+``/api/metrics/`` under ``password_hashing``.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from . import bench, metrics
+
+RESERVOIR_SIZE = 1000
+
+
+class HashingBusy(Exception):
+    """The pool is full. Raised from the hasher, so it is not tied to DRF; views translate it."""
+    message = "Too many sign-ins in progress; try again shortly."
+    wait = 1  # Seconds, for Retry-After
+
+
+class HashingPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.in_flight = 0
+        self.hashes = self.rejected = 0
+        self.queue_wait = deque(maxlen=RESERVOIR_SIZE)
+        self.hash_time = deque(maxlen=RESERVOIR_SIZE)
+
+    def _workers(self):
+        return getattr(settings, 'PASSWORD_HASH_WORKERS', 2)
+
+    def capacity(self):
+        """Hashes allowed in flight: workers plus queue, below the server's request threads."""
+        capacity = self._workers() + getattr(settings, 'PASSWORD_HASH_QUEUE', 1)
+        threads = getattr(settings, 'SERVER_THREADS', None)
+        if threads:
+            capacity = min(capacity, max(threads - 1, 1))  # A single-threaded server can only hash one at a time
+        return capacity
+
+    def _start(self):
+        # Started on first use, so each forked worker process gets its own threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers(), thread_name_prefix='password-hash')
+        return self._executor
+
+    def run(self, func, *args):
+        """Run ``func(*args)`` on the pool and return its result; HashingBusy when full."""
+        if not self._workers():
+            return self._timed(time.perf_counter(), func, *args)  # Pool disabled: hash inline
+        executor = self._executor or self._start()
+        capacity = self.capacity()
+        with self._lock:
+            if self.in_flight >= capacity:
+                self.rejected += 1
+                raise HashingBusy()
+            self.in_flight += 1
+        try:
+            return executor.submit(self._timed, time.perf_counter(), func, *args).result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _timed(self, queued, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self.hashes += 1
+                self.queue_wait.append(started - queued)
+                self.hash_time.append(finished - started)
+
+    def stats(self):
+        return {
+            'workers': self._workers(),
+            'capacity': self.capacity(),
+            'in_flight': self.in_flight,
+            'hashes': self.hashes,
+            'rejected': self.rejected,
+            'iterations': PooledPBKDF2PasswordHasher().iterations,
+            'queue_wait': bench.summarize(list(self.queue_wait)),
+            'hash_time': bench.summarize(list(self.hash_time)),
+        }
+
+
+hashing_pool = HashingPool()
+metrics.register('password_hashing', hashing_pool.stats)
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """Django's PBKDF2-SHA256 with a configurable iteration count, hashed on ``hashing_pool``."""
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', None) or PBKDF2PasswordHasher.iterations
+
+    def encode(self, password, salt, iterations=None):
+        # verify() and make_password() both come through here
+        return hashing_pool.run(super().encode, password, salt, iterations)
@@ -0,0 +1,95 @@
+"""
+Hold queue: patrons wait in line for a book with no free copies instead of
+polling checkout.
+
+A hold can only be placed while ``copies_available`` is 0, and the check and
+the ``holds_waiting`` increment are one conditional UPDATE. So a return can
+never shelve a copy while a hold is being queued. Returned copies are handed
+to holders by ``circulation.return_book``, skipping holders who are at
+``LIBRARY_MAX_OPEN_LOANS`` by then. Waiting holds lapse at
+``expires_at`` (``HOLD_EXPIRY_DAYS`` after placing) and are closed by
+``sweep_expired_holds``, which the ``sweep_holds`` command runs.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from rest_framework import status
+
+from .circulation import CirculationError, _announce, _limit_error, _missing_book_or, _touched, max_open_loans
+from .models import Book, Hold, LibraryUser, Transaction
+from .signals import books_changed
+
+
+def place_hold(user, book_id, priority=0):
+    """Queue the LibraryUser ``user`` for ``book_id`` and return the Hold."""
+    try:
+        with transaction.atomic():
+            queued = Book.objects.filter(pk=book_id, copies_available=0).update(
+                holds_waiting=F('holds_waiting') + 1, **_touched()
+            )
+            if not queued:
+                raise _missing_book_or(book_id, "Copies are available; check the book out instead.")
+            if Transaction.objects.filter(user=user, book_id=book_id, return_date__isnull=True).exists():
+                raise CirculationError("You have already checked out this book.")
+            # Refuse early; the limit is checked again when a copy is allocated
+            limit = max_open_loans()
+            if limit is not None and LibraryUser.objects.filter(pk=user.pk, open_loans__gte=limit).exists():
+                raise _limit_error(limit)
+            hold = Hold.objects.create(
+                user=user, book_id=book_id, priority=priority,
+                expires_at=timezone.now() + timedelta(days=getattr(settings, 'HOLD_EXPIRY_DAYS', 30)),
+            )
+            _announce(user, [book_id])
+            return hold
+    except IntegrityError:
+        # The waiting-hold constraint; the increment above is rolled back too
+        raise CirculationError("You already have a hold on this book.")
+
+
+def cancel_hold(user, hold_id):
+    """Withdraw ``user``'s waiting hold ``hold_id``."""
+    hold = Hold.objects.filter(pk=hold_id, user=user).first()
+    if hold is None:
+        raise CirculationError("Hold not found.", status.HTTP_404_NOT_FOUND)
+    with transaction.atomic():
+        # Book row first, like returns, so the two cannot deadlock
+        list(Book.objects.select_for_update().filter(pk=hold.book_id).values_list('pk', flat=True))
+        cancelled = Hold.objects.filter(pk=hold.pk, status=Hold.WAITING).update(
+            status=Hold.CANCELLED, closed_at=timezone.now()
+        )
+        if not cancelled:
+            raise CirculationError("Only waiting holds can be cancelled.")
+        Book.objects.filter(pk=hold.book_id).update(holds_waiting=F('holds_waiting') - 1, **_touched())
+        _announce(user, [hold.book_id])
+
+
+def sweep_expired_holds(now=None, batch_size=500):
+    """Close waiting holds past ``expires_at`` in batches; return how many expired."""
+    now = now or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            candidates = list(Hold.objects.filter(
+                status=Hold.WAITING, expires_at__lte=now
+            ).order_by('expires_at').values_list('pk', 'book_id')[:batch_size])
+            if not candidates:
+                return total
+            # Lock the books in id order, then re-read the holds under the lock
+            book_ids = sorted({book_id for _, book_id in candidates})
+            list(Book.objects.select_for_update().filter(pk__in=book_ids).order_by('pk').values_list('pk', flat=True))
+            expired = list(Hold.objects.filter(
+                pk__in=[pk for pk, _ in candidates], status=Hold.WAITING
+            ).values_list('pk', 'book_id'))
+            if expired:
+                Hold.objects.filter(pk__in=[pk for pk, _ in expired]).update(status=Hold.EXPIRED, closed_at=now)
+                per_book = Counter(book_id for _, book_id in expired)
+                Book.objects.filter(pk__in=per_book).update(
+                    holds_waiting=F('holds_waiting') - Case(*(When(pk=book_id, then=Value(count)) for book_id, count in per_book.items())),
+                    **_touched()
+                )
+                transaction.on_commit(lambda ids=list(per_book): books_changed.send(sender=Book, book_ids=ids))
+            total += len(expired)
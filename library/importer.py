@@ -0,0 +1,166 @@
+"""
+Streaming bulk import of books from CSV or JSON Lines.
+
+Rows are read one at a time, validated in batches without per-row database
+queries, and written with one upsert per batch keyed on ``isbn``. A bad row
+is reported and skipped instead of aborting the load. Progress can be saved
+to a checkpoint file after every committed batch, so an interrupted import
+resumes where it stopped.
+
+``copies_available`` only seeds new books. On a book that already exists it
+is live circulation state (moved by checkouts, returns and holds), so a
+re-import updates the catalogue fields and leaves the count alone.
+"""
+import csv
+import io
+import json
+import time
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from rest_framework import serializers
+
+from .models import Book
+from .search import book_index
+from .serializers import ISBNField
+from .signals import books_changed
+
+FORMATS = ('csv', 'jsonl')
+UPDATE_FIELDS = ['title', 'author', 'published_date']  # Overwritten on an existing ISBN
+MAX_REPORTED_ERRORS = 1000
+
+
+class BookRowSerializer(serializers.ModelSerializer):
+    # No UniqueValidator: an existing ISBN is an update, not an error
+    isbn = ISBNField(max_length=13)
+
+    class Meta:
+        model = Book
+        fields = ['isbn'] + UPDATE_FIELDS + ['copies_available']
+
+
+def read_rows(stream, fmt):
+    """Yield row dicts from a text or binary ``stream`` without loading it whole."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format {fmt!r}; expected one of {', '.join(FORMATS)}.")
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield {'__error__': f"Invalid JSON: {exc}"}
+
+
+class ImportReport:
+    def __init__(self, skipped=0):
+        self.rows_done = skipped  # Rows consumed, including previously imported ones
+        self.written = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    def add_error(self, row_number, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'rows_done': self.rows_done,
+            'written': self.written,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'elapsed_s': round(elapsed, 3),
+            'rows_per_s': round(self.written / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+class BookImporter:
+    def __init__(self, batch_size=1000, checkpoint_path=None, on_batch=None):
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.on_batch = on_batch  # Called with the report after each committed batch
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as handle:
+                return json.load(handle)['rows_done']
+        except (FileNotFoundError, TypeError):
+            return 0
+
+    def _save_checkpoint(self, report):
+        if self.checkpoint_path:
+            with open(self.checkpoint_path, 'w') as handle:
+                json.dump({'rows_done': report.rows_done}, handle)
+
+    def run(self, rows, skip=0):
+        """Import ``rows`` (an iterable of dicts), skipping the first ``skip``."""
+        report = ImportReport(skipped=skip)
+        batch = []
+        for row_number, row in enumerate(rows, start=1):
+            if row_number <= skip:
+                continue
+            batch.append((row_number, row))
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch, report)
+                batch = []
+        if batch:
+            self._import_batch(batch, report)
+        return report
+
+    def _import_batch(self, batch, report):
+        books = {}
+        for row_number, row in batch:
+            if '__error__' in row:
+                report.add_error(row_number, {'non_field_errors': [row['__error__']]})
+                continue
+            serializer = BookRowSerializer(data=row)
+            if serializer.is_valid():
+                books[serializer.validated_data['isbn']] = (row_number, Book(**serializer.validated_data))
+            else:
+                report.add_error(row_number, serializer.errors)
+
+        if books:
+            try:
+                with transaction.atomic():
+                    self._upsert([book for _, book in books.values()])
+                report.written += len(books)
+            except DatabaseError:
+                # Isolate the offending rows instead of losing the whole batch
+                for row_number, book in books.values():
+                    try:
+                        with transaction.atomic():
+                            self._upsert([book])
+                        report.written += 1
+                    except DatabaseError as exc:
+                        report.add_error(row_number, {'non_field_errors': [str(exc)]})
+            self._announce(list(books))
+
+        report.rows_done = batch[-1][0]
+        self._save_checkpoint(report)
+        if self.on_batch:
+            self.on_batch(report)
+
+    def _upsert(self, books):
+        # Bump the version of the books that already exist, as Book.save does;
+        # the upsert then moves updated_at with the catalogue fields. Both feed the book's ETag.
+        Book.objects.filter(isbn__in=[book.isbn for book in books]).update(version=F('version') + 1)
+        kwargs = {'update_conflicts': True, 'update_fields': UPDATE_FIELDS + ['updated_at']}
+        if connection.features.supports_update_conflicts_with_target:
+            kwargs['unique_fields'] = ['isbn']  # MySQL infers the key itself
+        Book.objects.bulk_create(books, **kwargs)
+
+    def _announce(self, isbns):
+        # bulk_create bypasses model signals, so refresh the search index and
+        # notify listeners (response caches, ...) explicitly
+        written = list(Book.objects.filter(isbn__in=isbns).values_list('id', 'title', 'author'))
+        if book_index.is_built:
+            for book_id, title, author in written:
+                book_index.add(book_id, title, author)
+        books_changed.send(sender=Book, book_ids=[book_id for book_id, _, _ in written])
@@ -0,0 +1,37 @@
+"""
+Move returned loans older than the archive horizon out of the live loan
+table. Safe to interrupt and re-run; run it nightly from cron:
+
+    python manage.py archive_transactions --dry-run
+    python manage.py archive_transactions
+    python manage.py archive_transactions --older-than 180
+
+On MySQL, ``OPTIMIZE TABLE library_transaction`` after a large first run
+gives the freed pages back.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from library.archive import archivable, archive_horizon, archive_returned_loans
+
+
+class Command(BaseCommand):
+    help = "Move returned loans older than TRANSACTION_ARCHIVE_AFTER_DAYS to the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, metavar='DAYS', help="Override TRANSACTION_ARCHIVE_AFTER_DAYS")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Loans moved per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Count the loans that would move")
+
+    def handle(self, *args, **options):
+        if options['older_than'] is not None:
+            before = timezone.now() - timedelta(days=options['older_than'])
+        else:
+            before = archive_horizon()
+        if options['dry_run']:
+            self.stdout.write(f"{archivable(before).count()} loan(s) returned before {before:%Y-%m-%d} would be archived.")
+            return
+        moved = archive_returned_loans(before, batch_size=options['batch_size'])
+        self.stdout.write(f"Archived {moved} loan(s) returned before {before:%Y-%m-%d}.")
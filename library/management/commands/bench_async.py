@@ -0,0 +1,97 @@
+"""
+Compare the sync DRF read path under WSGI with the async-native views under
+ASGI at high connection counts, fully in-process:
+
+    python manage.py bench_async --settings=library_management_system.settings_local --connections 200
+
+WSGI requests run on a pool of ``--threads`` worker threads, as a threaded
+WSGI server would; ASGI requests all run concurrently on one event loop,
+with the middleware asgi.py runs (no WhiteNoise).
+"""
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from library import bench
+from library.models import Book
+
+PATHS = {
+    'available': ('/api/books/available/', '/api/async/books/available/'),
+    'search': ('/api/books/search/?q=garden', '/api/async/books/search/?q=garden'),
+    'retrieve': ('/api/books/{pk}/', '/api/async/books/{pk}/'),
+}
+
+
+def asgi_middleware():
+    # asgi.py leaves out the sync-only WhiteNoise, which would put every request on a thread
+    return [path for path in settings.MIDDLEWARE if not path.startswith('whitenoise.')]
+
+
+class Command(BaseCommand):
+    help = "Benchmark sync WSGI vs async ASGI catalogue reads at high connection counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10_000)
+        parser.add_argument('--connections', type=int, default=200, help="Concurrent client connections")
+        parser.add_argument('--requests', type=int, default=2000, help="Requests per endpoint and server")
+        parser.add_argument('--threads', type=int, default=16, help="WSGI worker threads")
+
+    def handle(self, *args, **options):
+        bench.seed_books(options['books'])
+        bench.seed_users(1)
+        user = User.objects.get(username=f'{bench.BENCH_USER_PREFIX}0')
+        self.auth = f'Bearer {AccessToken.for_user(user)}'
+        self.book_pk = Book.objects.filter(isbn__startswith=bench.BENCH_ISBN_PREFIX).values_list('pk', flat=True).first()
+
+        report = {}
+        for name, (sync_path, async_path) in PATHS.items():
+            report[name] = {'wsgi': self._wsgi(sync_path.format(pk=self.book_pk), options['requests'], options['threads'])}
+            # AsyncClient always sends Host: testserver
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], MIDDLEWARE=asgi_middleware()):
+                report[name]['asgi'] = asyncio.run(self._asgi(async_path.format(pk=self.book_pk), options['requests'], options['connections']))
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def _result(self, samples, elapsed, errors):
+        return {
+            'requests_per_s': round(len(samples) / elapsed, 1),
+            'errors': errors,
+            'latency': bench.summarize(samples),
+        }
+
+    def _wsgi(self, path, total, threads):
+        def call(_):
+            client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=self.auth)
+            try:
+                return bench.timed(client.get, path)
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(call, range(total)))
+        elapsed = time.perf_counter() - start
+        return self._result([took for _, took in results], elapsed, sum(r.status_code != 200 for r, _ in results))
+
+    async def _asgi(self, path, total, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path, headers={'Authorization': self.auth})
+                return response, time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(call() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+        return self._result([took for _, took in results], elapsed, sum(r.status_code != 200 for r, _ in results))
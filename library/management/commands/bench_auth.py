@@ -0,0 +1,77 @@
+"""
+Benchmark /api/books/available/ throughput with plain JWTAuthentication and
+with the cached principal resolution.
+
+    python manage.py bench_auth --settings=library_management_system.settings_local
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from library import bench
+from library.authentication import CachedJWTAuthentication, principal_cache
+from library.views import BookViewSet
+
+
+class Command(BaseCommand):
+    help = "Compare requests/sec on the available endpoint with and without cached JWT principals."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10_000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=8)
+
+    def handle(self, *args, **options):
+        bench.seed_books(options['books'])
+        bench.seed_users(options['users'])
+        users = list(User.objects.filter(username__startswith=bench.BENCH_USER_PREFIX)[:options['users']])
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+
+        original = BookViewSet.authentication_classes
+        report = {}
+        try:
+            for label, auth_class in (('jwt', JWTAuthentication), ('cached_jwt', CachedJWTAuthentication)):
+                BookViewSet.authentication_classes = [auth_class]
+                principal_cache.clear()
+                report[label] = self._run(tokens, options['requests'], options['concurrency'])
+        finally:
+            BookViewSet.authentication_classes = original
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def _run(self, tokens, total, concurrency):
+        # Queries per request, measured once on a warm cache
+        client = APIClient(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {tokens[0]}')
+        client.get('/api/books/available/', {'page_size': 20})
+        with CaptureQueriesContext(connection) as queries:
+            client.get('/api/books/available/', {'page_size': 20})
+
+        def worker(index):
+            client = APIClient(HTTP_HOST='localhost')
+            samples = []
+            try:
+                for i in range(index, total, concurrency):
+                    client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens[i % len(tokens)]}')
+                    _, elapsed = bench.timed(client.get, '/api/books/available/', {'page_size': 20})
+                    samples.append(elapsed)
+            finally:
+                connections.close_all()
+            return samples
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = [sample for result in pool.map(worker, range(concurrency)) for sample in result]
+        elapsed = time.perf_counter() - start
+        return {
+            'requests_per_s': round(total / elapsed, 1),
+            'queries_per_request': len(queries),
+            'latency': bench.summarize(samples),
+        }
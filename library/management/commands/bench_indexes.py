@@ -0,0 +1,83 @@
+"""
+Benchmark the available listing with and without its copies_available index.
+
+Seeds a local database (200k books and 1M transactions by default), then
+measures each endpoint with the index dropped ("before") and restored
+("after"), and prints the latencies as JSON. Checkout and return are
+measured too, as a control: their open-loan lookup uses the (user, book)
+prefix of the unique open-loan constraint, which is never dropped, so they
+should not move between phases. Run it against a local database:
+
+    python manage.py bench_indexes --settings=library_management_system.settings_local
+"""
+import json
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIClient
+
+from library import bench
+from library.models import Book
+
+# Indexes whose effect is measured; constraints are never dropped
+MEASURED_INDEXES = [
+    (Book, 'book_copies_available_idx'),
+]
+
+
+class Command(BaseCommand):
+    help = "Seed a local database and report endpoint latency before and after the lookup indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=200_000)
+        parser.add_argument('--users', type=int, default=5_000)
+        parser.add_argument('--transactions', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=50, help="Calls per endpoint and phase")
+
+    def handle(self, *args, **options):
+        self.stderr.write("Seeding...")
+        bench.seed_books(options['books'])
+        bench.seed_users(options['users'])
+        bench.seed_transactions(options['transactions'])
+
+        client = APIClient(HTTP_HOST='localhost')
+        client.force_authenticate(User.objects.filter(username__startswith=bench.BENCH_USER_PREFIX).first())
+        rng = random.Random(0)
+        book_ids = list(Book.objects.filter(isbn__startswith=bench.BENCH_ISBN_PREFIX).values_list('pk', flat=True))
+        isbns = [f"{bench.BENCH_ISBN_PREFIX}{i:012d}".lower() for i in range(len(book_ids))]
+
+        indexes = [(model, self._index(model, name)) for model, name in MEASURED_INDEXES]
+        with bench.without_throttling():  # Checkout would otherwise hit its rate limit mid-run
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.remove_index(model, index)
+            try:
+                before = self._measure(client, rng, book_ids, isbns, options['repeat'])
+            finally:
+                with connection.schema_editor() as editor:
+                    for model, index in indexes:
+                        editor.add_index(model, index)
+            after = self._measure(client, rng, book_ids, isbns, options['repeat'])
+
+        self.stdout.write(json.dumps({'before': before, 'after': after}, indent=2))
+
+    def _index(self, model, name):
+        return next(index for index in model._meta.indexes if index.name == name)
+
+    def _measure(self, client, rng, book_ids, isbns, repeat):
+        samples = {'available?isbn': [], 'available?title': [], 'checkout': [], 'return_book': []}
+        for _ in range(repeat):
+            _, elapsed = bench.timed(client.get, '/api/books/available/', {'isbn': rng.choice(isbns)})
+            samples['available?isbn'].append(elapsed)
+            _, elapsed = bench.timed(client.get, '/api/books/available/', {'title': f"Book {rng.randrange(len(book_ids))} "})
+            samples['available?title'].append(elapsed)
+
+            book_id = rng.choice(book_ids)
+            response, elapsed = bench.timed(client.post, '/api/books/checkout/', {'book_id': book_id}, format='json')
+            samples['checkout'].append(elapsed)
+            if response.status_code == 200:
+                _, elapsed = bench.timed(client.post, '/api/books/return_book/', {'book_id': book_id}, format='json')
+                samples['return_book'].append(elapsed)
+        return {endpoint: bench.summarize(values) for endpoint, values in samples.items()}
@@ -0,0 +1,60 @@
+"""
+Benchmark the catalogue search index against the icontains filters used by
+the available listing.
+
+    python manage.py bench_search --settings=library_management_system.settings_local
+"""
+import json
+import random
+
+from django.core.management.base import BaseCommand
+
+from library import bench
+from library.models import Book
+from library.search import book_index
+
+
+class Command(BaseCommand):
+    help = "Compare /api/books/search/ ranking with the icontains title/author scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=100, help="Queries per kind")
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.stderr.write("Seeding...")
+        bench.seed_books(options['books'])
+
+        _, build_seconds = bench.timed(book_index.build_from_database)
+        rng = random.Random(0)
+        total = Book.objects.count()
+        queries = {
+            'exact': lambda: f"book {rng.randrange(total)}",
+            'prefix': lambda: f"author {rng.randrange(5000)} gard",
+            'typo': lambda: f"pyhton {rng.randrange(total)}",
+        }
+
+        report = {'books': total, 'index_build_s': round(build_seconds, 2)}
+        for kind, make_query in queries.items():
+            search, icontains = [], []
+            for _ in range(options['repeat']):
+                query = make_query()
+                _, elapsed = bench.timed(self._search, query, options['limit'])
+                search.append(elapsed)
+                _, elapsed = bench.timed(self._icontains, query)
+                icontains.append(elapsed)
+            report[kind] = {'search': bench.summarize(search), 'icontains': bench.summarize(icontains)}
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def _search(self, query, limit):
+        # What the search endpoint does: rank, then load the top hits
+        hits = book_index.search(query, limit)
+        return Book.objects.in_bulk([book_id for book_id, _ in hits])
+
+    def _icontains(self, query):
+        # What the available endpoint does for the same words
+        books = Book.objects.filter(copies_available__gt=0)
+        for word in query.split():
+            books = books.filter(title__icontains=word) | books.filter(author__icontains=word)
+        return list(books)
@@ -0,0 +1,57 @@
+"""
+Compare the book list rendering paths on pages of increasing size:
+
+- ``serializer``: BookSerializer over model instances, stock JSONRenderer
+  (the list path before the .values() read path)
+- ``values``: ``.values()`` rows rendered by FastJSONRenderer (all fields)
+- ``sparse``: the same with ``?fields=id,title,copies_available``
+
+    python manage.py bench_serializers --settings=library_management_system.settings_local
+"""
+import json
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from library import bench
+from library.models import Book
+from library.renderers import FastJSONRenderer
+from library.serializers import BookSerializer, book_values_fields
+
+
+class Command(BaseCommand):
+    help = "Report rows/s for the ModelSerializer and .values() book list paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=20_000)
+        parser.add_argument('--page-sizes', default='50,500,5000', help="Comma-separated rows per page")
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        bench.seed_books(options['books'])
+        books = Book.objects.filter(copies_available__gt=0).order_by('id')
+        sparse = book_values_fields('id,title,copies_available')
+        paths = {
+            'serializer': lambda n: JSONRenderer().render(BookSerializer(books[:n], many=True).data),
+            'values': lambda n: FastJSONRenderer().render(list(books[:n].values(*book_values_fields(None)))),
+            'sparse': lambda n: FastJSONRenderer().render(list(books[:n].values(*sparse))),
+        }
+
+        report = {}
+        for page_size in (int(size) for size in options['page_sizes'].split(',')):
+            report[page_size] = {}
+            for name, render in paths.items():
+                samples = []
+                for _ in range(options['repeat']):
+                    body, elapsed = bench.timed(render, page_size)
+                    samples.append(elapsed)
+                mean = sum(samples) / len(samples)
+                report[page_size][name] = {
+                    'rows_per_s': round(page_size / mean),
+                    'bytes_per_row': round(len(body) / page_size, 1),
+                    'latency': bench.summarize(samples),
+                }
+            baseline = report[page_size]['serializer']['rows_per_s']
+            for name in ('values', 'sparse'):
+                report[page_size][name]['speedup'] = round(report[page_size][name]['rows_per_s'] / baseline, 2)
+        self.stdout.write(json.dumps(report, indent=2))
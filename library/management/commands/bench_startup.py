@@ -0,0 +1,92 @@
+"""
+Measure worker cold start: time to set Django up and load the URL conf and
+middleware (what a fresh worker does before its first request), peak
+resident memory, and the modules that dominate import time. It compares a
+full worker with an API-only one (LIBRARY_SERVE_DOCS=0, LIBRARY_SERVE_ADMIN=0).
+
+    python manage.py bench_startup --settings=library_management_system.settings_local
+    python manage.py bench_startup --runs 10 --top 40
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter per measurement
+COLD_START = """
+import json, resource, time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()  # django.setup() and the middleware chain
+from django.urls import get_resolver
+get_resolver().url_patterns  # Loaded by the first request otherwise
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+CONFIGURATIONS = {
+    'full': {'LIBRARY_SERVE_DOCS': '1', 'LIBRARY_SERVE_ADMIN': '1'},
+    'api_only': {'LIBRARY_SERVE_DOCS': '0', 'LIBRARY_SERVE_ADMIN': '0'},
+}
+
+
+def parse_importtime(stderr):
+    """Return ``{module: (self_us, cumulative_us)}`` from ``python -X importtime`` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+class Command(BaseCommand):
+    help = "Report worker cold-start time, memory and per-module import time, with and without docs/admin."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Cold starts per configuration (median reported)")
+        parser.add_argument('--top', type=int, default=25, help="Modules listed by import time")
+
+    def handle(self, *args, **options):
+        report = {}
+        for label, flags in CONFIGURATIONS.items():
+            env = {**os.environ, **flags, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+            runs = [json.loads(self._start(env).stdout) for _ in range(options['runs'])]
+            profile = parse_importtime(self._start(env, '-X', 'importtime').stderr)
+            report[label] = {
+                'cold_start_ms': round(statistics.median(run['seconds'] for run in runs) * 1000, 1),
+                'max_rss_mb': round(statistics.median(run['max_rss_kb'] for run in runs) / 1024, 1),
+                'modules_imported': len(profile),
+                'slowest_modules_ms': self._slowest(profile, options['top']),
+                'packages_ms': self._packages(profile, options['top']),
+            }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def _start(self, env, *flags):
+        result = subprocess.run(
+            [sys.executable, *flags, '-c', COLD_START],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Cold start failed:\n{result.stderr[-2000:]}")
+        return result
+
+    def _slowest(self, profile, top):
+        # Self time: the module's own body, without the imports it triggers
+        ranked = sorted(profile.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        return {name: round(self_us / 1000, 2) for name, (self_us, _) in ranked}
+
+    def _packages(self, profile, top):
+        totals = defaultdict(int)
+        for name, (self_us, _) in profile.items():
+            totals[name.split('.')[0]] += self_us
+        ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {name: round(total_us / 1000, 1) for name, total_us in ranked}
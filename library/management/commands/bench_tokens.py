@@ -0,0 +1,88 @@
+"""
+Benchmark token/refresh/ throughput against a large revocation history, with
+simplejwt's token_blacklist tables and with library.tokens' RevokedToken.
+
+    python manage.py bench_tokens --settings=library_management_system.settings_local
+    python manage.py bench_tokens --history 5000000 --requests 5000
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken as BlacklistAppRefreshToken
+
+from library import bench, serializers, tokens
+from library.models import RevokedToken
+from library.views import RefreshView
+
+
+class Command(BaseCommand):
+    help = "Compare token refreshes/sec with the token_blacklist tables and with RevokedToken."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, default=1_000_000, help="Rotated-out tokens already in each store")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=4)
+
+    def handle(self, *args, **options):
+        bench.seed_users(1)
+        user = User.objects.filter(username__startswith=bench.BENCH_USER_PREFIX).first()
+        self.stdout.write("Seeding token history...")
+        bench.seed_token_history(options['history'], token_text=str(BlacklistAppRefreshToken.for_user(user)))
+
+        stores = (
+            ('token_blacklist', jwt_serializers.TokenRefreshSerializer, BlacklistAppRefreshToken),
+            ('revoked_token', serializers.TokenRefreshSerializer, tokens.RefreshToken),
+        )
+        report = {'history': {
+            'outstanding_tokens': OutstandingToken.objects.count(),
+            'revoked_tokens': RevokedToken.objects.count(),
+        }}
+        original = RefreshView.serializer_class
+        try:
+            with bench.without_throttling():  # Measure the store, not the rate limit
+                for label, serializer_class, token_class in stores:
+                    RefreshView.serializer_class = serializer_class
+                    refresh_tokens = [str(token_class.for_user(user)) for _ in range(options['requests'] + 1)]
+                    report[label] = self._run(refresh_tokens, options['concurrency'])
+        finally:
+            RefreshView.serializer_class = original
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def _refresh(self, client, token):
+        response = client.post('/api/token/refresh/', {'refresh': token}, format='json')
+        if response.status_code != 200:
+            raise RuntimeError(f"Refresh failed with {response.status_code}: {response.content[:200]!r}")
+
+    def _run(self, refresh_tokens, concurrency):
+        # Queries per refresh, measured once, like check_query_budgets counts them
+        with CaptureQueriesContext(connection) as queries:
+            self._refresh(APIClient(HTTP_HOST='localhost'), refresh_tokens.pop())
+
+        def worker(index):
+            client = APIClient(HTTP_HOST='localhost')
+            samples = []
+            try:
+                for token in refresh_tokens[index::concurrency]:
+                    _, elapsed = bench.timed(self._refresh, client, token)
+                    samples.append(elapsed)
+            finally:
+                connections.close_all()
+            return samples
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = [sample for result in pool.map(worker, range(concurrency)) for sample in result]
+        elapsed = time.perf_counter() - start
+        return {
+            'refreshes_per_s': round(len(refresh_tokens) / elapsed, 1),
+            'queries_per_refresh': bench.count_queries(queries),
+            'latency': bench.summarize(samples),
+        }
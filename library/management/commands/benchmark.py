@@ -0,0 +1,197 @@
+"""
+Reproducible load test of the REST API.
+
+Seeds a local database with a configurable catalogue, patrons and loan
+history, then drives the real URL routes (token issue and refresh,
+books/available, checkout, return_book, registration) through Django's
+in-process WSGI client from concurrent threads. Results are printed (and
+optionally written) as JSON with throughput and latency percentiles, and can
+be compared with a stored baseline. Only 2xx responses count toward
+throughput and latency; the rest are reported by status code. Everything runs offline:
+
+    python manage.py benchmark --settings=library_management_system.settings_local \\
+        --output bench.json --baseline baseline.json
+"""
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+
+from library import bench
+from library.models import Book
+
+SCENARIOS = ('token', 'token_refresh', 'available', 'checkout', 'return_book', 'register')
+
+
+class Command(BaseCommand):
+    help = "Seed a local database, load-test the API routes and report throughput and latency percentiles as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=20_000)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--transactions', type=int, default=50_000)
+        parser.add_argument('--requests', type=int, default=500, help="Requests per scenario")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated subset of: " + ', '.join(SCENARIOS))
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for request mixes")
+        parser.add_argument('--output', help="Also write the JSON report to this file")
+        parser.add_argument('--baseline', help="Report to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression before failing")
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        self.stderr.write("Seeding...")
+        bench.seed_books(options['books'])
+        bench.seed_users(options['users'])
+        bench.seed_transactions(options['transactions'])
+        self.rng = random.Random(options['seed'])
+        self.usernames = [f"{bench.BENCH_USER_PREFIX}{i}" for i in range(options['users'])]
+        self.book_ids = list(Book.objects.filter(
+            isbn__startswith=bench.BENCH_ISBN_PREFIX, copies_available__gt=0).values_list('pk', flat=True))
+
+        report = {
+            'meta': {
+                'database': connection.vendor,
+                'books': options['books'],
+                'users': options['users'],
+                'transactions': options['transactions'],
+                'requests_per_scenario': options['requests'],
+                'concurrency': options['concurrency'],
+                'debug': settings.DEBUG,
+            },
+            'scenarios': {},
+        }
+        with bench.without_throttling():  # Measure the endpoints, not the rate limits
+            for name in scenarios:
+                self.stderr.write(f"Running {name}...")
+                report['scenarios'][name] = self._run(name, options['requests'], options['concurrency'])
+
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                report['comparison'] = self._compare(json.load(handle), report, options['tolerance'])
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output)
+        self.stdout.write(output)
+
+        regressions = [name for name, result in report.get('comparison', {}).items() if result['regressed']]
+        if regressions:
+            raise CommandError(f"Regressed against baseline: {', '.join(regressions)}")
+
+    # Scenario drivers: each takes a worker's client and state, and returns the measured response
+
+    def _login(self, client, state):
+        response = client.post('/api/token/', {
+            'username': self.rng.choice(self.usernames), 'password': bench.BENCH_PASSWORD,
+        }, content_type='application/json')
+        if response.status_code == 200:
+            state.update(response.json())
+        return response
+
+    def _token(self, client, state):
+        return self._login(client, state)
+
+    def _token_refresh(self, client, state):
+        response = client.post('/api/token/refresh/', {'refresh': state['refresh']}, content_type='application/json')
+        if response.status_code == 200:
+            state.update(response.json())  # Rotation hands out a new refresh token
+        return response
+
+    def _available(self, client, state):
+        return client.get('/api/books/available/', {'page_size': 20}, HTTP_AUTHORIZATION=f"Bearer {state['access']}")
+
+    def _checkout(self, client, state):
+        book_id = self.rng.choice(self.book_ids)
+        response = client.post('/api/books/checkout/', {'book_id': book_id},
+                               content_type='application/json', HTTP_AUTHORIZATION=f"Bearer {state['access']}")
+        if response.status_code == 200:
+            state.setdefault('borrowed', []).append(book_id)
+        return response
+
+    def _return_book(self, client, state):
+        borrowed = state.get('borrowed') or [self.rng.choice(self.book_ids)]
+        return client.post('/api/books/return_book/', {'book_id': borrowed.pop()},
+                           content_type='application/json', HTTP_AUTHORIZATION=f"Bearer {state['access']}")
+
+    def _register(self, client, state):
+        return client.post('/api/register/', {
+            'username': f"bench-reg-{uuid.uuid4().hex[:12]}", 'password': bench.BENCH_PASSWORD,
+        }, content_type='application/json')
+
+    def _run(self, name, total, concurrency):
+        driver = getattr(self, f'_{name}')
+
+        def worker(index):
+            client = Client(HTTP_HOST='localhost')
+            state = {}
+            samples, failures = [], Counter()
+            try:
+                if name not in ('token', 'register'):
+                    response = self._login(client, state)
+                    if response.status_code != 200:
+                        raise CommandError(f"Login for {name} failed with {response.status_code}: {response.content[:200]!r}")
+                if name == 'return_book':
+                    # Give the worker loans to return
+                    for _ in range(index, total, concurrency):
+                        self._checkout(client, state)
+                for _ in range(index, total, concurrency):
+                    response, elapsed = bench.timed(driver, client, state)
+                    # Refusals (4xx) and errors are fast; timing them would flatter the numbers
+                    if 200 <= response.status_code < 300:
+                        samples.append(elapsed)
+                    else:
+                        failures[response.status_code] += 1
+            finally:
+                connections.close_all()
+            return samples, failures
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(worker, range(concurrency)))
+        elapsed = time.perf_counter() - start
+        samples = [sample for worker_samples, _ in results for sample in worker_samples]
+        failures = sum((worker_failures for _, worker_failures in results), Counter())
+        failed = sum(failures.values())
+        return {
+            'requests': len(samples) + failed,
+            'failed': failed,
+            'failure_rate': round(failed / (len(samples) + failed), 3) if samples or failed else 0.0,
+            'failures_by_status': {str(code): count for code, count in sorted(failures.items())},
+            # Successful (2xx) responses only
+            'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+            'latency': bench.summarize(samples),
+        }
+
+    def _compare(self, baseline, report, tolerance):
+        comparison = {}
+        for name, current in report['scenarios'].items():
+            previous = baseline.get('scenarios', {}).get(name)
+            if not previous:
+                continue
+            throughput_change = current['throughput_rps'] / previous['throughput_rps'] - 1 if previous['throughput_rps'] else 0.0
+            p95_change = current['latency']['p95_ms'] / previous['latency']['p95_ms'] - 1 if previous['latency']['p95_ms'] else 0.0
+            # A scenario that failed more often than before regressed, however fast its successes were
+            failure_rate = current['failure_rate']
+            previous_failure_rate = previous.get('failure_rate', 0.0)
+            comparison[name] = {
+                'throughput_change': round(throughput_change, 3),
+                'p95_change': round(p95_change, 3),
+                'failure_rate_change': round(failure_rate - previous_failure_rate, 3),
+                'regressed': (
+                    throughput_change < -tolerance or p95_change > tolerance
+                    or failure_rate > previous_failure_rate * (1 + tolerance)
+                ),
+            }
+        return comparison
@@ -0,0 +1,101 @@
+"""
+Assert the number of SQL queries issued by the hot write paths.
+
+Everything runs inside a transaction that is rolled back, so the command is
+safe to run against any database. It exits with an error when a path goes
+over its budget, which makes it usable as a CI gate:
+
+    python manage.py check_query_budgets --settings=library_management_system.settings_local
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from library import bench, circulation
+from library.models import Book
+
+# Path -> maximum queries, excluding transaction control (BEGIN, savepoints, ...)
+# The register and login throttles count in the database (THROTTLE_SHARED_SCOPES). The
+# probe opens their windows, which costs a failed UPDATE, the expired-row DELETE, the
+# window INSERT and the read of both windows; later requests in a window cost two.
+BUDGETS = {
+    # Throttle window (4), username uniqueness check, INSERT user, INSERT profile
+    'register': 7,
+    # Throttle window (4), user lookup by username (issued refresh tokens are not recorded)
+    'login': 5,
+    # Revocation INSERT of the rotated-out refresh token
+    'refresh': 1,
+    # Conditional copy decrement, open-loan counter (limit check), loan INSERT
+    'checkout': 3,
+    # Loan close, copy increment, open-loan counter
+    'return': 3,
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Fail if registration, login, token refresh, checkout or return exceed their SQL query budgets."
+
+    def handle(self, *args, **options):
+        counts = {}
+        try:
+            with transaction.atomic():
+                self._measure(counts)
+                raise Rollback
+        except Rollback:
+            pass
+
+        failures = []
+        for path, budget in BUDGETS.items():
+            line = f"{path}: {counts[path]} queries (budget {budget})"
+            if counts[path] > budget:
+                failures.append(line)
+            self.stdout.write(line)
+        if failures:
+            raise CommandError("Over budget: " + "; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("All query budgets met."))
+
+    def _measure(self, counts):
+        client = APIClient(HTTP_HOST='localhost')
+        credentials = {'username': 'query-budget-probe', 'password': 'Probe-password-123'}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/register/', credentials, format='json')
+        self._expect(response, 201)
+        counts['register'] = self._count(queries)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/token/', credentials, format='json')
+        self._expect(response, 200)
+        counts['login'] = self._count(queries)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/token/refresh/', {'refresh': response.json()['refresh']}, format='json')
+        self._expect(response, 200)
+        counts['refresh'] = self._count(queries)
+
+        patron = User.objects.select_related('libraryuser').get(username=credentials['username']).libraryuser
+        book = Book.objects.create(
+            title="Query budget probe", author="probe", isbn="QUERYPROBE",
+            published_date=timezone.now().date(), copies_available=1,
+        )
+        with CaptureQueriesContext(connection) as queries:
+            circulation.checkout_book(patron, book.pk)
+        counts['checkout'] = self._count(queries)
+
+        with CaptureQueriesContext(connection) as queries:
+            circulation.return_book(patron, book.pk)
+        counts['return'] = self._count(queries)
+
+    def _expect(self, response, status_code):
+        if response.status_code != status_code:
+            raise CommandError(f"{response.wsgi_request.path} returned {response.status_code}: {response.content[:200]!r}")
+
+    def _count(self, queries):
+        return bench.count_queries(queries)
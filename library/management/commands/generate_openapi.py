@@ -0,0 +1,33 @@
+"""
+Write the OpenAPI schema to a file, for deployment builds and offline use.
+
+    python manage.py generate_openapi                      # OPENAPI_SCHEMA_PATH, served by /openapi.json
+    python manage.py generate_openapi --output api.json    # anywhere else
+    python manage.py generate_openapi --output -           # stdout
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from library.schema import generate_schema
+
+
+class Command(BaseCommand):
+    help = "Generate the OpenAPI schema once and write it as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Destination file, or - for stdout (default: OPENAPI_SCHEMA_PATH)")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'SERVE_DOCS', True):
+            # The file is fingerprinted against the URL conf of the docs workers that serve it
+            raise CommandError("Run with LIBRARY_SERVE_DOCS=1, like the workers that serve the docs.")
+        output = options['output'] or getattr(settings, 'OPENAPI_SCHEMA_PATH', None)
+        if not output:
+            raise CommandError("Pass --output or set OPENAPI_SCHEMA_PATH.")
+        body = generate_schema()
+        if output == '-':
+            self.stdout.write(body.decode())
+            return
+        with open(output, 'wb') as handle:
+            handle.write(body)
+        self.stderr.write(f"Wrote {len(body)} bytes to {output}")
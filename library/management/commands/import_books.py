@@ -0,0 +1,52 @@
+"""
+Bulk-load books from a CSV or JSON Lines file, upserting on ISBN.
+
+    python manage.py import_books catalogue.csv --checkpoint catalogue.ckpt
+
+Re-running with the same ``--checkpoint`` resumes after the last committed batch.
+"""
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.importer import FORMATS, BookImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = "Stream books from a CSV or JSONL file into the catalogue in batched upserts keyed on isbn."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File with isbn, title, author, published_date, copies_available (used for new books only)")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--checkpoint', help="Progress file; an existing one is resumed from")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        fmt = options['format'] or path.suffix.lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError(f"Cannot infer the format of {path.name}; pass --format.")
+
+        importer = BookImporter(
+            batch_size=options['batch_size'],
+            checkpoint_path=options['checkpoint'],
+            on_batch=self._progress,
+        )
+        skip = importer.load_checkpoint()
+        if skip:
+            self.stderr.write(f"Resuming after row {skip}")
+        with path.open('rb') as stream:
+            report = importer.run(read_rows(stream, fmt), skip=skip)
+
+        summary = report.as_dict()
+        for error in summary.pop('errors'):
+            self.stderr.write(f"row {error['row']}: {json.dumps(error['errors'])}")
+        self.stdout.write(json.dumps(summary))
+
+    def _progress(self, report):
+        progress = report.as_dict()
+        self.stderr.write(
+            f"{progress['rows_done']} rows, {progress['written']} written, "
+            f"{progress['error_count']} errors, {progress['rows_per_s']} rows/s"
+        )
@@ -0,0 +1,38 @@
+"""
+Delete revocation entries for refresh tokens that have expired anyway, in
+small batches. The same goes for expired rows left in simplejwt's
+token_blacklist tables from before ``library.tokens``. Run it from cron:
+
+    python manage.py prune_tokens
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.state import token_backend
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from library.models import RevokedToken
+
+
+def prune(model, before, batch_size):
+    total = 0
+    while True:
+        # Walks the expires_at index; each DELETE is a short primary-key batch
+        pks = list(model.objects.filter(expires_at__lte=before).order_by().values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        model.objects.filter(pk__in=pks).delete()
+        total += len(pks)
+
+
+class Command(BaseCommand):
+    help = "Delete revoked and outstanding refresh-token entries whose tokens have expired."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows deleted per statement")
+
+    def handle(self, *args, **options):
+        # A token is still accepted until exp + leeway, so its entry must outlive that
+        before = timezone.now() - token_backend.get_leeway()
+        revoked = prune(RevokedToken, before, options['batch_size'])
+        outstanding = prune(OutstandingToken, before, options['batch_size'])
+        self.stdout.write(f"Pruned {revoked} revoked and {outstanding} legacy outstanding token(s).")
@@ -0,0 +1,61 @@
+"""
+Repair drift in the denormalized circulation counters:
+``LibraryUser.open_loans`` and ``Book.times_circulated`` against the loan
+tables (live and archived), and ``Book.holds_waiting`` against the hold queue.
+
+Rows are checked in primary-key batches. Each batch is fixed in its own
+short transaction, so the command can run against a live database and can be
+re-run at any time:
+
+    python manage.py reconcile_counters --dry-run
+    python manage.py reconcile_counters
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from library.models import ArchivedTransaction, Book, Hold, LibraryUser, Transaction
+
+
+def _count(queryset, key):
+    return Coalesce(Subquery(queryset.order_by().values(key).annotate(count=Count('pk')).values('count')), Value(0))
+
+
+COUNTERS = [
+    (LibraryUser, 'open_loans', lambda: _count(Transaction.objects.filter(user=OuterRef('pk'), return_date__isnull=True), 'user')),
+    # Archived loans still count towards a book's circulation
+    (Book, 'times_circulated', lambda: _count(Transaction.objects.filter(book=OuterRef('pk')), 'book')
+        + _count(ArchivedTransaction.objects.filter(book=OuterRef('pk')), 'book')),
+    (Book, 'holds_waiting', lambda: _count(Hold.objects.filter(book=OuterRef('pk'), status=Hold.WAITING), 'book')),
+]
+
+
+class Command(BaseCommand):
+    help = "Recount open loans, circulation and waiting holds, and fix counters that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without fixing it")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        for model, field, actual in COUNTERS:
+            drifted = self._reconcile(model, field, actual, options['batch_size'], options['dry_run'])
+            verb = "drifted" if options['dry_run'] else "fixed"
+            self.stdout.write(f"{model.__name__}.{field}: {drifted} row(s) {verb}")
+
+    def _reconcile(self, model, field, actual, batch_size, dry_run):
+        drifted, last_pk = 0, 0
+        while True:
+            pks = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return drifted
+            last_pk = pks[-1]
+            with transaction.atomic():
+                # Lock the batch so circulation cannot move a counter between the recount and the fix
+                stale = list(model.objects.select_for_update().filter(pk__in=pks).annotate(
+                    actual=actual()
+                ).exclude(**{field: F('actual')}).values_list('pk', flat=True))
+                if stale and not dry_run:
+                    model.objects.filter(pk__in=stale).update(**{field: actual()})
+            drifted += len(stale)
@@ -0,0 +1,91 @@
+"""
+Concurrency stress test for the checkout/return engine.
+
+Fires thousands of parallel checkouts (and duplicate checkouts) at a single
+book, then returns everything in parallel, and verifies the final counts are
+exact. Run it against a local database, e.g.
+
+    python manage.py stress_checkout --settings=library_management_system.settings_local
+"""
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from library import circulation
+from library.circulation import CirculationError
+from library.models import Book, LibraryUser, Transaction
+
+
+class Command(BaseCommand):
+    help = "Fire parallel checkouts and returns at one book and verify the copy counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help="Number of patrons competing for the book")
+        parser.add_argument('--copies', type=int, default=500, help="Copies of the book on the shelf")
+        parser.add_argument('--workers', type=int, default=32, help="Number of concurrent threads")
+        parser.add_argument('--keep', action='store_true', help="Keep the generated book and users")
+
+    def handle(self, *args, **options):
+        copies = options['copies']
+        tag = uuid.uuid4().hex[:8]
+        book = Book.objects.create(
+            title=f"Stress test {tag}", author="stress", isbn=f"S{tag}",
+            published_date=timezone.now().date(), copies_available=copies,
+        )
+        # bulk_create skips the post_save signal, so profiles are created explicitly
+        users = User.objects.bulk_create(
+            User(username=f"stress-{tag}-{i}", password="!") for i in range(options['users'])
+        )
+        if not all(user.pk for user in users):
+            users = list(User.objects.filter(username__startswith=f"stress-{tag}-"))
+        patrons = LibraryUser.objects.bulk_create(LibraryUser(user=user) for user in users)
+        if not all(patron.pk for patron in patrons):
+            patrons = list(LibraryUser.objects.filter(user__in=users))
+
+        try:
+            # Every patron tries twice so the open-loan constraint is exercised too
+            results = self._run(options['workers'], circulation.checkout_book, book.pk, patrons * 2)
+            winners = [patron for patron, ok in zip(patrons * 2, results) if ok]
+            expected = min(len(patrons), copies)
+            book.refresh_from_db()
+            open_loans = Transaction.objects.filter(book=book, return_date__isnull=True).count()
+            self._check("checkouts", len(winners), expected)
+            self._check("distinct borrowers", len({patron.pk for patron in winners}), expected)
+            self._check("copies after checkout", book.copies_available, copies - expected)
+            self._check("open loans", open_loans, expected)
+
+            results = self._run(options['workers'], circulation.return_book, book.pk, winners * 2)
+            book.refresh_from_db()
+            self._check("returns", sum(results), expected)
+            self._check("copies after return", book.copies_available, copies)
+            self._check("open loans after return", Transaction.objects.filter(book=book, return_date__isnull=True).count(), 0)
+        finally:
+            if not options['keep']:
+                book.delete()
+                User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"OK: {len(patrons)} patrons, {copies} copies, {expected} loans, counts exact."
+        ))
+
+    def _run(self, workers, operation, book_id, patrons):
+        def attempt(patron):
+            try:
+                operation(patron, book_id)
+                return True
+            except CirculationError:
+                return False
+            finally:
+                connections.close_all()  # Each worker thread owns its connection
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(attempt, patrons))
+
+    def _check(self, label, actual, expected):
+        if actual != expected:
+            raise CommandError(f"{label}: expected {expected}, got {actual}")
+        self.stdout.write(f"{label}: {actual}")
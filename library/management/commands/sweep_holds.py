@@ -0,0 +1,30 @@
+"""
+Expire waiting holds past their ``expires_at``. Run it from cron, or keep it
+running as a background worker:
+
+    python manage.py sweep_holds              # one pass
+    python manage.py sweep_holds --loop 60    # a pass every minute
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from library.holds import sweep_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Expire waiting holds that are past their expiry time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Holds closed per transaction")
+        parser.add_argument('--loop', type=float, metavar='SECONDS', help="Keep sweeping, pausing this long between passes")
+
+    def handle(self, *args, **options):
+        while True:
+            expired = sweep_expired_holds(batch_size=options['batch_size'])
+            self.stdout.write(f"Expired {expired} hold(s).")
+            if not options['loop']:
+                return
+            connections.close_all()  # Do not hold a connection while idle
+            time.sleep(options['loop'])
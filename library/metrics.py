@@ -0,0 +1,14 @@
+"""
+Registry of in-process counters exposed through the admin-only
+``/api/metrics/`` endpoint. Each component registers a callable returning a
+JSON-serializable snapshot of its own counters.
+"""
+_sources = {}
+
+
+def register(name, snapshot):
+    _sources[name] = snapshot
+
+
+def snapshot():
+    return {name: source() for name, source in _sources.items()}
@@ -0,0 +1,231 @@
+"""
+Per-request query and latency profiling.
+
+For a sampled fraction of requests (``PROFILING_SAMPLE_RATE``, off by
+default) this records, per view and method: SQL query count, DB time,
+response rendering time and total latency. A request that repeats the same
+query shape ``PROFILING_N_PLUS_ONE_THRESHOLD`` times or more is flagged as a
+likely N+1. Aggregates (percentiles and latency histograms) are served
+through ``/api/metrics/`` under ``requests``. With sampling off the only
+cost is one settings lookup per request.
+"""
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+from . import bench, metrics, routers
+from .hashing import HashingBusy
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+RESERVOIR_SIZE = 1000
+
+
+class QueryProbe:
+    """execute_wrapper that tallies query count, time and shapes."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            self.shapes[sql] += 1  # Parameters are separate, so the SQL is the shape
+
+
+class ViewProfile:
+    def __init__(self):
+        self.requests = 0
+        self.n_plus_one = 0
+        self.worst_shape = None
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.samples = {name: deque(maxlen=RESERVOIR_SIZE) for name in ('total', 'db', 'render', 'queries')}
+
+    def add(self, total, db, render, queries, repeated_shape):
+        self.requests += 1
+        total_ms = total * 1000
+        self.histogram[next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if total_ms <= bound), -1)] += 1
+        for name, value in (('total', total), ('db', db), ('render', render), ('queries', queries)):
+            self.samples[name].append(value)
+        if repeated_shape:
+            self.n_plus_one += 1
+            self.worst_shape = repeated_shape
+
+    def report(self):
+        queries = sorted(self.samples['queries'])
+        return {
+            'requests': self.requests,
+            'latency': bench.summarize(self.samples['total']),
+            'db_time': bench.summarize(self.samples['db']),
+            'render_time': bench.summarize(self.samples['render']),
+            'queries': {
+                'p50': bench.percentile(queries, 0.50),
+                'p95': bench.percentile(queries, 0.95),
+                'max': queries[-1] if queries else 0,
+            },
+            'latency_histogram_ms': dict(zip([f'<={bound}' for bound in LATENCY_BUCKETS_MS] + ['>' + str(LATENCY_BUCKETS_MS[-1])], self.histogram)),
+            'n_plus_one_requests': self.n_plus_one,
+            'n_plus_one_example': self.worst_shape,
+        }
+
+
+class ProfileStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(ViewProfile)
+
+    def add(self, key, *args):
+        with self._lock:
+            self._views[key].add(*args)
+
+    def report(self):
+        with self._lock:
+            return {key: profile.report() for key, profile in sorted(self._views.items())}
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+profile_store = ProfileStore()
+metrics.register('requests', profile_store.report)
+
+
+class RequestProfilingMiddleware:
+    # Async-capable so ASGI requests to async views stay on the event loop
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        with self._profiling(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        with self._profiling(request):
+            return await self.get_response(request)
+
+    def _sampled(self):
+        rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        return rate and random.random() < rate
+
+    @contextmanager
+    def _profiling(self, request):
+        probe = QueryProbe()
+        request._profiling_render = [0.0]
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(probe))
+            yield
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        key = f"{request.method} {match.view_name if match else 'unresolved'}"
+        shape, repeats = probe.shapes.most_common(1)[0] if probe.shapes else (None, 0)
+        threshold = getattr(settings, 'PROFILING_N_PLUS_ONE_THRESHOLD', 5)
+        profile_store.add(
+            key, total, probe.seconds, request._profiling_render[0], probe.count,
+            shape if repeats >= threshold else None,
+        )
+
+    def process_template_response(self, request, response):
+        # DRF responses render lazily right after this hook; time that rendering
+        timing = getattr(request, '_profiling_render', None)
+        if timing is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                timing[0] = time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class ReplicaReadsMiddleware:
+    """
+    Marks the request so the database router may send its reads to replicas,
+    unless the client is pinned to the primary (``routers.stick_to_primary``)
+    by a signed cookie or its view sets ``primary_reads = True``.
+    """
+    async_capable = True
+    sync_capable = True
+    PIN_COOKIE = 'replica_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routers.replica_reads(self._pinned(request)) as routing:
+            response = self.get_response(request)
+        return self._pin(response, routing)
+
+    async def __acall__(self, request):
+        with routers.replica_reads(self._pinned(request)) as routing:
+            response = await self.get_response(request)
+        return self._pin(response, routing)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # DRF's as_view() exposes the view class as .cls
+        if getattr(getattr(view_func, 'cls', None), 'primary_reads', False):
+            routers.read_from_primary()
+
+    def _pinned(self, request):
+        sticky = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+        return request.get_signed_cookie(self.PIN_COOKIE, default=None, salt=self.PIN_COOKIE, max_age=sticky) is not None
+
+    def _pin(self, response, routing):
+        if routing.pin:
+            response.set_signed_cookie(
+                self.PIN_COOKIE, '1', salt=self.PIN_COOKIE, max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class HashingBusyMiddleware:
+    """Answers ``HashingBusy`` from views outside DRF (the admin login) with 503 and Retry-After."""
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # Only process_exception does anything
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, HashingBusy):
+            response = HttpResponse(exception.message, status=503, content_type='text/plain; charset=utf-8')
+            response['Retry-After'] = str(exception.wait)
+            return response
+        return None
@@ -0,0 +1,44 @@
+# Generated by Django 5.1 on 2026-10-18 16:35
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+
+def close_duplicate_open_loans(apps, schema_editor):
+    # The old read-modify-write checkout could record a second open loan of the
+    # same book for the same user. Keep the earliest, mark the rest returned
+    # and put their copies back, so the constraint below can be created.
+    Book = apps.get_model("library", "Book")
+    Transaction = apps.get_model("library", "Transaction")
+    duplicates = Transaction.objects.filter(return_date__isnull=True).values("user_id", "book_id").annotate(
+        loans=Count("id"), first=Min("id")
+    ).filter(loans__gt=1)
+    now = timezone.now()
+    for row in duplicates.iterator():
+        closed = Transaction.objects.filter(
+            user_id=row["user_id"], book_id=row["book_id"], return_date__isnull=True
+        ).exclude(pk=row["first"]).update(return_date=now)
+        Book.objects.filter(pk=row["book_id"]).update(copies_available=F("copies_available") + closed)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0002_alter_book_copies_available_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_loans, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="transaction",
+            constraint=models.UniqueConstraint(
+                models.F("user"),
+                models.F("book"),
+                models.Case(
+                    models.When(return_date__isnull=True, then=models.Value(1))
+                ),
+                name="unique_open_loan_per_user_book",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+def normalize_isbns(apps, schema_editor):
+    # Store ISBNs in canonical form so lookups are exact matches on the unique
+    # index instead of iexact scans. Rows whose canonical form already exists
+    # are left alone rather than breaking the migration.
+    Book = apps.get_model("library", "Book")
+    taken = set(Book.objects.values_list("isbn", flat=True))
+    for pk, isbn in Book.objects.values_list("pk", "isbn").iterator():
+        canonical = isbn.replace("-", "").replace(" ", "").upper()
+        if canonical != isbn and canonical not in taken:
+            Book.objects.filter(pk=pk).update(isbn=canonical)
+            taken.add(canonical)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0003_transaction_unique_open_loan"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_isbns, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["copies_available"], name="book_copies_available_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["user", "book", "return_date"], name="transaction_open_loan_idx"
+            ),
+        ),
+    ]
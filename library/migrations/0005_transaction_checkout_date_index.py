@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0004_book_isbn_normalize_and_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="transaction",
+            name="checkout_date",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
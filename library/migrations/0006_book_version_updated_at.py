@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0005_transaction_checkout_date_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1 on 2026-10-18 22:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    # Start the counters from the loan history; reconcile_counters repairs
+    # any later drift the same way
+    Book = apps.get_model("library", "Book")
+    LibraryUser = apps.get_model("library", "LibraryUser")
+    Transaction = apps.get_model("library", "Transaction")
+    open_loans = (
+        Transaction.objects.filter(user=OuterRef("pk"), return_date__isnull=True)
+        .order_by().values("user").annotate(count=Count("pk")).values("count")
+    )
+    LibraryUser.objects.update(open_loans=Coalesce(Subquery(open_loans), Value(0)))
+    loans = (
+        Transaction.objects.filter(book=OuterRef("pk"))
+        .order_by().values("book").annotate(count=Count("pk")).values("count")
+    )
+    Book.objects.update(times_circulated=Coalesce(Subquery(loans), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0007_holds"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="times_circulated",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="libraryuser",
+            name="open_loans",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["-times_circulated", "id"], name="book_popularity_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
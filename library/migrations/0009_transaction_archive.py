@@ -0,0 +1,38 @@
+# Generated by Django 5.1 on 2026-10-18 23:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0008_circulation_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedTransaction",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("checkout_date", models.DateTimeField(db_index=True)),
+                ("return_date", models.DateTimeField(blank=True, null=True)),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="library.book",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="library.libraryuser",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1 on 2026-10-18 23:50
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def copy_blacklist(apps, schema_editor):
+    # Refresh tokens rotated out before this migration must stay revoked;
+    # expired ones are rejected on their exp claim and need no entry
+    BlacklistedToken = apps.get_model("token_blacklist", "BlacklistedToken")
+    RevokedToken = apps.get_model("library", "RevokedToken")
+    revoked = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list(
+        "token__jti", "token__expires_at"
+    )
+    RevokedToken.objects.bulk_create(
+        (RevokedToken(jti=jti, expires_at=expires_at) for jti, expires_at in revoked.iterator()),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0009_transaction_archive"),
+        ("token_blacklist", "0012_alter_outstandingtoken_user"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RevokedToken",
+            fields=[
+                (
+                    "jti",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(copy_blacklist, migrations.RunPython.noop),
+    ]
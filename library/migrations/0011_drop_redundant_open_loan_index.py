@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-19 09:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0010_revoked_tokens"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="transaction",
+            name="transaction_open_loan_idx",
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1 on 2026-10-19 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0011_drop_redundant_open_loan_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogueSegment",
+            fields=[
+                ("id", models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ("generation", models.PositiveBigIntegerField(default=0)),
+                ("changed_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("library", "0012_catalogue_segments"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ThrottleWindow",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=200, primary_key=True, serialize=False),
+                ),
+                ("hits", models.PositiveIntegerField(default=0)),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
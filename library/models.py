@@ -1,20 +1,67 @@
 from django.db import models
+from django.db.models import Case, Value, When
 from django.contrib.auth.models import User
 
+
+def normalize_isbn(isbn):
+    """Canonical stored form of an ISBN, so lookups can use the unique index."""
+    return isbn.replace('-', '').replace(' ', '').upper()
+
+
 class Book(models.Model):
     title = models.CharField(max_length=255)
     author = models.CharField(max_length=255)
     isbn = models.CharField(max_length=13, unique=True)
     published_date = models.DateField()
     copies_available = models.PositiveIntegerField()
+    # Bumped by every write path (saves, checkout, return, imports); together
+    # they make the book's ETag and Last-Modified
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Waiting holds; while non-zero, returned copies go to holders instead of the shelf
+    holds_waiting = models.PositiveIntegerField(default=0)
+    # Loans ever made, kept by the circulation engine (see reconcile_counters)
+    times_circulated = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Supports the copies_available > 0 filter of the available listing
+            models.Index(fields=['copies_available'], name='book_copies_available_idx'),
+            # Popular titles ranking
+            models.Index(fields=['-times_circulated', 'id'], name='book_popularity_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.isbn = normalize_isbn(self.isbn)
+        if self.pk is not None and not self._state.adding:
+            self.version += 1
+        super().save(*args, **kwargs)
+
+class CatalogueSegment(models.Model):
+    """
+    Change counter for a block of ``SIZE`` consecutive book ids. It is
+    bumped after every commit that changes one of those books (see
+    ``library.cache.catalogue_versions``), so cached listings and their
+    ETags can tell, in any worker, whether the books they cover changed.
+    """
+    SIZE = 1000
+
+    id = models.PositiveIntegerField(primary_key=True)  # Book id // SIZE
+    generation = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"books {self.id * self.SIZE}-{(self.id + 1) * self.SIZE - 1}: {self.generation}"
+
 class LibraryUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     date_of_membership = models.DateField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
+    # Loans not yet returned, kept by the circulation engine (see reconcile_counters)
+    open_loans = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
@@ -22,8 +69,100 @@ class LibraryUser(models.Model):
 class Transaction(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     user = models.ForeignKey(LibraryUser, on_delete=models.CASCADE)
-    checkout_date = models.DateTimeField(auto_now_add=True)
+    checkout_date = models.DateTimeField(auto_now_add=True, db_index=True)  # History date-range filters
+    return_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # One open loan per user per book. Returned loans map to NULL, which
+            # never collides, so this works as a functional unique index on
+            # MySQL too (it has no partial indexes). Its (user, book) prefix
+            # also serves the open-loan lookup of checkout and return.
+            models.UniqueConstraint(
+                'user', 'book', Case(When(return_date__isnull=True, then=Value(1))),
+                name='unique_open_loan_per_user_book',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.book} - {self.checkout_date}"
+
+class ArchivedTransaction(models.Model):
+    """
+    A returned loan moved out of ``Transaction`` by ``archive_transactions``.
+
+    It keeps the loan's id and has the same columns in the same order, so
+    ``library.archive.LoanHistory`` can read both tables as one.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    user = models.ForeignKey(LibraryUser, on_delete=models.CASCADE, related_name='+')
+    checkout_date = models.DateTimeField(db_index=True)
     return_date = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"{self.user} - {self.book} - {self.checkout_date}"
\ No newline at end of file
+        return f"{self.user} - {self.book} - {self.checkout_date} (archived)"
+
+class Hold(models.Model):
+    """A patron's place in the queue for a book with no free copies."""
+    WAITING = 'waiting'
+    FULFILLED = 'fulfilled'
+    CANCELLED = 'cancelled'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (WAITING, 'Waiting'),
+        (FULFILLED, 'Fulfilled'),
+        (CANCELLED, 'Cancelled'),
+        (EXPIRED, 'Expired'),
+    ]
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    user = models.ForeignKey(LibraryUser, on_delete=models.CASCADE)
+    priority = models.PositiveSmallIntegerField(default=0)  # Higher is served first, then FIFO
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    closed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # One waiting hold per user per book; closed holds map to NULL
+            models.UniqueConstraint(
+                'user', 'book', Case(When(status='waiting', then=Value(1))),
+                name='unique_waiting_hold_per_user_book',
+            ),
+        ]
+        indexes = [
+            # Head of a book's queue: WHERE book = ? AND status = 'waiting'
+            # ORDER BY priority DESC, id LIMIT 1, read straight off the index
+            models.Index(fields=['book', 'status', '-priority', 'id'], name='hold_queue_idx'),
+            # Expiry sweep: WHERE status = 'waiting' AND expires_at <= now
+            models.Index(fields=['status', 'expires_at'], name='hold_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.book} - {self.status}"
+
+class RevokedToken(models.Model):
+    """
+    A refresh token that was rotated out (see ``library.tokens``). Kept only
+    until the token would have expired anyway; ``prune_tokens`` drops it then.
+    """
+    jti = models.CharField(max_length=64, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti
+
+class ThrottleWindow(models.Model):
+    """
+    Requests one client made to a rate-limited scope in one time window (see
+    ``library.throttling``), for the scopes counted in the database so that
+    every worker shares one budget. Rows are dropped once they expire.
+    """
+    key = models.CharField(max_length=200, primary_key=True)  # Scope, client and window
+    hits = models.PositiveIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.hits}"
@@ -0,0 +1,32 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination keyed on the primary key.
+
+    Each page is a ``WHERE id > <cursor> ORDER BY id LIMIT n`` query, so it
+    costs the same on page 1 and page 10,000, unlike OFFSET pagination.
+    Clients may ask for ``?page_size=`` up to ``max_page_size``.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def position(self, request):
+        """
+        The id the requested page starts after: 0 for the first page, None
+        for cursors that are not a plain forward step (previous links).
+        """
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            return 0
+        if cursor.reverse or cursor.offset or not (cursor.position or '').isdigit():
+            return None
+        return int(cursor.position)
+
+
+class HistoryPagination(KeysetPagination):
+    """Keyset pagination over loans, newest first."""
+    ordering = '-id'
@@ -0,0 +1,28 @@
+"""
+JSON rendering through orjson.
+
+Output matches DRF's JSONRenderer for API responses (compact separators,
+UTF-8, ``Z`` for UTC datetimes, U+2028/U+2029 escaped) at a fraction of the
+CPU cost. This matters most for rows taken straight from ``QuerySet.values()``,
+whose dates and datetimes orjson encodes natively.
+"""
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+_fallback = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)  # Browsable API pretty-printing
+        # Types orjson does not know (Decimal, lazy strings, ...) go through DRF's encoder
+        ret = orjson.dumps(data, default=_fallback.default, option=OPTIONS)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
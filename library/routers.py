@@ -0,0 +1,188 @@
+"""
+Primary/replica database routing.
+
+Reads of ``Book`` and ``User`` made while serving a request (marked by
+``library.middleware.ReplicaReadsMiddleware``) go to one healthy alias in
+``DATABASE_REPLICAS``, the same one for the whole request. Everything else
+goes to ``default``: writes, reads of other models, reads inside a
+transaction, reads from management commands, and every read of a view with
+``primary_reads = True`` (login, token refresh and registration, which must
+see users the moment they are created). With no replicas configured, this
+router changes nothing.
+
+Read-your-writes: a checkout or return pins the client to the primary for
+``REPLICA_STICKY_SECONDS``. The pin covers the rest of the current request
+and, through a signed cookie set on the response, the client's next
+requests to any worker.
+
+A replica whose connection fails is skipped for ``REPLICA_RETRY_SECONDS``.
+So is one found lagging by more than ``REPLICA_MAX_LAG_SECONDS``: every
+``REPLICA_LAG_CHECK_SECONDS`` a worker compares the newest catalogue change
+(``CatalogueSegment.changed_at``) on the primary and on the replica.
+"""
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.models import Max
+
+from . import metrics
+from .models import CatalogueSegment
+
+ROUTED_MODELS = {('library', 'book'), ('auth', 'user')}
+
+
+class RequestRouting:
+    """Routing state of one request. Mutated in place, so contexts copied from the request's share it."""
+
+    def __init__(self, pinned=False):
+        self.replica_reads = not pinned
+        self.replica = None  # Picked on the first routed read
+        self.replica_used = False
+        self.pin = False  # Set by stick_to_primary; the response pins the client
+
+
+_routing = ContextVar('replica_routing', default=None)
+
+
+def _replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def stick_to_primary():
+    """Send the current client's reads to the primary for the sticky window, starting now."""
+    state = _routing.get()
+    if state is not None and _replicas():
+        state.replica_reads = False
+        state.pin = True
+
+
+def read_from_primary():
+    """Send the rest of the current request's reads to the primary."""
+    state = _routing.get()
+    if state is not None:
+        state.replica_reads = False
+
+
+def used_replica():
+    """True once the current request has read from a replica, so its results may lag."""
+    state = _routing.get()
+    return state is not None and state.replica_used
+
+
+@contextmanager
+def replica_reads(pinned=False):
+    """Allow replica reads for the duration of a request (see ReplicaReadsMiddleware)."""
+    state = RequestRouting(pinned)
+    token = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(token)
+
+
+class ReplicaHealth:
+    """Tracks which replicas are usable, and how reads were routed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._down_until = {}
+        self._lag_due = {}
+        self.lag = {}
+        self.reads = Counter()
+        self.failures = Counter()
+        self.lagging = Counter()
+
+    def pick(self, aliases):
+        now = time.monotonic()
+        candidates = [alias for alias in aliases if self._down_until.get(alias, 0) <= now]
+        while candidates:
+            alias = random.choice(candidates)
+            if self._usable(alias):
+                return alias
+            candidates.remove(alias)
+        return None
+
+    def _usable(self, alias):
+        try:
+            connections[alias].ensure_connection()  # No-op while the connection is open
+            max_lag = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', None)
+            if max_lag is None or time.monotonic() < self._lag_due.get(alias, 0):
+                return True
+            self._lag_due[alias] = time.monotonic() + getattr(settings, 'REPLICA_LAG_CHECK_SECONDS', 5)
+            self.lag[alias] = self._measure_lag(alias)
+            if self.lag[alias] <= max_lag:
+                return True
+            counter = self.lagging
+        except DatabaseError:
+            counter = self.failures
+        with self._lock:
+            counter[alias] += 1
+            self._down_until[alias] = time.monotonic() + getattr(settings, 'REPLICA_RETRY_SECONDS', 30)
+        return False
+
+    def _newest_change(self, alias):
+        return CatalogueSegment.objects.using(alias).aggregate(newest=Max('changed_at'))['newest']
+
+    def _measure_lag(self, alias):
+        # Seconds between the newest catalogue change on the primary and on the replica
+        primary = self._newest_change(DEFAULT_DB_ALIAS)
+        if primary is None:
+            return 0.0
+        replica = self._newest_change(alias)
+        if replica is None:
+            return float('inf')  # Has none of the primary's changes yet
+        return max((primary - replica).total_seconds(), 0.0)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'replicas': {
+                alias: {
+                    'healthy': self._down_until.get(alias, 0) <= now,
+                    'reads': self.reads[alias],
+                    'failures': self.failures[alias],
+                    'lagging': self.lagging[alias],  # Times skipped for lag
+                    'lag_s': self.lag.get(alias),  # At the last check
+                }
+                for alias in _replicas()
+            },
+            'primary_reads': self.reads[DEFAULT_DB_ALIAS],
+        }
+
+
+replica_health = ReplicaHealth()
+metrics.register('replicas', replica_health.stats)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = _replicas()
+        if not replicas or (model._meta.app_label, model._meta.model_name) not in ROUTED_MODELS:
+            return None
+        alias = DEFAULT_DB_ALIAS
+        state = _routing.get()
+        # Reads inside a transaction must see its writes and locks
+        if state is not None and state.replica_reads and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # One replica per request, so its reads see one point in time
+            state.replica = state.replica or replica_health.pick(replicas)
+            if state.replica:
+                alias = state.replica
+                state.replica_used = True
+        replica_health.reads[alias] += 1
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects read from any of them may be related
+        pool = {DEFAULT_DB_ALIAS, *_replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
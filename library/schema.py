@@ -0,0 +1,146 @@
+"""
+The OpenAPI schema, generated once per process instead of on every request.
+
+``/openapi.json`` serves the schema bytes with a strong ETag, and the
+Swagger UI and ReDoc pages (``SchemaUIView``) load their spec from it
+(``SPEC_URL``); the pages themselves only need the cached schema's title and
+version, so no request introspects the views. The
+schema comes from ``OPENAPI_SCHEMA_PATH`` (written at build time by
+``manage.py generate_openapi``) when that file was generated for the current
+URL conf, and is otherwise generated on first use. The URL conf fingerprint
+is stored in the file as ``x-urlconf-fingerprint``. With ``DEBUG`` on, the
+file is ignored, so edited views and decorators show up after a reload.
+"""
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.http import HttpResponse
+from django.urls import URLPattern, get_resolver
+from django.views.decorators.http import require_safe
+from drf_yasg import openapi
+from drf_yasg.app_settings import swagger_settings
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+from rest_framework.response import Response
+
+from . import conditional
+
+FINGERPRINT_KEY = 'x-urlconf-fingerprint'
+
+API_INFO = openapi.Info(
+    title="Library Management API",
+    default_version='v1',
+    description="API documentation for the Library Management System",
+    terms_of_service="https://www.google.com/policies/terms/",
+    contact=openapi.Contact(email="contact@library.local"),
+    license=openapi.License(name="BSD License"),
+)
+
+schema_view = get_schema_view(
+    API_INFO,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+)
+
+
+def _patterns(resolver, prefix=''):
+    for pattern in resolver.url_patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLPattern):
+            callback = pattern.callback
+            view = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None) or callback
+            yield f"{route} {view.__module__}.{view.__qualname__} {sorted(getattr(callback, 'actions', None) or {})}"
+        else:
+            yield from _patterns(pattern, route)
+
+
+def urlconf_fingerprint():
+    """Hash of every route and the view behind it, plus the schema settings."""
+    digest = hashlib.sha1(repr(settings.SWAGGER_SETTINGS).encode())
+    for line in _patterns(get_resolver()):
+        digest.update(line.encode())
+    return digest.hexdigest()
+
+
+def generate_schema(fingerprint=None):
+    """Introspect every view and return the schema as JSON bytes."""
+    generator = swagger_settings.DEFAULT_GENERATOR_CLASS(API_INFO)
+    schema = generator.get_schema(request=None, public=True)
+    schema[FINGERPRINT_KEY] = fingerprint or urlconf_fingerprint()
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+class SchemaCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entry = None
+
+    def _get(self):
+        entry = self._entry
+        if entry is None:
+            with self._lock:
+                if self._entry is None:
+                    body = self._load()
+                    info = json.loads(body)['info']
+                    self._entry = (body, '"%s"' % hashlib.sha1(body).hexdigest(), info['title'], info['version'])
+                entry = self._entry
+        return entry
+
+    def get(self):
+        """Return ``(body, etag)``, loading or generating the schema on first use."""
+        return self._get()[:2]
+
+    def title_and_version(self):
+        return self._get()[2:]
+
+    def _load(self):
+        fingerprint = urlconf_fingerprint()
+        path = getattr(settings, 'OPENAPI_SCHEMA_PATH', None)
+        if path and not settings.DEBUG:
+            try:
+                with open(path, 'rb') as handle:
+                    body = handle.read()
+                if json.loads(body).get(FINGERPRINT_KEY) == fingerprint:
+                    return body
+            except (OSError, ValueError):
+                pass  # Missing or unreadable: generate instead
+        return generate_schema(fingerprint)
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
+
+
+schema_cache = SchemaCache()
+
+
+class SchemaUIView(schema_view):
+    """Swagger UI and ReDoc pages, built from the cached schema instead of a new generator run."""
+
+    def get(self, request, version='', format=None):
+        # The UI renderers read only the title and version; the spec loads from SPEC_URL
+        title, version = schema_cache.title_and_version()
+        return Response(openapi.Swagger(info=openapi.Info(title=title, default_version=version), _prefix='/'))
+
+
+def _urlconf_changed(setting, **kwargs):
+    if setting in ('ROOT_URLCONF', 'SWAGGER_SETTINGS', 'OPENAPI_SCHEMA_PATH'):
+        schema_cache.clear()
+
+
+setting_changed.connect(_urlconf_changed)
+
+
+@require_safe
+def openapi_json(request):
+    body, etag = schema_cache.get()
+    unchanged = conditional.not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    response = HttpResponse(body, content_type='application/json')
+    response['Cache-Control'] = 'public, no-cache'  # Clients revalidate with the ETag
+    return conditional.set_validators(response, etag)
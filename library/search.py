@@ -0,0 +1,196 @@
+"""
+In-process catalogue search index.
+
+An inverted index over book titles and authors with relevance ranking,
+prefix matching on the last query word (search-as-you-type) and tolerance
+for a single typo per word (symmetric-delete lookup). The index is built
+lazily from the database on first use, kept in sync with this process's
+writes through the Book save/delete signals, and rebuilt in the background
+once it is older than ``SEARCH_INDEX_MAX_AGE`` seconds so writes made by
+other workers show up too.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+TOKEN_RE = re.compile(r'\w+')
+
+TITLE_WEIGHT = 2.0
+AUTHOR_WEIGHT = 1.0
+EXACT_MATCH, PREFIX_MATCH, TYPO_MATCH = 1.0, 0.6, 0.4
+MAX_PREFIX_EXPANSIONS = 50
+MIN_TYPO_LENGTH = 4  # Shorter words would match far too much with a typo
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def _deletes(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+class BookSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+        self._built_at = None
+        self._rebuilding = False
+
+    def _reset(self):
+        self._postings = defaultdict(dict)  # term -> {book id: field weight}
+        self._doc_terms = {}                # book id -> terms, for removal
+        self._vocabulary = []               # sorted terms, for prefix lookup
+        self._typo_variants = defaultdict(set)  # one-deletion variant -> terms
+
+    # Maintenance
+
+    def add(self, book_id, title, author):
+        weights = defaultdict(float)
+        for term in tokenize(title):
+            weights[term] += TITLE_WEIGHT
+        for term in tokenize(author):
+            weights[term] += AUTHOR_WEIGHT
+        with self._lock:
+            self._remove(book_id)
+            for term, weight in weights.items():
+                if term not in self._postings:
+                    self._add_term(term)
+                self._postings[term][book_id] = weight
+            self._doc_terms[book_id] = tuple(weights)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def _remove(self, book_id):
+        for term in self._doc_terms.pop(book_id, ()):
+            postings = self._postings[term]
+            postings.pop(book_id, None)
+            if not postings:
+                del self._postings[term]
+                self._vocabulary.pop(bisect.bisect_left(self._vocabulary, term))
+                for variant in _deletes(term):
+                    self._typo_variants[variant].discard(term)
+
+    def _add_term(self, term):
+        bisect.insort(self._vocabulary, term)
+        if len(term) >= MIN_TYPO_LENGTH:
+            for variant in _deletes(term):
+                self._typo_variants[variant].add(term)
+
+    def build(self, rows):
+        """Replace the index contents with ``(id, title, author)`` rows."""
+        fresh = BookSearchIndex()
+        for book_id, title, author in rows:
+            fresh.add(book_id, title, author)
+        with self._lock:
+            self._postings = fresh._postings
+            self._doc_terms = fresh._doc_terms
+            self._vocabulary = fresh._vocabulary
+            self._typo_variants = fresh._typo_variants
+            self._built_at = time.monotonic()
+
+    def build_from_database(self):
+        from .models import Book
+
+        self.build(Book.objects.values_list('id', 'title', 'author').iterator(chunk_size=10000))
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def ensure_fresh(self):
+        """Build on first use; refresh in the background once the index gets old."""
+        if self._built_at is None:
+            with self._lock:
+                if self._built_at is None:
+                    self.build_from_database()
+            return
+        max_age = getattr(settings, 'SEARCH_INDEX_MAX_AGE', 300)
+        if max_age and time.monotonic() - self._built_at > max_age and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._background_rebuild, daemon=True).start()
+
+    def _background_rebuild(self):
+        from django.db import connection
+
+        try:
+            self.build_from_database()
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    # Querying
+
+    def _candidates(self, word, allow_prefix):
+        """Terms matching one query word, mapped to their match quality."""
+        matches = {}
+        if word in self._postings:
+            matches[word] = EXACT_MATCH
+        if allow_prefix:
+            start = bisect.bisect_left(self._vocabulary, word)
+            for term in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+                if not term.startswith(word):
+                    break
+                matches.setdefault(term, PREFIX_MATCH)
+        if len(word) >= MIN_TYPO_LENGTH:
+            # Terms within one edit: same deletions, a deletion of the word, or the word with one extra letter
+            typo_terms = set(self._typo_variants.get(word, ()))
+            for variant in _deletes(word):
+                typo_terms.update(self._typo_variants.get(variant, ()))
+                if variant in self._postings:
+                    typo_terms.add(variant)
+            for term in typo_terms:
+                matches.setdefault(term, TYPO_MATCH)
+        return matches
+
+    def search(self, query, limit=20):
+        """Return up to ``limit`` ``(book id, score)`` pairs, best first.
+
+        Every query word must match (exactly, as a prefix for the last word,
+        or with one typo); scores are idf-weighted with titles counting more
+        than authors.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        with self._lock:
+            total = max(len(self._doc_terms), 1)
+            per_word = []
+            for position, word in enumerate(words):
+                matches = self._candidates(word, position == len(words) - 1)
+                if not matches:
+                    return []
+                weighted = [
+                    (self._postings[term], quality * math.log(1 + total / len(self._postings[term])))
+                    for term, quality in matches.items()
+                ]
+                per_word.append((sum(len(postings) for postings, _ in weighted), weighted))
+
+            # Score the most selective word over its postings, then only probe
+            # the surviving books for the other words
+            per_word.sort(key=lambda item: item[0])
+            ranked = defaultdict(float)
+            for postings, factor in per_word[0][1]:
+                for book_id, weight in postings.items():
+                    ranked[book_id] = max(ranked[book_id], factor * weight)
+            for _, weighted in per_word[1:]:
+                narrowed = {}
+                for book_id, score in ranked.items():
+                    best = max((factor * postings.get(book_id, 0.0) for postings, factor in weighted), default=0.0)
+                    if best:
+                        narrowed[book_id] = score + best
+                ranked = narrowed
+                if not ranked:
+                    return []
+        return heapq.nlargest(limit, ranked.items(), key=lambda item: (item[1], -item[0]))
+
+
+book_index = BookSearchIndex()
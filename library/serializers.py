@@ -1,12 +1,41 @@
 from rest_framework import serializers
-from .models import Book, User, Transaction
+from django.db import transaction
+from rest_framework.validators import UniqueValidator
+from .models import Book, User, Transaction, Hold, normalize_isbn
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+from . import tokens
+
+class ISBNField(serializers.CharField):
+    """Normalizes the ISBN before the uniqueness check and storage."""
+
+    def to_internal_value(self, data):
+        return normalize_isbn(super().to_internal_value(data))
 
 class BookSerializer(serializers.ModelSerializer):
+    isbn = ISBNField(max_length=13, validators=[UniqueValidator(queryset=Book.objects.all())])
+
     class Meta:
         model = Book
         fields = '__all__'
+        read_only_fields = ('version', 'holds_waiting', 'times_circulated')
+
+# BookSerializer's output fields, in order; list endpoints read these with
+# .values() and render the rows directly, skipping per-instance serializers
+BOOK_FIELDS = tuple(BookSerializer().fields)
+
+def book_values_fields(value):
+    """Parse a sparse fieldset such as ``id,title,copies_available``. ``id`` is always included."""
+    if not value:
+        return BOOK_FIELDS
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = sorted(requested - set(BOOK_FIELDS))
+    if unknown:
+        raise serializers.ValidationError({'fields': [f"Unknown field(s): {', '.join(unknown)}."]})
+    return tuple(name for name in BOOK_FIELDS if name == 'id' or name in requested)
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -16,16 +45,72 @@ class UserSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = User(**validated_data)
         user.set_password(validated_data['password'])  # Hash the password
-        user.save()
+        with transaction.atomic():  # The user and its LibraryUser profile are created together
+            user.save()
         return user
 
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    token_class = tokens.RefreshToken
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    @property
+    def token_class(self):
+        # When rotation revokes the presented token, that revocation is the blacklist check
+        if jwt_settings.ROTATE_REFRESH_TOKENS and jwt_settings.BLACKLIST_AFTER_ROTATION:
+            return tokens.RotatingRefreshToken
+        return tokens.RefreshToken
+
+class TokenVerifySerializer(jwt_serializers.TokenVerifySerializer):
+    def validate(self, attrs):
+        token = UntypedToken(attrs['token'])
+        if tokens.is_revoked(token.get(jwt_settings.JTI_CLAIM)):
+            raise serializers.ValidationError("Token is blacklisted")
+        return {}
+
 class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
 
+class HoldSerializer(serializers.ModelSerializer):
+    position = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Hold
+        fields = ('id', 'book', 'status', 'priority', 'position', 'created_at', 'expires_at', 'closed_at')
+
+    def get_position(self, hold):
+        # 1-based place in the book's queue (annotated by HoldViewSet); None once closed
+        return getattr(hold, 'position', None) if hold.status == Hold.WAITING else None
+
+class HoldCreateSerializer(serializers.Serializer):
+    book_id = serializers.IntegerField(required=True)
+    priority = serializers.IntegerField(required=False, default=0, min_value=0, max_value=100)  # Staff only
+
+class TransactionFilterSerializer(serializers.Serializer):
+    since = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'])
+    until = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'])
+
+class TransactionExportSerializer(TransactionFilterSerializer):
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], required=False, default='csv')
+
 class CheckoutSerializer(serializers.Serializer):
     book_id = serializers.IntegerField(required=True)
 
 class ReturnBookSerializer(serializers.Serializer):
     book_id = serializers.IntegerField(required=True)
+
+class BookBatchSerializer(serializers.Serializer):
+    book_ids = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=100)
+
+class BookSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(required=True)
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+class BookPopularSerializer(serializers.Serializer):
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+class BookImportSerializer(serializers.Serializer):
+    file = serializers.FileField(required=True)
+    format = serializers.ChoiceField(choices=['csv', 'jsonl'], required=True)
+    skip = serializers.IntegerField(required=False, default=0, min_value=0)
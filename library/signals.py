@@ -1,13 +1,63 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
 from django.contrib.auth.models import User
-from .models import LibraryUser
+from .authentication import principal_cache
+from .cache import catalogue_versions
+from .feed import availability_feed
+from .models import Book, LibraryUser
+from .search import book_index
+from .throttling import db_latency
+
+# Sent after commit whenever books' catalogue data or copy counts change,
+# with ``book_ids``. Bulk paths that bypass model signals send it directly.
+books_changed = Signal()
 
 @receiver(post_save, sender=User)
 def create_library_user(sender, instance, created, **kwargs):
-    if created:  # Check if the user was just created
+    # Provision the profile exactly once, when the user is inserted, inside the
+    # caller's transaction. Later saves (last_login, password changes) never
+    # touch the profile. Creating it also primes instance.libraryuser.
+    if created:
         LibraryUser.objects.create(user=instance)
 
+# Keep the in-process search index in step with catalogue edits. Until the
+# index is first built there is nothing to update; the build reads the table.
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    if book_index.is_built:
+        transaction.on_commit(lambda: book_index.add(instance.pk, instance.title, instance.author))
+    transaction.on_commit(lambda: books_changed.send(sender=Book, book_ids=[instance.pk]))
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    book_id = instance.pk
+    if book_index.is_built:
+        transaction.on_commit(lambda: book_index.remove(book_id))
+    transaction.on_commit(lambda: books_changed.send(sender=Book, book_ids=[book_id]))
+
+@receiver(books_changed)
+def invalidate_available_cache(sender, book_ids, **kwargs):
+    catalogue_versions.bump(book_ids)
+
+@receiver(books_changed)
+def push_availability(sender, book_ids, **kwargs):
+    availability_feed.publish(book_ids)
+
+# Drop cached principals as soon as the user or their profile changes
 @receiver(post_save, sender=User)
-def save_library_user(sender, instance, **kwargs):
-    instance.libraryuser.save()  # This ensures that the library user is saved when the user is saved
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    principal_cache.invalidate(instance.pk)
+
+@receiver(post_save, sender=LibraryUser)
+@receiver(post_delete, sender=LibraryUser)
+def forget_cached_profile(sender, instance, **kwargs):
+    principal_cache.invalidate(instance.user_id)
+
+# Every primary connection reports its query times to the load shedder
+@receiver(connection_created)
+def watch_db_latency(sender, connection, **kwargs):
+    if connection.alias == DEFAULT_DB_ALIAS and db_latency not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_latency)
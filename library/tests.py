@@ -1,3 +1,1058 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import SyncToAsync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.handlers.asgi import ASGIHandler
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import F, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.connection import ConnectionDoesNotExist
+from drf_yasg.generators import OpenAPISchemaGenerator
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import bench, circulation, holds, tokens
+from .archive import LoanHistory, archive_returned_loans
+from .authentication import principal_cache
+from .cache import available_cache, catalogue_versions
+from .circulation import CirculationError
+from .export import iter_batches
+from .feed import Subscription, availability_feed
+from .hashing import hashing_pool
+from .importer import BookImporter
+from .management.commands.bench_async import asgi_middleware
+from .management.commands.check_query_budgets import BUDGETS
+from .middleware import ReplicaReadsMiddleware
+from .models import ArchivedTransaction, Book, CatalogueSegment, Hold, LibraryUser, RevokedToken, ThrottleWindow, Transaction
+from .routers import ReplicaHealth, replica_health
+from .schema import schema_cache
+from .serializers import TokenVerifySerializer
+from .throttling import SlidingWindowThrottle, db_latency
+from .views import BookViewSet
+
+
+def make_book(copies, isbn='TEST000000001', **fields):
+    return Book.objects.create(
+        title=f"Test book {isbn}", author="Test author", isbn=isbn,
+        published_date=timezone.now().date(), copies_available=copies, **fields
+    )
+
+
+def make_patron(username):
+    # The post_save receiver provisions the profile
+    return User.objects.create(username=username).libraryuser
+
+
+def clear_caches():
+    # Rate-limit counters, cached pages and principals would otherwise leak between tests
+    for cache in caches.all():
+        cache.clear()
+    principal_cache.clear()
+
+
+class CirculationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('reader')
+        self.book = make_book(2)
+
+    def test_checkout_takes_a_copy_and_records_the_loan(self):
+        circulation.checkout_book(self.patron, self.book.pk)
+
+        self.book.refresh_from_db()
+        self.patron.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 1)
+        self.assertEqual(self.book.times_circulated, 1)
+        self.assertEqual(self.patron.open_loans, 1)
+        self.assertTrue(Transaction.objects.filter(user=self.patron, book=self.book, return_date__isnull=True).exists())
+
+    def test_second_checkout_of_the_same_book_is_refused(self):
+        circulation.checkout_book(self.patron, self.book.pk)
+        with self.assertRaises(CirculationError) as refused:
+            circulation.checkout_book(self.patron, self.book.pk)
+
+        self.assertEqual(refused.exception.status_code, status.HTTP_400_BAD_REQUEST)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 1)  # The decrement was rolled back
+        self.assertEqual(Transaction.objects.filter(book=self.book).count(), 1)
+
+    def test_checkout_without_copies_is_refused(self):
+        empty = make_book(0, isbn='TEST000000002')
+        with self.assertRaises(CirculationError) as refused:
+            circulation.checkout_book(self.patron, empty.pk)
+        self.assertEqual(refused.exception.message, "No copies available.")
+
+    def test_checkout_of_a_missing_book_is_not_found(self):
+        with self.assertRaises(CirculationError) as refused:
+            circulation.checkout_book(self.patron, self.book.pk + 1000)
+        self.assertEqual(refused.exception.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_return_restocks_and_closes_the_loan(self):
+        circulation.checkout_book(self.patron, self.book.pk)
+        circulation.return_book(self.patron, self.book.pk)
+
+        self.book.refresh_from_db()
+        self.patron.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 2)
+        self.assertEqual(self.patron.open_loans, 0)
+        self.assertFalse(Transaction.objects.filter(book=self.book, return_date__isnull=True).exists())
+
+    def test_return_without_a_loan_is_refused(self):
+        with self.assertRaises(CirculationError):
+            circulation.return_book(self.patron, self.book.pk)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 2)
+
+    def test_batch_checkout_reports_each_book(self):
+        empty = make_book(0, isbn='TEST000000002')
+        results = circulation.checkout_books(self.patron, [self.book.pk, self.book.pk, empty.pk, self.book.pk + 1000])
+
+        self.assertEqual([result['status'] for result in results], [200, 400, 400, 404])
+        self.book.refresh_from_db()
+        self.patron.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 1)
+        self.assertEqual(self.patron.open_loans, 1)
+
+        results = circulation.return_books(self.patron, [self.book.pk, empty.pk])
+        self.assertEqual([result['status'] for result in results], [200, 400])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 2)
+
+
+class BatchCirculationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('desk')
+        self.books = [make_book(1, isbn=f'TEST00000000{i}') for i in range(3)]
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.patron.user)
+
+    def _post(self, path, book_ids):
+        return self.client.post(path, {'book_ids': book_ids}, format='json')
+
+    def _copies(self):
+        return list(Book.objects.filter(pk__in=[book.pk for book in self.books]).order_by('pk').values_list('copies_available', flat=True))
+
+    def test_failed_items_leave_the_rest_of_the_batch_applied(self):
+        circulation.checkout_book(make_patron('lender'), self.books[1].pk)  # No copies left
+        book_ids = [self.books[0].pk, self.books[1].pk, self.books[2].pk + 1000, self.books[2].pk]
+
+        response = self._post('/api/books/checkout/batch/', book_ids)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(result['book_id'], result['status']) for result in response.data['results']],
+            list(zip(book_ids, [200, 400, 404, 200])),
+        )
+        self.assertEqual(self._copies(), [0, 0, 0])
+        self.patron.refresh_from_db()
+        self.assertEqual(self.patron.open_loans, 2)
+        self.assertEqual(Transaction.objects.filter(user=self.patron, return_date__isnull=True).count(), 2)
+
+        response = self._post('/api/books/return/batch/', [self.books[0].pk, self.books[1].pk])
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 400])
+        self.assertEqual(self._copies(), [1, 0, 0])
+
+    def test_batch_return_lends_held_copies_to_their_holders(self):
+        self._post('/api/books/checkout/batch/', [book.pk for book in self.books[:2]])
+        waiter = make_patron('waiter')
+        holds.place_hold(waiter, self.books[1].pk)
+
+        response = self._post('/api/books/return/batch/', [book.pk for book in self.books[:2]])
+
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 200])
+        self.assertEqual(self._copies(), [1, 0, 1])  # The held copy went to the waiter, not the shelf
+        waiter.refresh_from_db()
+        self.assertEqual(waiter.open_loans, 1)
+        self.assertEqual(Hold.objects.get(user=waiter).status, Hold.FULFILLED)
+
+    def test_malformed_batch_changes_nothing(self):
+        for book_ids in ([], list(range(1, 102)), ['one']):
+            self.assertEqual(self._post('/api/books/checkout/batch/', book_ids).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._copies(), [1, 1, 1])
+        self.assertFalse(Transaction.objects.exists())
+
+
+class ConcurrentCirculationTests(TransactionTestCase):
+    """Parallel checkouts and returns against one book; the counts must come out exact."""
+
+    patrons = 120
+    copies = 40
+    workers = 16
+
+    def setUp(self):
+        clear_caches()
+
+    def _run(self, operation, book_id, patrons):
+        def attempt(patron):
+            try:
+                operation(patron, book_id)
+                return True
+            except CirculationError:
+                return False
+            finally:
+                connections.close_all()  # Each worker thread owns its connection
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(attempt, patrons))
+
+    def test_parallel_checkouts_and_returns_keep_exact_counts(self):
+        book = make_book(self.copies)
+        patrons = [make_patron(f"racer-{i}") for i in range(self.patrons)]
+
+        # Every patron tries twice, so the one-open-loan constraint is raced too
+        results = self._run(circulation.checkout_book, book.pk, patrons * 2)
+        winners = [patron for patron, ok in zip(patrons * 2, results) if ok]
+        book.refresh_from_db()
+        self.assertEqual(len(winners), self.copies)
+        self.assertEqual(len({patron.pk for patron in winners}), self.copies)
+        self.assertEqual(book.copies_available, 0)
+        self.assertEqual(book.times_circulated, self.copies)
+        self.assertEqual(Transaction.objects.filter(book=book, return_date__isnull=True).count(), self.copies)
+        self.assertEqual(LibraryUser.objects.aggregate(total=Sum('open_loans'))['total'], self.copies)
+
+        results = self._run(circulation.return_book, book.pk, winners * 2)
+        book.refresh_from_db()
+        self.assertEqual(sum(results), self.copies)
+        self.assertEqual(book.copies_available, self.copies)
+        self.assertFalse(Transaction.objects.filter(book=book, return_date__isnull=True).exists())
+        self.assertEqual(LibraryUser.objects.aggregate(total=Sum('open_loans'))['total'], 0)
+
+    def test_return_of_a_held_book_races_the_hold_cancel(self):
+        for i in range(10):
+            book = make_book(0, isbn=f'RACE{i:09d}')
+            lender, holder = make_patron(f"lender-{i}"), make_patron(f"holder-{i}")
+            Transaction.objects.create(user=lender, book=book)
+            LibraryUser.objects.filter(pk=lender.pk).update(open_loans=1)
+            hold = holds.place_hold(holder, book.pk)
+
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                returned = pool.submit(self._run, circulation.return_book, book.pk, [lender])
+                cancelled = pool.submit(self._run, holds.cancel_hold, hold.pk, [holder])
+                self.assertEqual(returned.result(), [True])
+                cancelled = cancelled.result()[0]
+
+            # Either the cancel won and the copy is shelved, or the holder got it and the cancel was refused
+            book.refresh_from_db()
+            holder.refresh_from_db()
+            hold.refresh_from_db()
+            lent = Transaction.objects.filter(user=holder, book=book, return_date__isnull=True).exists()
+            self.assertNotEqual(cancelled, lent)
+            self.assertEqual(hold.status, Hold.CANCELLED if cancelled else Hold.FULFILLED)
+            self.assertEqual((book.copies_available, book.holds_waiting), (0 if lent else 1, 0))
+            self.assertEqual(holder.open_loans, int(lent))
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)  # Same hasher, fewer rounds
+class QueryBudgetTests(TestCase):
+    """Hot paths pinned to the query counts in check_query_budgets.BUDGETS."""
+
+    credentials = {'username': 'budget-reader', 'password': 'Budget-password-123'}
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient(HTTP_HOST='localhost')
+
+    def assertQueries(self, path, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            result = func(*args, **kwargs)
+        # Savepoints are bookkeeping of the surrounding test transaction, not work
+        self.assertEqual(
+            bench.count_queries(queries), BUDGETS[path],
+            '\n'.join(query['sql'] for query in queries.captured_queries),
+        )
+        return result
+
+    def _register(self):
+        response = self.assertQueries('register', self.client.post, '/api/register/', self.credentials, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_register(self):
+        self._register()
+        self.assertEqual(LibraryUser.objects.filter(user__username=self.credentials['username']).count(), 1)
+
+    def test_login_and_refresh(self):
+        self._register()
+        response = self.assertQueries('login', self.client.post, '/api/token/', self.credentials, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        refresh = response.json()['refresh']
+        response = self.assertQueries('refresh', self.client.post, '/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_saving_a_user_leaves_the_profile_alone(self):
+        user = User.objects.create(username='budget-profile')
+        with self.assertNumQueries(1):  # The user UPDATE only
+            user.last_login = timezone.now()
+            user.save()
+
+    def test_checkout_and_return(self):
+        patron = make_patron('budget-borrower')
+        book = make_book(1)
+        self.assertQueries('checkout', circulation.checkout_book, patron, book.pk)
+        self.assertQueries('return', circulation.return_book, patron, book.pk)
+
+
+class HoldTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.lender = make_patron('lender')
+        self.book = make_book(1)
+        circulation.checkout_book(self.lender, self.book.pk)  # The only copy is out
+
+    def test_hold_needs_an_empty_shelf(self):
+        other = make_book(1, isbn='TEST000000002')
+        with self.assertRaises(CirculationError):
+            holds.place_hold(make_patron('early'), other.pk)
+        other.refresh_from_db()
+        self.assertEqual(other.holds_waiting, 0)
+
+    def test_returned_copy_goes_to_the_head_of_the_queue(self):
+        first, second, staff = make_patron('first'), make_patron('second'), make_patron('staff')
+        holds.place_hold(first, self.book.pk)
+        holds.place_hold(second, self.book.pk)
+        priority_hold = holds.place_hold(staff, self.book.pk, priority=5)
+
+        circulation.return_book(self.lender, self.book.pk)
+
+        self.book.refresh_from_db()
+        staff.refresh_from_db()
+        priority_hold.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 0)  # Lent on, never shelved
+        self.assertEqual(self.book.holds_waiting, 2)
+        self.assertEqual(priority_hold.status, Hold.FULFILLED)
+        self.assertEqual(staff.open_loans, 1)
+        self.assertTrue(Transaction.objects.filter(user=staff, book=self.book, return_date__isnull=True).exists())
+
+        circulation.return_book(staff, self.book.pk)
+        self.assertEqual(Hold.objects.get(user=first, book=self.book).status, Hold.FULFILLED)  # Then first come, first served
+
+    def test_cancelled_hold_leaves_the_queue(self):
+        hold = holds.place_hold(make_patron('waiter'), self.book.pk)
+        holds.cancel_hold(hold.user, hold.pk)
+
+        circulation.return_book(self.lender, self.book.pk)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.holds_waiting, 0)
+        self.assertEqual(self.book.copies_available, 1)
+
+    def test_sweep_expires_overdue_holds(self):
+        hold = holds.place_hold(make_patron('waiter'), self.book.pk)
+        self.assertEqual(holds.sweep_expired_holds(now=hold.expires_at + timedelta(seconds=1)), 1)
+
+        hold.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual(hold.status, Hold.EXPIRED)
+        self.assertEqual(self.book.holds_waiting, 0)
+
+    def test_cancel_over_the_api(self):
+        waiter = make_patron('waiter')
+        hold = holds.place_hold(waiter, self.book.pk)
+        client = APIClient(HTTP_HOST='localhost')
+        client.force_authenticate(waiter.user)
+
+        self.assertEqual(client.delete('/api/holds/abc/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(client.delete(f'/api/holds/{hold.pk + 1000}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(client.delete(f'/api/holds/{hold.pk}/').status_code, status.HTTP_204_NO_CONTENT)
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, Hold.CANCELLED)
+
+
+@override_settings(LIBRARY_MAX_OPEN_LOANS=2)
+class LoanLimitTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('reader')
+        self.books = [make_book(1, isbn=f'TEST00000000{i}') for i in range(5)]
+
+    def _open_loans(self):
+        self.patron.refresh_from_db()
+        return self.patron.open_loans
+
+    def test_checkout_stops_at_the_limit(self):
+        circulation.checkout_book(self.patron, self.books[0].pk)
+        results = circulation.checkout_books(self.patron, [book.pk for book in self.books[1:4]])
+
+        self.assertEqual([result['status'] for result in results], [200, 400, 400])
+        with self.assertRaises(CirculationError):
+            circulation.checkout_book(self.patron, self.books[4].pk)
+        self.assertEqual(self._open_loans(), 2)
+
+    def _hold_everything_else(self):
+        # One loan, then holds on four books lent to others
+        circulation.checkout_book(self.patron, self.books[0].pk)
+        lenders = []
+        for index, book in enumerate(self.books[1:]):
+            lender = make_patron(f'lender-{index}')
+            circulation.checkout_book(lender, book.pk)
+            holds.place_hold(self.patron, book.pk)
+            lenders.append(lender)
+        return lenders
+
+    def test_allocation_skips_holders_at_the_limit(self):
+        lenders = self._hold_everything_else()
+        for lender, book in zip(lenders, self.books[1:]):
+            circulation.return_book(lender, book.pk)
+
+        self.assertEqual(self._open_loans(), 2)
+        self.assertEqual(Transaction.objects.filter(user=self.patron, return_date__isnull=True).count(), 2)
+        # Passed-over holds keep waiting; their copies went back on the shelf
+        self.assertEqual(Hold.objects.filter(user=self.patron, status=Hold.WAITING).count(), 3)
+        self.assertEqual(Book.objects.filter(pk__in=[book.pk for book in self.books[2:]], copies_available=1, holds_waiting=1).count(), 3)
+
+    def test_allocation_goes_to_the_next_holder_under_the_limit(self):
+        lenders = self._hold_everything_else()
+        circulation.return_book(lenders[0], self.books[1].pk)  # The patron's second loan
+        runner_up = make_patron('runner-up')
+        holds.place_hold(runner_up, self.books[2].pk)
+
+        results = circulation.return_books(lenders[1], [self.books[2].pk])
+        self.assertEqual(results[0]['status'], 200)
+        runner_up.refresh_from_db()
+        self.assertEqual(runner_up.open_loans, 1)
+        self.assertEqual(self._open_loans(), 2)
+        self.assertEqual(Hold.objects.get(user=self.patron, book=self.books[2]).status, Hold.WAITING)
+
+
+class BookUpdateTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.book = make_book(3)
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(User.objects.create(username='editor'))
+
+    def test_update_keeps_counters_moved_after_the_read(self):
+        get_object = BookViewSet.get_object
+
+        def read_then_circulate(view):
+            book = get_object(view)
+            # A checkout and a queued hold commit between the read and the save
+            Book.objects.filter(pk=book.pk).update(
+                copies_available=F('copies_available') - 1, times_circulated=F('times_circulated') + 1,
+                holds_waiting=F('holds_waiting') + 1,
+            )
+            return book
+
+        with mock.patch.object(BookViewSet, 'get_object', read_then_circulate):
+            response = self.client.patch(f'/api/books/{self.book.pk}/', {'title': "Renamed"}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.title, "Renamed")
+        self.assertEqual((self.book.copies_available, self.book.times_circulated, self.book.holds_waiting), (2, 1, 1))
+        self.assertEqual(self.book.version, 2)
+        self.assertEqual(response.data['copies_available'], 2)
+
+
+class AvailableCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('reader')
+        self.book = make_book(2)
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.patron.user)
+
+    def _copies(self, **params):
+        response = self.client.get('/api/books/available/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {row['id']: row['copies_available'] for row in response.data['results']}
+
+    def _hits(self):
+        return available_cache.stats()['hits']
+
+    def test_repeated_page_is_served_from_the_cache(self):
+        self._copies()
+        hits = self._hits()
+        with self.assertNumQueries(2):  # Change counters for the ETag and for the page's span; no book query
+            self.assertEqual(self._copies(), {self.book.pk: 2})
+        self.assertEqual(self._hits(), hits + 1)
+
+    def test_checkout_and_return_invalidate_the_page(self):
+        self._copies()
+        with self.captureOnCommitCallbacks(execute=True):
+            circulation.checkout_book(self.patron, self.book.pk)
+        self.assertEqual(self._copies(), {self.book.pk: 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            circulation.return_book(self.patron, self.book.pk)
+        self.assertEqual(self._copies(), {self.book.pk: 2})
+
+    def test_update_invalidates_the_page(self):
+        self.client.get('/api/books/available/', {'fields': 'id,title'})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/books/{self.book.pk}/', {'title': "Renamed"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        titles = self.client.get('/api/books/available/', {'fields': 'id,title'}).data['results']
+        self.assertEqual(titles, [{'id': self.book.pk, 'title': "Renamed"}])
+
+    def test_change_committed_by_another_worker_invalidates_the_page(self):
+        self._copies()
+        # Another worker's checkout: its cache is not ours, only the database is shared
+        Book.objects.filter(pk=self.book.pk).update(copies_available=F('copies_available') - 1)
+        CatalogueSegment.objects.create(pk=self.book.pk // CatalogueSegment.SIZE, generation=1, changed_at=timezone.now())
+        self.assertEqual(self._copies(), {self.book.pk: 1})
+
+    def test_change_outside_the_page_keeps_it_cached(self):
+        far = make_book(1, isbn='TEST000000002', id=self.book.pk + CatalogueSegment.SIZE)
+        self.assertEqual(self._copies(page_size=1), {self.book.pk: 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            circulation.checkout_book(self.patron, far.pk)
+        hits = self._hits()
+        self.assertEqual(self._copies(page_size=1), {self.book.pk: 2})
+        self.assertEqual(self._hits(), hits + 1)
+        # The last page runs to the end of the catalogue, so the same change reaches it
+        self.assertEqual(self._copies(), {self.book.pk: 2})
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('reader')
+        self.book = make_book(2)
+
+    def _row(self, isbn, title, copies):
+        return {'isbn': isbn, 'title': title, 'author': "Test author", 'published_date': '2020-01-01', 'copies_available': copies}
+
+    def test_reimport_keeps_live_copy_count_and_bumps_version(self):
+        circulation.checkout_book(self.patron, self.book.pk)
+
+        report = BookImporter().run([self._row(self.book.isbn, "Second edition", 2)])
+
+        self.assertEqual(report.written, 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.title, "Second edition")
+        self.assertEqual(self.book.copies_available, 1)  # The open loan still holds a copy
+        self.assertEqual(self.book.version, 3)  # Checkout, then the import
+
+        circulation.return_book(self.patron, self.book.pk)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 2)
+
+    def test_new_books_take_their_copy_count(self):
+        report = BookImporter().run([self._row('9780306406157', "New", 4), {'isbn': 'bad'}])
+
+        self.assertEqual((report.written, report.error_count), (1, 1))
+        book = Book.objects.get(isbn='9780306406157')
+        self.assertEqual((book.copies_available, book.version), (4, 1))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('reader')
+        self.book = make_book(2)
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.patron.user)
+
+    def _revalidate(self, path, etag, **params):
+        return self.client.get(path, params, HTTP_IF_NONE_MATCH=etag)
+
+    def test_book_detail(self):
+        path = f'/api/books/{self.book.pk}/'
+        etag = self.client.get(path)['ETag']
+        self.assertEqual(self._revalidate(path, etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        circulation.checkout_book(self.patron, self.book.pk)
+
+        response = self._revalidate(path, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['copies_available'], 1)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_listing(self):
+        for path in ('/api/books/', '/api/books/available/'):
+            etag = self.client.get(path)['ETag']
+            self.assertFalse(etag.startswith('W/'))
+            self.assertEqual(self._revalidate(path, etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                circulation.checkout_book(self.patron, self.book.pk)
+
+            response = self._revalidate(path, etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['results'][0]['copies_available'], 1)
+            with self.captureOnCommitCallbacks(execute=True):
+                circulation.return_book(self.patron, self.book.pk)
+
+    def test_listing_page_ignores_changes_before_its_cursor(self):
+        # Counters cover blocks of ids, so the third page starts in the block after the first book's
+        next_block = (self.book.pk // CatalogueSegment.SIZE + 1) * CatalogueSegment.SIZE
+        make_book(1, isbn='TEST000000002', id=next_block)
+        make_book(1, isbn='TEST000000003', id=next_block + 1)
+        first_page = self.client.get('/api/books/', {'page_size': 1})
+        third_page = self.client.get(first_page.data['next']).data['next']
+        etag = self.client.get(third_page)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            circulation.checkout_book(self.patron, self.book.pk)
+
+        self.assertEqual(self.client.get(third_page, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get('/api/books/', {'page_size': 1}, HTTP_IF_NONE_MATCH=first_page['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    async def test_async_listing(self):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.patron.user)}'}
+        path = '/api/async/books/available/'
+        etag = (await self.async_client.get(path, headers=headers))['ETag']
+        response = await self.async_client.get(path, headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        await sync_to_async(circulation.checkout_book)(self.patron, self.book.pk)
+        await sync_to_async(catalogue_versions.bump)([self.book.pk])  # TestCase never commits, so no on_commit
+
+        response = await self.async_client.get(path, headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ASGIMiddlewareTests(TestCase):
+    @override_settings(MIDDLEWARE=asgi_middleware())
+    def test_asgi_chain_stays_on_the_event_loop(self):
+        # One sync-only middleware would wrap the whole chain in SyncToAsync
+        self.assertNotIsInstance(ASGIHandler()._middleware_chain, SyncToAsync)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], PASSWORD_HASH_ITERATIONS=1000)
+class ReplicaRoutingTests(TransactionTestCase):
+    # Outside a transaction, since reads inside one stay on the primary. There is
+    # no 'replica' database here, so a read routed to it raises ConnectionDoesNotExist.
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('reader')
+        self.book = make_book(2)
+        self.client = APIClient(HTTP_HOST='localhost')
+        patcher = mock.patch.object(replica_health, 'pick', return_value='replica')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_request_reads_go_to_the_replica(self):
+        self.client.force_authenticate(self.patron.user)
+        with self.assertRaises(ConnectionDoesNotExist):
+            self.client.get(f'/api/books/{self.book.pk}/')
+
+    def test_registration_login_and_authentication_read_from_the_primary(self):
+        credentials = {'username': 'newcomer', 'password': 'correct horse'}
+        response = self.client.post('/api/register/', {**credentials, 'email': 'new@example.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post('/api/register/', {**credentials, 'email': 'new@example.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)  # The uniqueness check saw the new user
+
+        tokens = self.client.post('/api/token/', credentials, format='json')
+        self.assertEqual(tokens.status_code, status.HTTP_200_OK)
+        refreshed = self.client.post('/api/token/refresh/', {'refresh': tokens.data['refresh']}, format='json')
+        self.assertEqual(refreshed.status_code, status.HTTP_200_OK)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens.data['access']}")
+        self.assertEqual(self.client.get('/api/holds/').status_code, status.HTTP_200_OK)
+
+    def test_checkout_pins_the_client_to_the_primary(self):
+        self.client.force_authenticate(self.patron.user)
+        response = self.client.post('/api/books/checkout/', {'book_id': self.book.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(ReplicaReadsMiddleware.PIN_COOKIE, response.cookies)
+
+        # The cookie comes back with the next request, to whichever worker serves it
+        self.assertEqual(self.client.get(f'/api/books/{self.book.pk}/').data['copies_available'], 1)
+
+        other = APIClient(HTTP_HOST='localhost')
+        other.force_authenticate(self.patron.user)
+        with self.assertRaises(ConnectionDoesNotExist):
+            other.get(f'/api/books/{self.book.pk}/')
+
+    def test_listing_read_from_a_replica_is_not_cached(self):
+        self.client.force_authenticate(self.patron.user)
+        with mock.patch.object(replica_health, 'pick', return_value=DEFAULT_DB_ALIAS):  # A replica mirroring the primary
+            hits = available_cache.stats()['hits']
+            for _ in range(2):
+                response = self.client.get('/api/books/available/')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertNotIn('ETag', response)
+        self.assertEqual(available_cache.stats()['hits'], hits)
+
+
+@override_settings(REPLICA_MAX_LAG_SECONDS=10)
+class ReplicaHealthTests(TestCase):
+    def _pick_with_lag(self, seconds):
+        # 'default' stands in for the replica's connection; the newest changes are made up
+        health = ReplicaHealth()
+        now = timezone.now()
+        with mock.patch.object(health, '_newest_change', side_effect=[now, now - timedelta(seconds=seconds)]):
+            return health, health.pick([DEFAULT_DB_ALIAS])
+
+    def test_replica_within_the_lag_limit_is_used(self):
+        health, picked = self._pick_with_lag(3)
+        self.assertEqual(picked, DEFAULT_DB_ALIAS)
+        self.assertEqual(health.lag[DEFAULT_DB_ALIAS], 3)
+
+    def test_lagging_replica_is_skipped(self):
+        health, picked = self._pick_with_lag(60)
+        self.assertIsNone(picked)
+        self.assertEqual(health.lagging[DEFAULT_DB_ALIAS], 1)
+        self.assertIsNone(health.pick([DEFAULT_DB_ALIAS]))  # Still skipped until REPLICA_RETRY_SECONDS pass
+
+
+@override_settings(OPENAPI_SCHEMA_PATH=None)
+class SchemaTests(TestCase):
+    def setUp(self):
+        schema_cache.clear()
+        self.addCleanup(schema_cache.clear)
+
+    def test_schema_is_generated_once_for_json_and_ui_pages(self):
+        with mock.patch.object(OpenAPISchemaGenerator, 'get_schema', autospec=True, side_effect=OpenAPISchemaGenerator.get_schema) as get_schema:
+            response = self.client.get('/openapi.json', HTTP_HOST='localhost')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response['ETag']
+            for path in ('/swagger/', '/redoc/', '/swagger/', '/redoc/'):
+                page = self.client.get(path, HTTP_HOST='localhost')
+                self.assertEqual(page.status_code, status.HTTP_200_OK)
+                self.assertContains(page, "Library Management API")
+            revalidated = self.client.get('/openapi.json', HTTP_HOST='localhost', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(revalidated.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(get_schema.call_count, 1)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=1, SERVER_THREADS=2)
+class HashingPoolTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        User.objects.create_user('reader', password='correct horse', is_staff=True)
+        self.client = APIClient(HTTP_HOST='localhost')
+
+    def test_capacity_stays_below_the_server_threads(self):
+        self.assertEqual(hashing_pool.capacity(), 1)  # One of the two threads stays free
+        with self.settings(SERVER_THREADS=16):
+            self.assertEqual(hashing_pool.capacity(), 2)  # Workers plus queue
+
+    def test_full_pool_answers_503_with_retry_after(self):
+        started, release = threading.Event(), threading.Event()
+
+        def occupy():
+            started.set()
+            release.wait(10)
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            busy = pool.submit(hashing_pool.run, occupy)
+            started.wait(10)
+            try:
+                responses = [
+                    self.client.post('/api/token/', {'username': 'reader', 'password': 'correct horse'}, format='json'),
+                    self.client.post('/api/register/', {'username': 'newcomer', 'password': 'correct horse'}, format='json'),
+                ]
+                for response in responses:
+                    self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+                    self.assertEqual(response['Retry-After'], '1')
+                    self.assertEqual(response.data['detail'].code, 'hashing_busy')
+                admin = self.client.post('/admin/login/', {'username': 'reader', 'password': 'correct horse'})
+                self.assertEqual(admin.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+                self.assertEqual(admin['Retry-After'], '1')
+            finally:
+                release.set()
+            busy.result()
+
+        response = self.client.post('/api/token/', {'username': 'reader', 'password': 'correct horse'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('reader')
+        self.book = make_book(5)
+        self.client = APIClient(HTTP_HOST='localhost')
+        rates = {**SlidingWindowThrottle.THROTTLE_RATES, 'login': '2/min', 'checkout': '2/min'}
+        patcher = mock.patch.object(SlidingWindowThrottle, 'THROTTLE_RATES', rates)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def at(self, seconds):
+        return mock.patch.object(SlidingWindowThrottle, 'timer', return_value=seconds)
+
+    def login(self):
+        return self.client.post('/api/token/', {'username': 'reader', 'password': 'wrong'}, format='json')
+
+    def test_login_budget_is_shared_and_answers_429_with_retry_after(self):
+        with self.at(600.0):  # Start of a window
+            self.assertEqual(self.login().status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(self.login().status_code, status.HTTP_401_UNAUTHORIZED)
+            clear_caches()  # The counts live in the database, not in this worker
+            response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '60')
+        # The refused request was not counted
+        self.assertEqual(ThrottleWindow.objects.get().hits, 2)
+
+    def test_previous_window_counts_by_its_overlap(self):
+        self.client.force_authenticate(self.patron.user)
+
+        def checkout():
+            return self.client.post('/api/books/checkout/', {'book_id': self.book.pk}, format='json')
+
+        with self.at(600.0):
+            for _ in range(2):
+                self.assertNotEqual(checkout().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(checkout().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        with self.at(690.0):  # Halfway through the next window: the previous one weighs 1
+            self.assertNotEqual(checkout().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            response = checkout()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+
+    @override_settings(DB_LATENCY_SHED_MS=100)
+    def test_slow_database_sheds_throttled_endpoints_with_503(self):
+        self.client.force_authenticate(self.patron.user)
+        with mock.patch.multiple(db_latency, average_ms=500.0, updated=time.perf_counter()):
+            response = self.client.post('/api/books/checkout/', {'book_id': self.book.pk}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '2')
+            self.assertEqual(self.client.get('/api/books/').status_code, status.HTTP_200_OK)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 5)
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('reader')
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.patron.user)
+        self.start = timezone.now() - timedelta(days=10)
+        self.loans = []
+        for day in range(3):
+            book = make_book(1, isbn=f'TEST00000000{day}')
+            circulation.checkout_book(self.patron, book.pk)
+            loan = Transaction.objects.get(book=book)
+            Transaction.objects.filter(pk=loan.pk).update(checkout_date=self.start + timedelta(days=day))
+            self.loans.append(loan.pk)
+        circulation.checkout_book(make_patron('other'), make_book(1, isbn='TEST000000009').pk)
+
+    def _ids(self, response):
+        return [loan['id'] for loan in response.data['results']]
+
+    def test_history_lists_own_loans_newest_first_in_pages(self):
+        first = self.client.get('/api/transactions/', {'page_size': 2})
+        self.assertEqual(self._ids(first), self.loans[:0:-1])
+
+        second = self.client.get(first.data['next'])
+        self.assertEqual(self._ids(second), self.loans[:1])
+        self.assertIsNone(second.data['next'])
+
+        other = Transaction.objects.exclude(user=self.patron).get()
+        self.assertEqual(self.client.get(f'/api/transactions/{other.pk}/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_history_filters_on_checkout_date(self):
+        since = (self.start + timedelta(days=1)).isoformat()
+        until = (self.start + timedelta(days=2)).isoformat()
+        self.assertEqual(self._ids(self.client.get('/api/transactions/', {'since': since})), self.loans[:0:-1])
+        self.assertEqual(self._ids(self.client.get('/api/transactions/', {'since': since, 'until': until})), self.loans[1:2])
+        self.assertEqual(self.client.get('/api/transactions/', {'since': 'yesterday'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_is_for_admins(self):
+        self.assertEqual(self.client.get('/api/transactions/export/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_streams_every_loan_as_csv_or_ndjson(self):
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+
+        response = self.client.get('/api/transactions/export/', {'until': (self.start + timedelta(days=2)).isoformat()})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,book_id,user_id,checkout_date,return_date')
+        self.assertEqual([int(line.split(',')[0]) for line in lines[1:]], self.loans[:2])
+
+        response = self.client.get('/api/transactions/export/', {'output': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 4)  # Every patron's loans
+        self.assertIsNone(rows[0]['return_date'])
+
+    def test_export_reads_in_keyset_batches(self):
+        batches = list(iter_batches(Transaction.objects.all(), fields=['id'], batch_size=3))
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+        self.assertEqual(batches[1][0][0], Transaction.objects.order_by('pk').last().pk)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.patron = make_patron('reader')
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.patron.user)
+        self.two_years_ago = timezone.now() - timedelta(days=730)
+        self.loans = []
+        # Old and returned, old and returned, old but still open, recent and returned
+        for index, (days_out, returned) in enumerate([(730, True), (729, True), (728, False), (1, True)]):
+            book = make_book(1, isbn=f'TEST00000000{index}')
+            circulation.checkout_book(self.patron, book.pk)
+            if returned:
+                circulation.return_book(self.patron, book.pk)
+            loan = Transaction.objects.get(book=book)
+            checkout = timezone.now() - timedelta(days=days_out)
+            Transaction.objects.filter(pk=loan.pk).update(
+                checkout_date=checkout, return_date=checkout + timedelta(days=7) if returned else None
+            )
+            self.loans.append(loan.pk)
+
+    def _run(self, *args):
+        out = io.StringIO()
+        call_command(*args, stdout=out)
+        return out.getvalue()
+
+    def test_only_old_returned_loans_move(self):
+        self.assertIn("2 loan(s)", self._run('archive_transactions', '--dry-run'))
+        self.assertIn("Archived 2 loan(s)", self._run('archive_transactions', '--batch-size', '1'))
+
+        self.assertEqual(sorted(ArchivedTransaction.objects.values_list('pk', flat=True)), self.loans[:2])
+        self.assertEqual(sorted(Transaction.objects.values_list('pk', flat=True)), self.loans[2:])
+        self.assertEqual(archive_returned_loans(), 0)  # Re-runs find nothing left to move
+
+    def test_history_reads_both_tables_as_one(self):
+        archive_returned_loans()
+
+        first = self.client.get('/api/transactions/', {'page_size': 3})
+        self.assertEqual([loan['id'] for loan in first.data['results']], self.loans[:0:-1])
+        second = self.client.get(first.data['next'])
+        self.assertEqual([loan['id'] for loan in second.data['results']], self.loans[:1])
+
+        archived = self.client.get(f'/api/transactions/{self.loans[0]}/')
+        self.assertEqual(archived.status_code, status.HTTP_200_OK)
+        self.assertEqual(archived.data['book'], Book.objects.get(isbn='TEST000000000').pk)
+
+        since = (self.two_years_ago + timedelta(hours=12)).isoformat()
+        filtered = self.client.get('/api/transactions/', {'since': since, 'until': (timezone.now() - timedelta(days=7)).isoformat()})
+        self.assertEqual([loan['id'] for loan in filtered.data['results']], self.loans[2:0:-1])
+
+        self.assertEqual(list(LoanHistory().order_by('pk').values_list('pk', flat=True)), self.loans)
+
+    def test_archived_loans_still_count_towards_circulation(self):
+        archive_returned_loans()
+        output = self._run('reconcile_counters', '--dry-run')
+        self.assertIn("Book.times_circulated: 0 row(s) drifted", output)
+        self.assertIn("LibraryUser.open_loans: 0 row(s) drifted", output)
+
+
+class RefreshTokenTests(TestCase):
+    credentials = {'username': 'reader', 'password': 'correct horse'}
+
+    def setUp(self):
+        clear_caches()
+        User.objects.create_user(**self.credentials)
+        self.client = APIClient(HTTP_HOST='localhost')
+
+    def _refresh(self, token):
+        return self.client.post('/api/token/refresh/', {'refresh': token}, format='json')
+
+    def test_login_records_nothing(self):
+        response = self.client.post('/api/token/', self.credentials, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(RevokedToken.objects.exists())
+        self.assertFalse(OutstandingToken.objects.exists())
+
+    def test_rotation_revokes_the_presented_token(self):
+        issued = self.client.post('/api/token/', self.credentials, format='json').data['refresh']
+        jti = tokens.RefreshToken(issued)['jti']
+
+        rotated = self._refresh(issued)
+        self.assertEqual(rotated.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(rotated.data['refresh'], issued)
+        self.assertEqual(RevokedToken.objects.get().jti, jti)
+
+        self.assertEqual(self._refresh(issued).status_code, status.HTTP_401_UNAUTHORIZED)  # Replayed
+        self.assertEqual(self._refresh(rotated.data['refresh']).status_code, status.HTTP_200_OK)
+        self.assertFalse(TokenVerifySerializer(data={'token': issued}).is_valid())
+        with self.assertRaises(TokenError):
+            tokens.RefreshToken(issued)
+
+    def test_a_token_can_be_revoked_only_once(self):
+        token = tokens.RefreshToken.for_user(User.objects.get())
+        token.blacklist()
+        with self.assertRaises(TokenError):
+            token.blacklist()  # The loser of two racing rotations
+        self.assertEqual(RevokedToken.objects.count(), 1)
+
+    def test_prune_drops_only_expired_revocations(self):
+        now = timezone.now()
+        RevokedToken.objects.create(jti='expired', expires_at=now - timedelta(days=1))
+        RevokedToken.objects.create(jti='live', expires_at=now + timedelta(hours=1))
+        out = io.StringIO()
+        call_command('prune_tokens', '--batch-size', '1', stdout=out)
+        self.assertIn("Pruned 1 revoked", out.getvalue())
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['live'])
+
+
+@override_settings(FEED_COALESCE_SECONDS=0.05, FEED_POLL_SECONDS=60)
+class AvailabilityFeedTests(TransactionTestCase):
+    # The feed reader drops connections not in autocommit, which would end a TestCase transaction
+    def setUp(self):
+        clear_caches()
+        self.books = [make_book(3, isbn=f'TEST00000000{i}') for i in range(2)]
+        self.ids = [book.pk for book in self.books]
+
+    async def _close(self, subscription):
+        availability_feed.unsubscribe(subscription)
+        task = availability_feed._task
+        if task is not None:
+            availability_feed._wake.set()  # The reader stops once nobody watches
+            await task
+
+    async def _set_copies(self, book_id, copies):
+        await Book.objects.filter(pk=book_id).aupdate(copies_available=copies)
+
+    async def test_burst_of_changes_is_one_read_and_one_event_per_book(self):
+        subscription = await availability_feed.subscribe(self.ids)
+        try:
+            self.assertEqual(await subscription.next(1), {self.ids[0]: 3, self.ids[1]: 3})
+
+            await self._set_copies(self.ids[0], 0)
+            await self._set_copies(self.ids[1], 2)
+            reads = availability_feed.reads
+            for book_id in (self.ids[0], self.ids[0], self.ids[1], self.ids[0]):  # As commits land
+                availability_feed.publish([book_id])
+
+            self.assertEqual(await subscription.next(1), {self.ids[0]: 0, self.ids[1]: 2})
+            self.assertEqual(availability_feed.reads, reads + 1)
+        finally:
+            await self._close(subscription)
+
+    async def test_unchanged_counts_are_not_pushed(self):
+        subscription = await availability_feed.subscribe(self.ids[:1])
+        try:
+            await subscription.next(1)
+            availability_feed.publish(self.ids)  # The unwatched book is ignored
+            self.assertEqual(await subscription.next(0.2), {})
+        finally:
+            await self._close(subscription)
+        self.assertEqual(availability_feed.stats()['watched_books'], 0)
+
+    async def test_slow_client_keeps_only_the_latest_count(self):
+        subscription = Subscription(self.ids)
+        for copies in range(100):
+            subscription.push(self.ids[0], copies)
+        self.assertEqual(await subscription.next(1), {self.ids[0]: 99})
+        self.assertEqual(subscription.pending, {})
+
+    def test_committed_changes_reach_the_feed(self):
+        patron = make_patron('reader')
+        with mock.patch.object(availability_feed, 'publish') as publish:
+            circulation.checkout_book(patron, self.ids[0])
+        publish.assert_called_once_with([self.ids[0]])
+
+    async def test_feed_needs_asgi_and_book_ids(self):
+        user = await User.objects.acreate(username='reader')
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+        wsgi = await sync_to_async(self.client.get)('/api/async/books/feed/', {'books': '1'}, headers=headers)
+        self.assertEqual(wsgi.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+        for books in ('', 'one', ','.join(map(str, range(1, 102)))):
+            response = await self.async_client.get('/api/async/books/feed/', {'books': books}, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
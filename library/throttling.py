@@ -0,0 +1,192 @@
+"""
+Per-endpoint rate limits and load shedding.
+
+``SlidingWindowThrottle`` limits views that set ``throttle_scope`` (checkout,
+returns, holds, login, token refresh, registration) using
+``DEFAULT_THROTTLE_RATES``. It keys each budget on the user, or on the
+client IP for anonymous requests. A rate of ``'30/min'`` counts requests in
+one-minute windows and weighs the previous window by how much of it still
+overlaps the last minute, so the limit holds across window boundaries.
+
+Each check is one atomic increment (``add`` + ``incr``) and one read of
+both windows. For the scopes in ``THROTTLE_SHARED_SCOPES`` (login and
+registration, where the budget slows password guessing) the counters are
+``ThrottleWindow`` rows, so every worker counts against one budget. The other scopes count in the
+``THROTTLE_CACHE`` cache, per worker unless that points at a shared backend.
+Requests over budget get 429 with Retry-After.
+
+``db_latency`` keeps a moving average of query time on the primary. It is
+fed by an execute wrapper that ``library.signals`` installs on every
+``default`` connection. Each worker keeps its own average, but they all
+sample the same database, so they shed together. While the average is above
+``DB_LATENCY_SHED_MS``, throttled endpoints answer 503 with Retry-After
+before touching the database. Catalogue reads (unthrottled, mostly served
+from cache) keep working.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import ScopedRateThrottle
+
+from . import metrics
+from .models import ThrottleWindow
+
+
+class Overloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The service is overloaded; try again shortly."
+    default_code = 'overloaded'
+    wait = 2  # Sent as Retry-After by DRF's exception handler
+
+
+class DBLatency:
+    """Exponentially weighted moving average of query time, in milliseconds."""
+
+    alpha = 0.05
+    # Only recent samples count: when everything is shed, nothing refreshes the average
+    window_seconds = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.average_ms = 0.0
+        self.samples = 0
+        self.updated = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            now = time.perf_counter()
+            threshold = getattr(settings, 'DB_LATENCY_SHED_MS', None) or 1000
+            # Clamped, so one long export query cannot tip the average on its own
+            sample = min((now - start) * 1000, 2 * threshold)
+            with self._lock:  # Request threads share the average
+                self.average_ms += self.alpha * (sample - self.average_ms)
+                self.samples += 1
+                self.updated = now
+
+    def overloaded(self):
+        threshold = getattr(settings, 'DB_LATENCY_SHED_MS', None)
+        return (
+            threshold is not None
+            and self.average_ms > threshold
+            and time.perf_counter() - self.updated < self.window_seconds
+        )
+
+
+db_latency = DBLatency()
+
+
+class CacheCounters:
+    """Window counters in the ``THROTTLE_CACHE`` cache; atomic on LocMem, Redis and Memcached."""
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+
+    def hit(self, key, timeout):
+        self.cache.add(key, 0, timeout)
+        try:
+            self.cache.incr(key)
+        except ValueError:  # Lapsed between add and incr
+            self.cache.add(key, 1, timeout)
+
+    def counts(self, keys):
+        return self.cache.get_many(keys)
+
+    def undo(self, key):
+        try:
+            self.cache.decr(key)
+        except ValueError:
+            pass
+
+
+class DatabaseCounters:
+    """Window counters in ``ThrottleWindow`` rows, shared by every worker."""
+
+    def hit(self, key, timeout):
+        if ThrottleWindow.objects.filter(key=key).update(hits=F('hits') + 1):
+            return
+        now = timezone.now()
+        ThrottleWindow.objects.filter(expires_at__lt=now).delete()  # Once per client and window
+        try:
+            with transaction.atomic():
+                ThrottleWindow.objects.create(key=key, hits=1, expires_at=now + timedelta(seconds=timeout))
+        except IntegrityError:  # Another worker opened the window first
+            ThrottleWindow.objects.filter(key=key).update(hits=F('hits') + 1)
+
+    def counts(self, keys):
+        return dict(ThrottleWindow.objects.filter(key__in=keys).values_list('key', 'hits'))
+
+    def undo(self, key):
+        ThrottleWindow.objects.filter(key=key).update(hits=F('hits') - 1)
+
+
+cache_counters = CacheCounters()
+database_counters = DatabaseCounters()
+
+
+class SlidingWindowThrottle(ScopedRateThrottle):
+    cache_format = 'throttle_%(scope)s_%(ident)s'
+    throttled = Counter()
+    shed = Counter()
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+        if db_latency.overloaded():
+            self.shed[self.scope] += 1
+            raise Overloaded()
+
+        self.rate = self.get_rate()
+        if self.rate is None:
+            return True  # Scope configured as unlimited
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        key = self.get_cache_key(request, view)
+        counters = database_counters if self.scope in getattr(settings, 'THROTTLE_SHARED_SCOPES', ()) else cache_counters
+
+        now = self.timer()
+        window, elapsed = divmod(now, self.duration)
+        current_key, previous_key = f'{key}_{int(window)}', f'{key}_{int(window) - 1}'
+        # Kept for two windows: the next one still weighs this one
+        counters.hit(current_key, 2 * self.duration)
+        counts = counters.counts([current_key, previous_key])
+        current, previous = counts.get(current_key, 0), counts.get(previous_key, 0)
+        overlap = 1 - elapsed / self.duration  # Share of the previous window still within the rate's span
+        if previous * overlap + current <= self.num_requests:
+            return True
+
+        counters.undo(current_key)  # A refused request does not use up budget
+        self.throttled[self.scope] += 1
+        # Until enough of the previous window slides out, capped at this window's end (a
+        # lower bound when this window alone is full)
+        excess = previous * overlap + current - self.num_requests
+        self.wait_seconds = min(excess / previous * self.duration, self.duration - elapsed) if previous else self.duration - elapsed
+        return False
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def stats():
+    return {
+        'db_latency_ms': round(db_latency.average_ms, 3),
+        'db_latency_samples': db_latency.samples,
+        'shedding': db_latency.overloaded(),
+        'throttled': dict(SlidingWindowThrottle.throttled),
+        'shed': dict(SlidingWindowThrottle.shed),
+    }
+
+
+metrics.register('throttling', stats)
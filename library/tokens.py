@@ -0,0 +1,61 @@
+"""
+Refresh-token revocation in one compact table.
+
+simplejwt's blacklist app records every issued refresh token, with its full
+text, in ``OutstandingToken``. A rotation then costs a blacklist join, two
+``get_or_create`` calls and up to two inserts. Here nothing is recorded at
+issue time. A rotated-out token's jti goes into ``RevokedToken`` together
+with its expiry. Claiming the jti is a single primary-key INSERT, which both
+checks and revokes: if two requests race to rotate the same token, exactly
+one insert succeeds. Rows are only useful until the token expires, and
+``manage.py prune_tokens`` deletes them after that, so the table holds one
+refresh lifetime of rotations at most.
+
+``SIMPLE_JWT`` points the obtain, refresh and verify serializers at
+``library.serializers``, which use the token class below.
+"""
+from django.db import IntegrityError, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken as BaseRefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .models import RevokedToken
+
+
+def is_revoked(jti):
+    return RevokedToken.objects.filter(jti=jti).exists()
+
+
+def revoke(jti, exp):
+    """Record ``jti`` as revoked until ``exp``; TokenError if it already was."""
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=jti, expires_at=datetime_from_epoch(exp))
+    except IntegrityError:
+        raise TokenError(_("Token is blacklisted"))
+
+
+class RefreshToken(BaseRefreshToken):
+    """A refresh token checked against, and revoked into, ``RevokedToken``."""
+
+    # Set while the token is being rotated: blacklist() then does the check
+    claim_on_blacklist = False
+
+    def check_blacklist(self):
+        if not self.claim_on_blacklist and is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        revoke(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+
+    @classmethod
+    def for_user(cls, user):
+        # Skip BlacklistMixin.for_user: issued tokens are not recorded
+        return super(BlacklistMixin, cls).for_user(user)
+
+
+class RotatingRefreshToken(RefreshToken):
+    """A refresh token presented for rotation. Its revocation insert is the only lookup."""
+    claim_on_blacklist = True
@@ -3,19 +3,27 @@ from rest_framework.routers import DefaultRouter
 from .views import BookViewSet, UserViewSet
 # from .views import BookViewSet, UserViewSet, TransactionViewSet
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView  # Import token views
-from .views import BookViewSet, UserViewSet
-# from .views import BookViewSet, UserViewSet, TransactionViewSet
+from . import async_views
+from .views import BookViewSet, UserViewSet, UserCreateView, MetricsView, TransactionViewSet, HoldViewSet, LoginView, RefreshView
 
 router = DefaultRouter()
 router.register(r'books', BookViewSet)
 router.register(r'users', UserViewSet)
-# router.register(r'transactions', TransactionViewSet)
+router.register(r'transactions', TransactionViewSet)
+router.register(r'holds', HoldViewSet)
 
 
 urlpatterns = [
     path('', include(router.urls)),  # Include the router URLs
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),  # Adjusted path
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),  # Adjusted path
+    path('register/', UserCreateView.as_view(), name='register'),  # Open self-registration
+    path('token/', LoginView.as_view(), name='token_obtain_pair'),  # Rate limited per client IP
+    path('token/refresh/', RefreshView.as_view(), name='token_refresh'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),  # Admin-only in-process counters
+    # Async-native catalogue reads for ASGI deployments
+    path('async/books/available/', async_views.available, name='async-book-available'),
+    path('async/books/search/', async_views.search, name='async-book-search'),
+    path('async/books/<int:pk>/', async_views.book_detail, name='async-book-detail'),
+    path('async/books/feed/', async_views.feed, name='async-book-feed'),  # SSE; copies_available changes
 ]
 
 
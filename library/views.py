@@ -1,54 +1,191 @@
 from django.shortcuts import render
 from rest_framework import viewsets
-from .models import Book, User, Transaction
-from .serializers import BookSerializer, UserSerializer, TransactionSerializer, CheckoutSerializer, ReturnBookSerializer
+from .models import Book, User, Transaction, Hold, normalize_isbn
+from .serializers import BookSerializer, book_values_fields, UserSerializer, TransactionSerializer, CheckoutSerializer, ReturnBookSerializer, BookSearchSerializer, BookPopularSerializer, BookImportSerializer, BookBatchSerializer, TransactionFilterSerializer, TransactionExportSerializer, HoldSerializer, HoldCreateSerializer
 from django.urls import path, include 
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView  # Import token views
-from rest_framework.permissions import IsAuthenticated 
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action
 from rest_framework.response import Response  # Import Response for custom actions
 from rest_framework import status  # Import status for response status codes
-from django.utils import timezone  # Import timezone for setting the return date
 from rest_framework import generics
+from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
+from rest_framework.negotiation import BaseContentNegotiation
+from django.http import StreamingHttpResponse
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from rest_framework.exceptions import APIException, PermissionDenied
 from rest_framework.permissions import AllowAny
+from . import circulation, holds, routers
+from .circulation import CirculationError
+from .search import book_index
+from .cache import available_cache, catalogue_versions
+from . import conditional
+from .importer import BookImporter, read_rows
+from .export import csv_lines, ndjson_lines
+from .hashing import HashingBusy
+from .pagination import HistoryPagination
+from .archive import LoanHistory
+from . import metrics
 
 # Import Swagger tools for manual parameter specification
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+fields_parameter = openapi.Parameter('fields', openapi.IN_QUERY, description="Comma-separated fields to return, e.g. id,title,copies_available (id is always included)", type=openapi.TYPE_STRING)
+
+
 class BookViewSet(viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = None  # Set per action on circulation endpoints
+
+    def _book_rows(self, request, books, fields):
+        # Plain .values() rows, rendered as-is: no model instances or per-field serializer calls
+        page = self.paginate_queryset(books.values(*fields))
+        return self.get_paginated_response(page)
+
+    @swagger_auto_schema(manual_parameters=[fields_parameter])
+    def list(self, request, *args, **kwargs):
+        fields = book_values_fields(request.query_params.get('fields'))
+        # Answer polling clients with 304 before reading any books
+        etag, last_modified = conditional.catalogue_validators(request, self.paginator.position(request))
+        unchanged = conditional.not_modified(request, etag, last_modified)
+        if unchanged is not None:
+            return unchanged
+        response = self._book_rows(request, self.filter_queryset(self.get_queryset()), fields)
+        return conditional.set_validators(response, etag, last_modified)
 
+    def retrieve(self, request, *args, **kwargs):
+        book = self.get_object()
+        etag, last_modified = conditional.book_validators(book)
+        unchanged = conditional.not_modified(request, etag, last_modified)
+        if unchanged is not None:
+            return unchanged  # Skips BookSerializer
+        return conditional.set_validators(Response(self.get_serializer(book).data), etag, last_modified)
+
+    def perform_update(self, serializer):
+        # Write only the fields the client sent. A full save would put back the
+        # counters read by get_object() and undo checkouts, returns and holds
+        # that committed since (they move them with F() updates).
+        book = serializer.instance
+        for name, value in serializer.validated_data.items():
+            setattr(book, name, value)
+        book.version = F('version')  # Book.save adds the bump; the database applies it to the current value
+        book.save(update_fields=[*serializer.validated_data, 'version', 'updated_at'])
+        book.refresh_from_db(fields=['copies_available', 'version', 'holds_waiting', 'times_circulated'])
 
     # Define query parameters for Swagger documentation
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter('title', openapi.IN_QUERY, description="Filter by title (case-insensitive partial match)", type=openapi.TYPE_STRING),
             openapi.Parameter('author', openapi.IN_QUERY, description="Filter by author (case-insensitive partial match)", type=openapi.TYPE_STRING),
-            openapi.Parameter('isbn', openapi.IN_QUERY, description="Filter by exact ISBN", type=openapi.TYPE_STRING)
+            openapi.Parameter('isbn', openapi.IN_QUERY, description="Filter by exact ISBN", type=openapi.TYPE_STRING),
+            fields_parameter,
         ]
     )
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def available(self, request):
-        available_books = self.queryset.filter(copies_available__gt=0)
+        fields = book_values_fields(request.query_params.get('fields'))
+        after = self.paginator.position(request)  # None for previous links, which are not cached
+        etag, last_modified = conditional.catalogue_validators(request, after)
+        unchanged = conditional.not_modified(request, etag, last_modified)
+        if unchanged is not None:
+            return unchanged
 
         # Optional query filters: title, author, isbn
         title = request.query_params.get('title', None)
         author = request.query_params.get('author', None)
         isbn = request.query_params.get('isbn', None)
 
+        # Serve a cached page for the same normalized filters while none of the books it covers changed
+        cache_key = available_cache.key(request, {
+            'title': (title or '').lower(),
+            'author': (author or '').lower(),
+            'isbn': normalize_isbn(isbn or ''),
+            'cursor': request.query_params.get(self.paginator.cursor_query_param),
+            'page_size': self.paginator.get_page_size(request),
+            'fields': fields,
+        })
+        if after is not None:
+            cached = available_cache.get(cache_key, after)
+            if cached is not None:
+                return conditional.set_validators(Response(cached[0]), etag, last_modified)
+            versions = catalogue_versions.snapshot(after)  # Before the page, so a write during the read reads as a change
+
+        available_books = self.queryset.filter(copies_available__gt=0)
         if title:
             available_books = available_books.filter(title__icontains=title)  # Case-insensitive partial match
         if author:
             available_books = available_books.filter(author__icontains=author)  # Case-insensitive partial match
         if isbn:
-            available_books = available_books.filter(isbn__iexact=isbn)  # Exact match
+            available_books = available_books.filter(isbn=normalize_isbn(isbn))  # Exact match on the unique index
 
-        serializer = self.get_serializer(available_books, many=True)
-        return Response(serializer.data)
+        response = self._book_rows(request, available_books, fields)
+        if routers.used_replica():
+            return response  # A lagging replica's rows must not be cached or tagged with the primary's validators
+        if after is not None:
+            # A page with a next link covers ids up to its last book; the last page covers the rest
+            results = response.data['results']
+            through = results[-1]['id'] if response.data['next'] and results else None
+            available_cache.set(cache_key, response.data, catalogue_versions.narrow(versions, through), through)
+        return conditional.set_validators(response, etag, last_modified)
     
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Number of titles (1-100, default 20)", type=openapi.TYPE_INTEGER),
+            fields_parameter,
+        ]
+    )
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated], pagination_class=None)  # Top-N, not paged
+    def popular(self, request):
+        serializer = BookPopularSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        fields = book_values_fields(request.query_params.get('fields'))
+
+        # Most circulated first, read off the times_circulated index
+        books = self.queryset.order_by('-times_circulated', 'id')[:serializer.validated_data['limit']]
+        return Response(list(books.values(*fields)))
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, description="Search words matched against title and author (prefix and typo tolerant)", type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Maximum number of results (1-100, default 20)", type=openapi.TYPE_INTEGER)
+        ]
+    )
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated], pagination_class=None)  # Top-N, not paged
+    def search(self, request):
+        serializer = BookSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        # Rank in the in-process index, then load only the top hits
+        book_index.ensure_fresh()
+        hits = book_index.search(serializer.validated_data['q'], serializer.validated_data['limit'])
+        books = Book.objects.in_bulk([book_id for book_id, _ in hits])
+        results = [books[book_id] for book_id, _ in hits if book_id in books]
+        return Response(self.get_serializer(results, many=True).data)
+
+    @swagger_auto_schema(
+        method='post',
+        manual_parameters=[
+            openapi.Parameter('file', openapi.IN_FORM, description="CSV or JSONL with isbn, title, author, published_date, copies_available (used for new books only)", type=openapi.TYPE_FILE, required=True),
+            openapi.Parameter('format', openapi.IN_FORM, description="'csv' or 'jsonl'", type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('skip', openapi.IN_FORM, description="Rows to skip, to resume from a previous report's rows_done", type=openapi.TYPE_INTEGER)
+        ]
+    )
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated], parser_classes=[MultiPartParser], url_path='import')
+    def bulk_import(self, request):
+        serializer = BookImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # Upsert on ISBN in batches; bad rows are reported, not fatal
+        upload = serializer.validated_data['file']
+        rows = read_rows(upload.file, serializer.validated_data['format'])
+        report = BookImporter().run(rows, skip=serializer.validated_data['skip'])
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
     @swagger_auto_schema(
         method='post',
         request_body=openapi.Schema(
@@ -59,31 +196,19 @@ class BookViewSet(viewsets.ModelViewSet):
             required=['book_id']
         )
     )
-    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated], throttle_scope='checkout')
     def checkout(self, request):
         serializer = CheckoutSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         book_id = serializer.validated_data['book_id']
 
-        try:
-            book = Book.objects.get(pk=book_id)  # Retrieve the book based on the ID
-        except Book.DoesNotExist:
-            return Response({"message": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
-
         user = request.user.libraryuser  # Assuming the user is linked to LibraryUser via OneToOneField
 
-        # Check if the user has already checked out this book
-        if Transaction.objects.filter(user=user, book=book, return_date__isnull=True).exists():
-            return Response({"message": "You have already checked out this book."}, status=status.HTTP_400_BAD_REQUEST)
-
-        if book.copies_available > 0:
-            # Decrease available copies and create a transaction
-            book.copies_available -= 1
-            book.save()
-            Transaction.objects.create(user=user, book=book)
-            return Response({"message": "Book checked out successfully!"}, status=status.HTTP_200_OK)
-        else:
-            return Response({"message": "No copies available."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            circulation.checkout_book(user, book_id)
+        except CirculationError as exc:
+            return Response({"message": exc.message}, status=exc.status_code)
+        return Response({"message": "Book checked out successfully!"}, status=status.HTTP_200_OK)
 
 
     @swagger_auto_schema(
@@ -96,38 +221,80 @@ class BookViewSet(viewsets.ModelViewSet):
             required=['book_id']
         )
     )
-    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated], throttle_scope='return')
     def return_book(self, request):
         # Validate the incoming request data
         serializer = ReturnBookSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         book_id = serializer.validated_data['book_id']
 
-        # Try to retrieve the book by ID
-        try:
-            book = Book.objects.get(pk=book_id)
-        except Book.DoesNotExist:
-            return Response({"message": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
-
         user = request.user.libraryuser  # Assuming the user is linked to LibraryUser via OneToOneField
 
-        # Check if the user has checked out the book and not yet returned it
+        # Close the open loan and restock the copy in one transaction
         try:
-            transaction = Transaction.objects.get(user=user, book=book, return_date__isnull=True)
-            transaction.return_date = timezone.now()
-            transaction.save()
+            circulation.return_book(user, book_id)
+        except CirculationError as exc:
+            return Response({"message": exc.message}, status=exc.status_code)
+        return Response({"message": "Book returned successfully!"}, status=status.HTTP_200_OK)
 
-            # Increase the number of available copies
-            book.copies_available += 1
-            book.save()
 
-            return Response({"message": "Book returned successfully!"}, status=status.HTTP_200_OK)
-        except Transaction.DoesNotExist:
-            return Response({"message": "You have not checked out this book."}, status=status.HTTP_400_BAD_REQUEST)
+    @swagger_auto_schema(
+        method='post',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'book_ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER), description='IDs of the books to check out (up to 100)'),
+            },
+            required=['book_ids']
+        )
+    )
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated], throttle_scope='checkout', url_path='checkout/batch')
+    def checkout_batch(self, request):
+        serializer = BookBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
+        # One transaction for the whole stack; each book gets its own result
+        results = circulation.checkout_books(request.user.libraryuser, serializer.validated_data['book_ids'])
+        return Response({"results": results}, status=status.HTTP_200_OK)
 
+    @swagger_auto_schema(
+        method='post',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'book_ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER), description='IDs of the books to return (up to 100)'),
+            },
+            required=['book_ids']
+        )
+    )
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated], throttle_scope='return', url_path='return/batch')
+    def return_batch(self, request):
+        serializer = BookBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = circulation.return_books(request.user.libraryuser, serializer.validated_data['book_ids'])
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class SignInBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = HashingBusy.message
+    default_code = 'hashing_busy'
+    wait = HashingBusy.wait  # Sent as Retry-After by DRF's exception handler
 
-class UserCreateView(generics.CreateAPIView):
+
+class HashingBusyMixin:
+    """Answers a full password hashing pool (library.hashing) with 503 instead of a server error."""
+
+    def handle_exception(self, exc):
+        if isinstance(exc, HashingBusy):
+            exc = SignInBusy()
+        return super().handle_exception(exc)
+
+
+class UserCreateView(HashingBusyMixin, generics.CreateAPIView):
+    throttle_scope = 'register'
+    primary_reads = True  # The username check must see every user (see library.routers)
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = (AllowAny,)
@@ -146,3 +313,134 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
 
+
+class LoginView(HashingBusyMixin, TokenObtainPairView):
+    throttle_scope = 'login'  # Per client IP: slows password guessing
+    primary_reads = True  # A replica may not have a just-registered user yet
+
+
+class RefreshView(TokenRefreshView):
+    throttle_scope = 'token_refresh'
+    primary_reads = True
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """For views that build their own HttpResponse whatever the Accept header says."""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
+    """Loan history of the requesting user, newest first, archived loans included."""
+    queryset = Transaction.objects.all()
+    serializer_class = TransactionSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = HistoryPagination
+
+    def filter_dates(self, queryset, filters):
+        # Both bounds use the checkout_date index
+        if 'since' in filters:
+            queryset = queryset.filter(checkout_date__gte=filters['since'])
+        if 'until' in filters:
+            queryset = queryset.filter(checkout_date__lt=filters['until'])
+        return queryset
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Transaction.objects.none()  # Schema generation has no user
+        queryset = LoanHistory().filter(user__user=self.request.user)
+        if self.action == 'list':
+            filters = TransactionFilterSerializer(data=self.request.query_params)
+            filters.is_valid(raise_exception=True)
+            queryset = self.filter_dates(queryset, filters.validated_data)
+        return queryset
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('since', openapi.IN_QUERY, description="Only loans checked out at or after this date/time (ISO 8601)", type=openapi.TYPE_STRING),
+            openapi.Parameter('until', openapi.IN_QUERY, description="Only loans checked out before this date/time (ISO 8601)", type=openapi.TYPE_STRING)
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('output', openapi.IN_QUERY, description="'csv' (default) or 'ndjson'", type=openapi.TYPE_STRING),
+            openapi.Parameter('since', openapi.IN_QUERY, description="Only loans checked out at or after this date/time (ISO 8601)", type=openapi.TYPE_STRING),
+            openapi.Parameter('until', openapi.IN_QUERY, description="Only loans checked out before this date/time (ISO 8601)", type=openapi.TYPE_STRING)
+        ]
+    )
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser], pagination_class=None,
+            content_negotiation_class=IgnoreClientContentNegotiation)
+    def export(self, request):
+        filters = TransactionExportSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+
+        # All users' loans, streamed in keyset batches so memory stays flat
+        queryset = self.filter_dates(LoanHistory(), filters.validated_data)
+        if filters.validated_data['output'] == 'ndjson':
+            response = StreamingHttpResponse(ndjson_lines(queryset), content_type='application/x-ndjson')
+            response['Content-Disposition'] = 'attachment; filename="transactions.ndjson"'
+        else:
+            response = StreamingHttpResponse(csv_lines(queryset), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="transactions.csv"'
+        return response
+
+
+class HoldViewSet(viewsets.ReadOnlyModelViewSet):
+    """The requesting user's holds, newest first. POST places a hold, DELETE cancels it."""
+    queryset = Hold.objects.all()
+    serializer_class = HoldSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = HistoryPagination
+    lookup_value_regex = r'\d+'  # Other ids 404 at the router instead of reaching cancel_hold
+
+    @property
+    def throttle_scope(self):
+        # Placing and cancelling are rate limited; listing is not
+        return 'holds' if self.action in ('create', 'destroy') else None
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Hold.objects.none()  # Schema generation has no user
+        # Waiting holds ahead in the same queue, counted on the queue index
+        ahead = Hold.objects.filter(book=OuterRef('book'), status=Hold.WAITING).filter(
+            Q(priority__gt=OuterRef('priority')) | Q(priority=OuterRef('priority'), id__lt=OuterRef('id'))
+        ).order_by().values('book').annotate(count=Count('id')).values('count')
+        return super().get_queryset().filter(user__user=self.request.user).annotate(
+            position=Coalesce(Subquery(ahead), Value(0)) + 1
+        )
+
+    @swagger_auto_schema(request_body=HoldCreateSerializer, responses={201: HoldSerializer})
+    def create(self, request):
+        serializer = HoldCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        priority = serializer.validated_data['priority']
+        if priority and not request.user.is_staff:
+            raise PermissionDenied("Only staff can set hold priority.")
+
+        try:
+            hold = holds.place_hold(request.user.libraryuser, serializer.validated_data['book_id'], priority)
+        except CirculationError as exc:
+            return Response({"message": exc.message}, status=exc.status_code)
+        return Response(self.get_serializer(self.get_queryset().get(pk=hold.pk)).data, status=status.HTTP_201_CREATED)
+
+    def destroy(self, request, pk=None):
+        try:
+            holds.cancel_hold(request.user.libraryuser, pk)
+        except CirculationError as exc:
+            return Response({"message": exc.message}, status=exc.status_code)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class MetricsView(APIView):
+    """In-process counters (caches, profiling, ...) of the worker serving the request."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot())
@@ -3,14 +3,20 @@ ASGI config for library_management_system project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Static files are served by ``ASGIStaticFilesHandler`` rather than WhiteNoise,
+which is sync-only and would put every request behind a thread (see
+``MIDDLEWARE`` in settings). Only static file requests leave the event loop.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
 import os
 
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "library_management_system.settings")
+os.environ["DJANGO_ASGI"] = "1"  # Read by settings: leaves WhiteNoise out of MIDDLEWARE
 
-application = get_asgi_application()
+application = ASGIStaticFilesHandler(get_asgi_application())
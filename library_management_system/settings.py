@@ -12,6 +12,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -41,20 +42,49 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "rest_framework",  # Add Django REST Framework
-    "rest_framework_simplejwt.token_blacklist",
+    "rest_framework_simplejwt.token_blacklist",  # Legacy tables, drained by prune_tokens (see library.tokens)
     "drf_yasg",
     'corsheaders',
     "library",  # Add your library app
 
 ]
 
+# API-only workers can leave out the admin and the docs (Swagger UI, ReDoc,
+# /openapi.json) with LIBRARY_SERVE_ADMIN=0 / LIBRARY_SERVE_DOCS=0; route
+# /admin/, /swagger/, /redoc/ and /openapi.json to a worker with the defaults.
+# manage.py bench_startup measures the difference.
+SERVE_ADMIN = os.environ.get("LIBRARY_SERVE_ADMIN", "1") != "0"
+SERVE_DOCS = os.environ.get("LIBRARY_SERVE_DOCS", "1") != "0"
+if not SERVE_ADMIN:
+    INSTALLED_APPS.remove("django.contrib.admin")
+if not SERVE_DOCS:
+    INSTALLED_APPS.remove("drf_yasg")
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWTAuthentication with the user and profile resolved from a short-TTL cache
+        'library.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',  # Optional, change based on your needs
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'library.renderers.FastJSONRenderer',  # orjson; same output as the stock JSONRenderer
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Keyset pagination for every list endpoint; clients may pass ?page_size= (capped at 500)
+    'DEFAULT_PAGINATION_CLASS': 'library.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    # Sliding-window limits for views with a throttle_scope, per user (or IP when anonymous)
+    'DEFAULT_THROTTLE_CLASSES': ('library.throttling.SlidingWindowThrottle',),
+    'DEFAULT_THROTTLE_RATES': {
+        'checkout': '30/min',
+        'return': '60/min',
+        'holds': '20/min',
+        'login': '20/min',
+        'token_refresh': '30/min',
+        'register': '60/min',  # Per IP; campus NAT puts many students behind one address
+    },
 }
 
 
@@ -68,10 +98,17 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # Rotated-out refresh tokens go to library.RevokedToken, not the token_blacklist tables
+    'TOKEN_OBTAIN_SERIALIZER': 'library.serializers.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'library.serializers.TokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'library.serializers.TokenVerifySerializer',
     # Add other configurations here if necessary
 }
 
 MIDDLEWARE = [
+    "library.middleware.RequestProfilingMiddleware",  # Outermost, so it times the whole stack
+    "library.middleware.ReplicaReadsMiddleware",  # Lets request reads use DATABASE_REPLICAS
+    "library.middleware.HashingBusyMiddleware",  # 503 when the password hashing pool is full
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -80,8 +117,19 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
 ]
+# WhiteNoise serves static files in WSGI workers. It is sync-only, so in an ASGI
+# worker Django would adapt the whole chain to sync and every request, async views
+# included, would run on a thread. asgi.py sets DJANGO_ASGI=1 and serves static
+# files with ASGIStaticFilesHandler instead; every middleware above is async-capable.
+if os.environ.get('DJANGO_ASGI') != '1':
+    MIDDLEWARE.append("whitenoise.middleware.WhiteNoiseMiddleware")
+
+# Fraction of requests profiled (queries, DB time, render time, latency); 0 disables it.
+# Results are served per worker at /api/metrics/ under "requests".
+PROFILING_SAMPLE_RATE = 0.0
+# Repeats of one query shape within a request that flag it as a likely N+1
+PROFILING_N_PLUS_ONE_THRESHOLD = 5
 
 ROOT_URLCONF = "library_management_system.urls"
 
@@ -115,6 +163,65 @@ DATABASES = {
     }
 }
 
+# Read replicas: add their aliases to DATABASES and list them here. Book and
+# User reads made while serving requests then go to a healthy replica.
+DATABASE_ROUTERS = ['library.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_STICKY_SECONDS = 5  # After a checkout or return, the client reads from the primary this long (signed cookie)
+REPLICA_RETRY_SECONDS = 30  # A replica that failed to connect is skipped this long
+# A replica whose newest catalogue change trails the primary's by more than this is
+# skipped like a failed one; checked per worker every REPLICA_LAG_CHECK_SECONDS
+REPLICA_MAX_LAG_SECONDS = 10
+REPLICA_LAG_CHECK_SECONDS = 5
+
+# Caches. "available" holds rendered /api/books/available/ pages; point it at
+# django.core.cache.backends.filebased.FileBasedCache or
+# django.core.cache.backends.redis.RedisCache to change the backend.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'available': {
+        'BACKEND': 'library.cache.CountingLocMemCache',  # LRU bounded by MAX_ENTRIES
+        'LOCATION': 'available',  # Its own store: default's culls must not evict cached pages
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # Rate-limit counters of the scopes not in THROTTLE_SHARED_SCOPES (library.throttling);
+    # per worker unless pointed at a shared backend
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+THROTTLE_CACHE = 'throttle'
+# Scopes counted in the database (ThrottleWindow), so one budget holds across every worker:
+# the ones that slow password guessing and account farming
+THROTTLE_SHARED_SCOPES = ('login', 'register')
+
+# Throttled endpoints answer 503 while the primary's average query time is above this; None disables it
+DB_LATENCY_SHED_MS = 250
+
+# Seconds before the in-process search index (library.search) is rebuilt in the
+# background, so books written by other workers become searchable
+SEARCH_INDEX_MAX_AGE = 300
+
+AVAILABLE_CACHE_ALIAS = 'available'
+AVAILABLE_CACHE_TIMEOUT = 300  # Seconds; a page is also dropped once a book in its id span changes
+
+# Open loans a patron may hold at once (checkout, batch checkout, placing holds); None for no limit
+LIBRARY_MAX_OPEN_LOANS = None
+
+# Days a waiting hold stays queued before the sweep_holds command expires it
+HOLD_EXPIRY_DAYS = 30
+
+# Returned loans older than this many days move to the archive table (archive_transactions command)
+TRANSACTION_ARCHIVE_AFTER_DAYS = 365
+
+# Seconds an authenticated user (with profile) stays cached per worker, and the cache bound
+AUTH_PRINCIPAL_CACHE_TTL = 30
+AUTH_PRINCIPAL_CACHE_SIZE = 10000
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Bearer': {
@@ -125,7 +232,15 @@ SWAGGER_SETTINGS = {
         }
     },
     'USE_SESSION_AUTH': False,  # This disables the default session-based auth in Swagger UI
+    'SPEC_URL': 'schema-json',  # Serve the cached schema instead of regenerating it per request
 }
+REDOC_SETTINGS = {
+    'SPEC_URL': 'schema-json',
+}
+
+# Build-time schema written by "manage.py generate_openapi"; used when it
+# matches the current URL conf, otherwise the schema is generated on first use
+OPENAPI_SCHEMA_PATH = BASE_DIR / 'openapi.json'
 
 CORS_ALLOW_ALL_ORIGINS = True
 
@@ -148,6 +263,35 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing runs on a bounded per-process pool (library.hashing). The
+# first hasher hashes new passwords; the others only verify older hashes.
+PASSWORD_HASHERS = [
+    "library.hashing.PooledPBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+# PBKDF2 iterations; None keeps Django's default. Passwords are rehashed on their next login.
+PASSWORD_HASH_ITERATIONS = None
+# Hashing threads per process, and hashes that may wait for one before logins
+# and registrations get 503 + Retry-After. 0 workers hashes inline. Each hash in
+# flight holds a request thread, so the total stays below SERVER_THREADS.
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_QUEUE = 1
+# Request threads per worker process, as set in the WSGI server (e.g. gunicorn --threads)
+SERVER_THREADS = int(os.environ.get("LIBRARY_SERVER_THREADS", "4"))
+
+
+# Availability feed (/api/async/books/feed/, ASGI only): books per connection, the
+# pause that folds a burst of changes into one event, how often other workers'
+# writes are picked up, and the idle keepalive interval (seconds)
+FEED_MAX_BOOKS = 100
+FEED_COALESCE_SECONDS = 0.25
+FEED_POLL_SECONDS = 5
+FEED_KEEPALIVE_SECONDS = 15
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -0,0 +1,22 @@
+"""
+Settings for running the project locally against SQLite.
+
+Used by the test suite and the stress and benchmark management commands, e.g.
+
+    python manage.py test --settings=library_management_system.settings_local
+    python manage.py stress_checkout --settings=library_management_system.settings_local
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+        # Writers queue on the database lock instead of failing under load
+        "OPTIONS": {"timeout": 30, "transaction_mode": "IMMEDIATE"},
+        # A file rather than shared-cache memory, so threaded tests queue on
+        # the lock (and its timeout) instead of failing with "table is locked"
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+    }
+}
@@ -0,0 +1,21 @@
+"""
+Local settings with a stand-in read replica: two SQLite files.
+
+SQLite does not replicate, so copy the primary to refresh the "replica":
+
+    cp db.sqlite3 db-replica.sqlite3
+    python manage.py runserver --settings=library_management_system.settings_replica
+
+Writes made afterwards only reach db.sqlite3, which makes replica lag and
+read-your-writes pinning easy to observe.
+"""
+
+from .settings_local import *  # noqa: F401,F403
+
+DATABASES["replica"] = {
+    "ENGINE": "django.db.backends.sqlite3",
+    "NAME": BASE_DIR / "db-replica.sqlite3",
+    "OPTIONS": {"timeout": 30},
+    "TEST": {"MIRROR": "default"},
+}
+DATABASE_REPLICAS = ["replica"]
@@ -14,40 +14,33 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import path, include  
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Library Management API",
-        default_version='v1',
-        description="API documentation for the Library Management System",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="contact@library.local"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from library.views import LoginView, RefreshView
 
 
 
 
 urlpatterns = [
-    path("admin/", admin.site.urls),
     path('api/', include('library.urls')),  # Include library URLs
 
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-
-    
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('api/token/', LoginView.as_view(), name='token_obtain_pair'),
+    path('api/token/refresh/', RefreshView.as_view(), name='token_refresh'),
 
 ]
+
+# Imported only on workers that serve them (SERVE_ADMIN / SERVE_DOCS)
+if settings.SERVE_ADMIN:
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path("admin/", admin.site.urls))
+
+if settings.SERVE_DOCS:
+    from library.schema import SchemaUIView, openapi_json
+
+    urlpatterns += [
+        # The UI pages load the pre-generated schema from openapi.json (SPEC_URL)
+        path('openapi.json', openapi_json, name='schema-json'),
+        path('swagger/', SchemaUIView.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+        path('redoc/', SchemaUIView.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    ]